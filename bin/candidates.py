@@ -45,19 +45,32 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
+import array
+import bisect
 import collections
+import cPickle
+import functools
+import heapq
+import itertools
+import multiprocessing
 import re
 import os
+import sys
+import tempfile
 
-from libs.base.__common import WILDCARD
+from libs.base.__common import WILDCARD, SEPARATOR, WORD_SEPARATOR
 from libs.base.frequency import Frequency
 from libs.base.candidate import CandidateFactory
 from libs.base.ngram import Ngram
+from libs.base.ngram_sketch import NgramSketch
 from libs.util import read_options, treat_options_simplest, error, verbose,\
     interpret_ngram, warn
-from libs.filetype.patternlib import build_generic_pattern
-#from libs.filetype.indexlib import Index
+from libs.filetype.patternlib import build_generic_pattern, PatternSet
+from libs.filetype.indexlib import Index, index_basepath, CONTAINER_EXT, \
+    CONTAINER_MAGIC, SymbolTable
 from libs.base.meta import Meta
+from libs.base.sentence import Sentence, SentenceFactory
+from libs.base.word import Word, WORD_ATTRIBUTES
 from libs import filetype
 
 
@@ -137,9 +150,50 @@ OPTIONS may be:
     The syntax is `ID_A:w1,w2,w3...wN;ID_B:w1,w2...;ID_K:w1,w2...`.
     Example: "158:48,49;455:8,9".
 
+--sketch <megabytes>
+    Count candidates approximately, in a count-min sketch that takes at most
+    <megabytes> of memory, whatever the size of the corpus, and output only
+    the most frequent ones (see --sketch-freq), with their estimated
+    frequency (never below the exact one). Occurrences are not output. The
+    error bound is printed in verbose mode. Useful with -n on large corpora.
+
+--sketch-freq <n>
+    With --sketch, output the candidates whose estimated frequency is at
+    least <n>. Default 2.
+
+--sketch-error <epsilon>
+    With --sketch, size the sketch so that estimated frequencies exceed
+    the exact ones by at most <epsilon> times the number of counted
+    candidates (with probability 0.99). By default, the bound follows from
+    the memory given to --sketch.
+
+--exact
+    With --sketch, read the corpus a second time to extract the candidates
+    kept by the sketch as usual, with their occurrences and exact counts.
+
+--max-memory <megabytes>
+    Keep about <megabytes> of candidates in memory at most: beyond that,
+    they are sorted and written to temporary files, which are merged at
+    the end. Candidates are then output sorted by their words, and their
+    occurrences by corpus and words, instead of in the order in which they
+    are found. Useful on corpora too large for their candidates to fit in
+    memory.
+
+--jobs <n>
+    Match the patterns in <n> worker processes. Sentences are sent to the
+    workers in chunks (from a BinaryIndex, with -n or with patterns that
+    match fixed sequences of words, the workers read ranges of the index
+    instead), and the candidates found in each chunk are added
+    in the original order, so that the output is the same as with a single
+    process. With --sketch, the sketch itself is still counted in the main
+    process. Default 1.
+
 {common_options}
 """
 patterns = []
+pattern_set = None  # PatternSet(patterns)
+window_ngrams = False  # Extract -n ngrams without patterns (see ngram_windows)
+index_patterns = False  # Match patterns in the suffix arrays of a BinaryIndex
 ignore_pos = False
 match_distance = "All"
 non_overlapping = False
@@ -149,15 +203,50 @@ longest_pattern = 0
 shortest_pattern = float("inf")
 print_source = False
 id_order = ["*"]
+sketch = None  # NgramSketch()
+sketch_size = None
+sketch_error = None
+sketch_min_freq = 2
+exact_recount = False
+max_memory = None
+jobs = 1
+current_index_matches = None  # Matches in a BinaryIndex, for the workers
+heavy_hitters = None  # set of candidates kept by the sketch, with --exact
+word_symbols = SymbolTable()  # Strings of the words of candidates (see intern_word)
 
 input_filetype_ext = None
 output_filetype_ext = "XML"
 
+# Number of words that the mask of a source can represent (see add_source)
+MAX_MASK_BITS = array.array(b"l").itemsize * 8 - 1
+# Approximate memory taken by a candidate, an occurrence form and a source
+# in CandidatesGeneratorHandler (see --max-memory)
+CANDIDATE_ENTRY_SIZE = 150
+OCCUR_ENTRY_SIZE = 300
+SOURCE_ENTRY_SIZE = 3 * array.array(b"l").itemsize
+# Number of sentences sent at once to a worker process (--jobs)
+JOBS_CHUNK_SIZE = 256
+# Number of words of a BinaryIndex read at once by a worker process (--jobs).
+# The environment variable MWETOOLKIT_JOBS_INDEX_CHUNK_SIZE replaces it, e.g.
+# to test the splitting of small indexes into several ranges.
+JOBS_INDEX_CHUNK_SIZE = int(os.environ.get("MWETOOLKIT_JOBS_INDEX_CHUNK_SIZE",
+                                           1 << 16))
+
 
 ################################################################################
        
 class CandidatesGeneratorHandler(filetype.ChainedInputHandler):
-    r"""An InputHandler that generates Candidates."""
+    r"""An InputHandler that generates Candidates.
+
+    Candidates and their occurrences are kept as tuples of numbers in
+    `word_symbols`, and the occurrences of each form as an array of
+    `(sentence id, first word, mask of the words)` triples (see
+    `add_source`). Strings are only built in `print_candidates`.
+
+    With --max-memory, the candidates are written to a temporary file (a
+    run, sorted by candidate) whenever they take more than `max_memory`,
+    and the runs are merged in `print_candidates`.
+    """
     
     def before_file(self, fileobj, info={}):
         if not self.chain:
@@ -165,11 +254,34 @@ class CandidatesGeneratorHandler(filetype.ChainedInputHandler):
             self.chain = filetype.printer_class(ext)("candidates")
             self.chain.handle_meta(Meta(None,None,None), info)
             self.candidate_factory = CandidateFactory()
-            self.all_entities = collections.OrderedDict()
+            self.corpus_names = []
+            self.runs = []  # temporary files (see `spill`)
+            self.parallel_extractor = None  # ParallelExtractor (--jobs)
+            self.clear_candidates()
+        elif self.parallel_extractor is not None:
+            self.parallel_extractor.collect_all()
 
         self.chain.before_file(fileobj, info)
-        self.current_corpus_name = re.sub(".*/", "",
-                re.sub("\.(xml|info)", "", fileobj.name))
+        self.current_corpus_name = corpus_name(fileobj)
+        if self.current_corpus_name not in self.corpus_names:
+            self.corpus_names.append(self.current_corpus_name)
+        self.corpus_number = self.corpus_names.index(self.current_corpus_name)
+        self.occur_numbers = {}  # tuple of real words -> occurrence number
+
+
+    def clear_candidates(self):
+        """Forgets the candidates kept in memory."""
+        self.ngram_numbers = {}  # tuple of base words -> candidate number
+        self.ngrams = []  # candidate number -> tuple of base words
+        # For each occurrence form (a tuple of real words in a file):
+        self.occur_words = []  # tuple of real words
+        self.occur_ngram = array.array(b"l")  # candidate number
+        self.occur_corpus = array.array(b"l")  # index in `corpus_names`
+        self.occur_freq = array.array(b"l")
+        self.occur_sources = []  # array of sources (with --source)
+        self.odd_sources = []  # strings of the sources without a mask
+        self.occur_numbers = {}
+        self.memory = 0  # approximate size of the above, in bytes
 
 
     def handle_sentence(self, sentence, info={}):
@@ -179,51 +291,162 @@ class CandidatesGeneratorHandler(filetype.ChainedInputHandler):
         
         @param sentence A `Sentence` that is being read from the XML file.    
         """
-        global patterns, ignore_pos, surface_instead_lemmas, \
-               longest_pattern, shortest_pattern
+        if jobs > 1:
+            self.get_parallel_extractor().add(sentence)
+        else:
+            self.handle_matches(sentence_matches(sentence))
 
-        already_matched = set()
 
-        for pattern in patterns:
-            for (match_ngram, wordnums) in pattern.matches(sentence,
-                    match_distance=match_distance, id_order=id_order,
-                    overlapping=not non_overlapping):
-                wordnums_string = ",".join(unicode(wn+1) for wn in wordnums)
-                if wordnums_string in already_matched:
+    def get_parallel_extractor(self):
+        """Returns the ParallelExtractor of --jobs, created on first use."""
+        if self.parallel_extractor is None:
+            # Forked only now, so that workers inherit the options
+            self.parallel_extractor = ParallelExtractor(jobs,
+                                                        self.add_partial)
+        return self.parallel_extractor
+
+
+    def handle_matches(self, matches):
+        """Adds the candidate occurrences in `matches`, an iterable of
+        `(ngram, occur, sentence_id, wordnums)` tuples (see
+        `sentence_matches`), to the candidates of the current corpus."""
+        occur_numbers = self.occur_numbers
+        for (ngram, occur, sentence_id, wordnums) in matches:
+            occur_number = occur_numbers.get(occur)
+            if occur_number is None:
+                occur_number = self.add_occur(ngram, occur)
+                if occur_number is None:
+                    continue
+            self.occur_freq[occur_number] += 1
+            if print_source:
+                add_source(self.occur_sources[occur_number],
+                           self.odd_sources, sentence_id, wordnums)
+                self.memory += SOURCE_ENTRY_SIZE
+            if max_memory is not None and self.memory > max_memory:
+                self.spill()
+                occur_numbers = self.occur_numbers
+
+
+    def add_occur(self, ngram, occur):
+        """Adds the occurrence form `occur` of the candidate `ngram` to the
+        current corpus, and returns its number (or None if the candidate is
+        not kept by --sketch)."""
+        if heavy_hitters is not None and ngram not in heavy_hitters:
+            return None
+        ngram_number = self.ngram_numbers.setdefault(ngram, len(self.ngrams))
+        if ngram_number == len(self.ngrams):
+            self.ngrams.append(ngram)
+            self.memory += CANDIDATE_ENTRY_SIZE
+        occur_number = self.occur_numbers[occur] = len(self.occur_words)
+        self.occur_words.append(occur)
+        self.occur_ngram.append(ngram_number)
+        self.occur_corpus.append(self.corpus_number)
+        self.occur_freq.append(0)
+        if print_source:
+            self.occur_sources.append(array.array(b"l"))
+        self.memory += OCCUR_ENTRY_SIZE
+        return occur_number
+
+
+    def add_partial(self, partial):
+        """Adds the candidate occurrences of a chunk of the current corpus,
+        as aggregated by a worker process (see `aggregate_matches`)."""
+        (forms, odd_sources) = partial
+        intern = word_symbols.intern
+        for (ngram, occur, freq, sources) in forms:
+            ngram = tuple(map(intern, ngram))
+            occur = tuple(map(intern, occur))
+            occur_number = self.occur_numbers.get(occur)
+            if occur_number is None:
+                occur_number = self.add_occur(ngram, occur)
+                if occur_number is None:
                     continue
-                already_matched.add( wordnums_string )
-
-                if ignore_pos :    
-                    match_ngram.set_all( pos=WILDCARD )
-                ngram_real = unicode(match_ngram.to_string())
-
-                if( surface_instead_lemmas ) :
-                    match_ngram.set_all( lemma=WILDCARD )
-                else :
-                    for word in match_ngram:
-                        # (Still uses surface if lemma is unavailable)
-                        if word.lemma != WILDCARD:
-                            word.surface = WILDCARD
-
-                ngram_basestring = unicode(match_ngram.to_string())
-                info_for_ngram_basestring = self.all_entities.setdefault(ngram_basestring, {})
-                (surfaces_dict, total_freq) = info_for_ngram_basestring \
-                        .get(self.current_corpus_name, ({}, 0))
-                freq_surface = surfaces_dict.setdefault(ngram_real, [])
-
-                # Append the id of the source sentence. The number of items in
-                # surfaces_dict[form] is the number of occurrences of that form.
-                source_sent_id = str( sentence.id_number ) + ":" + wordnums_string
-                surfaces_dict[ ngram_real ].append( source_sent_id )
-                info_for_ngram_basestring[self.current_corpus_name] \
-                        = (surfaces_dict, total_freq + 1)
+            self.occur_freq[occur_number] += freq
+            if print_source:
+                for i in xrange(1, len(sources), 3):
+                    if sources[i] == -1:  # see `add_source`
+                        self.odd_sources.append(odd_sources[sources[i + 1]])
+                        sources[i + 1] = len(self.odd_sources) - 1
+                self.occur_sources[occur_number].extend(sources)
+                self.memory += SOURCE_ENTRY_SIZE * (len(sources) // 3)
+            if max_memory is not None and self.memory > max_memory:
+                self.spill()
+
+
+    def source_strings(self, sources):
+        """Returns the strings of the sources in the array `sources`, such
+        as "3:1,2,4" (see `add_source`)."""
+        strings = []
+        for i in xrange(0, len(sources), 3):
+            (sentence_id, first, mask) = sources[i:i+3]
+            if first == -1:
+                strings.append(self.odd_sources[mask])
+            else:
+                strings.append(source_string(sentence_id, [first + bit
+                        for bit in xrange(mask.bit_length())
+                        if mask >> bit & 1]))
+        return strings
 
 
     def finish(self):
+        if self.parallel_extractor is not None:
+            self.parallel_extractor.finish()
         self.print_candidates(self.chain)
         self.chain.finish()
 
 
+    def grouped_occurrences(self):
+        """Returns the list of the occurrence forms in memory, sorted by
+        candidate number (and in the order they were found), and an array
+        with the position in this list of the first occurrence form of each
+        candidate (followed by the length of the list)."""
+        occur_order = sorted(xrange(len(self.occur_words)),
+                             key=self.occur_ngram.__getitem__)
+        firsts = array.array(b"l", [0]) * (len(self.ngrams) + 1)
+        for occur_number in occur_order:
+            firsts[self.occur_ngram[occur_number] + 1] += 1
+        for ngram_number in xrange(len(self.ngrams)):
+            firsts[ngram_number + 1] += firsts[ngram_number]
+        return (occur_order, firsts)
+
+
+    def occur_entry(self, occur_number):
+        """Returns the `(corpus number, occurrence string, frequency,
+        source strings)` tuple of an occurrence form in memory (without
+        --source, the source strings are None)."""
+        return (self.occur_corpus[occur_number],
+                symbols_to_string(self.occur_words[occur_number]),
+                self.occur_freq[occur_number],
+                self.source_strings(self.occur_sources[occur_number])
+                if print_source else None)
+
+
+    def sorted_records(self):
+        """Generates a `(candidate string, entries)` pair for each candidate
+        in memory, sorted by candidate string, where `entries` is the list of
+        the `occur_entry` tuples of its occurrence forms."""
+        (occur_order, firsts) = self.grouped_occurrences()
+        ngram_strings = map(symbols_to_string, self.ngrams)
+        for ngram_number in sorted(xrange(len(self.ngrams)),
+                                   key=ngram_strings.__getitem__):
+            yield (ngram_strings[ngram_number], [self.occur_entry(
+                    occur_order[i]) for i in xrange(firsts[ngram_number],
+                    firsts[ngram_number + 1])])
+
+
+    def spill(self):
+        """Writes the candidates in memory to a new run, and forgets them."""
+        run = tempfile.TemporaryFile(prefix="mwetk-candidates-")
+        n_candidates = len(self.ngrams)
+        for record in self.sorted_records():
+            cPickle.dump(record, run, cPickle.HIGHEST_PROTOCOL)
+        run.seek(0)
+        self.runs.append(run)
+        self.clear_candidates()
+        verbose("Wrote %d candidates to temporary file %d" % (n_candidates,
+                len(self.runs)))
+
+
     def print_candidates(self, chain):
         """Prints a XML file (mwetoolkit-candidates.dtd) from a temporary 
         candidates file generated by the treat_sentence callback function. 
@@ -237,26 +460,723 @@ class CandidatesGeneratorHandler(filetype.ChainedInputHandler):
         """
         global print_cand_freq, print_source
         verbose("Outputting candidates file...")
-        for ngram_basestring, info in self.all_entities.iteritems() :
-            cand = self.candidate_factory.make()
-            cand.from_string(ngram_basestring)
-            for corpus_name, (surface_dict, total_freq) in info.iteritems():
-                if print_cand_freq :
-                   freq = Frequency( corpus_name, total_freq )
-                   cand.add_frequency( freq )
-                for occur_string in surface_dict.keys() :
-                    occur_form = Ngram( None, None )
-                    occur_form.from_string(occur_string)
-                    sources = surface_dict[occur_string]
-                    freq_value = len(sources)
-                    freq = Frequency( corpus_name, freq_value )
-                    occur_form.add_frequency( freq )
+        if max_memory is not None:
+            self.print_merged_candidates(chain)
+            return
+        (occur_order, firsts) = self.grouped_occurrences()
+        for (ngram_number, ngram) in enumerate(self.ngrams):
+            # The occurrence forms of each corpus, in dicts keyed by their
+            # strings, iterated in the order of the dicts (the forms found in
+            # several files of the same corpus are merged)
+            info = {}
+            for i in xrange(firsts[ngram_number], firsts[ngram_number + 1]):
+                (corpus_number, occur_string, freq, sources) \
+                        = self.occur_entry(occur_order[i])
+                surface_dict = info.setdefault(
+                        self.corpus_names[corpus_number], {})
+                if occur_string in surface_dict:
+                    (other_freq, other_sources) = surface_dict[occur_string]
+                    freq += other_freq
                     if print_source:
-                        occur_form.add_sources(sources)
-                    cand.add_occur( occur_form )
-            chain.handle_candidate(cand, info)
+                        sources = other_sources + sources
+                surface_dict[occur_string] = (freq, sources)
+            self.print_candidate(chain, symbols_to_string(ngram),
+                    [(corpus_name, [(occur_string,) + surface_dict[occur_string]
+                                    for occur_string in surface_dict.keys()])
+                     for (corpus_name, surface_dict) in info.iteritems()])
+
+
+    def print_merged_candidates(self, chain):
+        """Prints the candidates of the runs and of the memory (with
+        --max-memory), merging them in a single pass (k-way merge): the
+        frequencies of an occurrence form found in several runs are summed,
+        and its sources concatenated."""
+        runs = [read_run(run) for run in self.runs] + [self.sorted_records()]
+        # (candidate string, number of the run, entries), sorted by
+        # candidate then run
+        records = heapq.merge(*[numbered_records(run, run_number)
+                                for (run_number, run) in enumerate(runs)])
+        for (ngram_string, group) in itertools.groupby(records,
+                lambda record: record[0]):
+            occurs = {}  # (corpus number, occurrence string) -> [freq, sources]
+            for (_, _, entries) in group:
+                for (corpus_number, occur_string, freq, sources) in entries:
+                    occur = occurs.get((corpus_number, occur_string))
+                    if occur is None:
+                        occurs[(corpus_number, occur_string)] = [freq, sources]
+                    else:
+                        occur[0] += freq
+                        if print_source:
+                            occur[1].extend(sources)
+            self.print_candidate(chain, ngram_string,
+                    [(self.corpus_names[corpus_number],
+                      [(occur_string, freq, sources) for ((_, occur_string),
+                       (freq, sources)) in corpus_occurs])
+                     for (corpus_number, corpus_occurs) in itertools.groupby(
+                     sorted(occurs.iteritems()), lambda item: item[0][0])])
+        for run in self.runs:
+            run.close()
+
+
+    def print_candidate(self, chain, ngram_string, corpora):
+        """Prints the candidate `ngram_string`, with the `(corpus name,
+        occurrences)` pairs of `corpora`, where `occurrences` is a list of
+        `(occurrence string, frequency, source strings)` tuples."""
+        if heavy_hitters is not None and sketch_min_freq > sum(freq
+                for (corpus_name, occurrences) in corpora
+                for (occur_string, freq, sources) in occurrences):
+            return  # Overestimated by the sketch (--exact)
+        cand = self.candidate_factory.make()
+        cand.from_string(ngram_string)
+        for corpus_name, occurrences in corpora:
+            if print_cand_freq :
+               total_freq = sum(freq for (occur_string, freq, sources)
+                                in occurrences)
+               freq = Frequency( corpus_name, total_freq )
+               cand.add_frequency( freq )
+            for (occur_string, freq_value, sources) in occurrences:
+                occur_form = Ngram( None, None )
+                occur_form.from_string(occur_string)
+                freq = Frequency( corpus_name, freq_value )
+                occur_form.add_frequency( freq )
+                if print_source:
+                    occur_form.add_sources(sources)
+                cand.add_occur( occur_form )
+        chain.handle_candidate(cand)
 
         
+################################################################################
+
+class ParallelExtractor(object):
+    r"""Extracts candidates in worker processes (option --jobs).
+
+    Sentences are buffered into chunks of `JOBS_CHUNK_SIZE` and sent to a
+    worker, which returns the candidates found in the chunk (see
+    `aggregate_matches`). Each sentence is sent as its id and the
+    attributes of its words, which are rebuilt by the worker (a `Sentence`
+    cannot be pickled, since its `FeatureSet`s hold functions). Workers are
+    forked from the main process, so they share the options and the
+    patterns. Chunks whose results are pending are kept in a FIFO (reorder
+    buffer), so that their candidates are passed to `output` in their
+    original order.
+    """
+    def __init__(self, n_jobs, output):
+        verbose("Extracting in %d worker processes" % n_jobs)
+        self.pool = multiprocessing.Pool(n_jobs)
+        self.output = output
+        self.max_pending = 2 * n_jobs
+        self.chunk = []  # list of (id_number, list of word attributes)
+        self.pending = collections.deque()  # of AsyncResult
+
+    def add(self, sentence):
+        self.chunk.append((sentence.id_number, [(word.surface, word.lemma,
+                word.pos, word.syn) for word in sentence]))
+        if len(self.chunk) >= JOBS_CHUNK_SIZE:
+            self.submit(extract_sentences, (self.chunk,))
+            self.chunk = []
+
+    def submit(self, function, args):
+        """Runs `function(*args)` in a worker, whose result is passed to
+        `output` after the results of the chunks submitted before."""
+        self.pending.append(self.pool.apply_async(function, args))
+        while len(self.pending) > self.max_pending:
+            self.output(self.pending.popleft().get())
+
+    def collect_all(self):
+        """Waits for all the chunks, and outputs their candidates."""
+        if self.chunk:
+            self.submit(extract_sentences, (self.chunk,))
+            self.chunk = []
+        while self.pending:
+            self.output(self.pending.popleft().get())
+
+    def finish(self):
+        self.collect_all()
+        self.pool.close()
+        self.pool.join()
+
+
+################################################################################
+
+def add_source(sources, odd_sources, sentence_id, wordnums):
+    """
+        Appends the occurrence of the words `wordnums` of the sentence
+        `sentence_id` to the array `sources`, as a `(sentence_id, first
+        word, mask)` triple, where the bit `i` of `mask` is set for the word
+        `first word + i`. Sources that cannot be represented this way (with
+        a sentence id that is not a number, words that are too far apart or
+        out of order) are appended to the list `odd_sources` as strings, and
+        represented by the triple `(0, -1, index in odd_sources)`.
+    """
+    first = wordnums[0]
+    mask = 0
+    for wordnum in wordnums:
+        if not 0 <= wordnum - first < MAX_MASK_BITS \
+                or mask >> (wordnum - first):
+            break
+        mask |= 1 << (wordnum - first)
+    else:
+        if type(sentence_id) is int:
+            sources.extend((sentence_id, first, mask))
+            return
+    sources.extend((0, -1, len(odd_sources)))
+    odd_sources.append(source_string(sentence_id, wordnums))
+
+
+def aggregate_matches(matches):
+    """
+        Returns the candidate occurrences in `matches` (see
+        `sentence_matches`), aggregated by occurrence form in the order in
+        which they are first found, as a `(forms, odd_sources)` pair, where
+        `forms` is a list of `(ngram, occur, freq, sources)` tuples. The
+        words of `ngram` and `occur` are strings, since the numbers of
+        `word_symbols` are not shared between processes, and `sources` (or
+        None without --source) is an array of `add_source`, whose odd
+        sources are in `odd_sources`.
+    """
+    occur_numbers = {}  # tuple of real words -> index in forms
+    forms = []  # [ngram, occur, freq, sources]
+    odd_sources = []
+    for (ngram, occur, sentence_id, wordnums) in matches:
+        occur_number = occur_numbers.get(occur)
+        if occur_number is None:
+            occur_number = occur_numbers[occur] = len(forms)
+            forms.append([ngram, occur, 0,
+                          array.array(b"l") if print_source else None])
+        form = forms[occur_number]
+        form[2] += 1
+        if print_source:
+            add_source(form[3], odd_sources, sentence_id, wordnums)
+    symbols = word_symbols.number_to_symbol
+    return ([(tuple(symbols[word] for word in ngram),
+              tuple(symbols[word] for word in occur), freq, sources)
+             for (ngram, occur, freq, sources) in forms], odd_sources)
+
+
+def extract_sentences(sentences):
+    """
+        Worker function for option --jobs. Returns the `aggregate_matches`
+        of a chunk of sentences, given as `(id_number, list of (surface,
+        lemma, pos, syn))` pairs.
+    """
+    return aggregate_matches(match for (id_number, words) in sentences
+            for match in sentence_matches(Sentence([Word(*attributes)
+                    for attributes in words], id_number)))
+
+
+def extract_index_range(start, end):
+    """
+        Worker function for option --jobs. Returns the `aggregate_matches`
+        of the sentences of the index being read that start between the
+        positions `start` and `end` (see `index_matches`), as generated by
+        `current_index_matches(start, end)`.
+    """
+    return aggregate_matches(current_index_matches(start, end))
+
+
+################################################################################
+
+def read_run(run):
+    """
+        Generates the `(candidate string, entries)` records written to the
+        temporary file `run` by `CandidatesGeneratorHandler.spill`.
+    """
+    while True:
+        try:
+            yield cPickle.load(run)
+        except EOFError:
+            return
+
+
+def numbered_records(records, run_number):
+    """
+        Generates the `(candidate string, run_number, entries)` tuples of
+        the `(candidate string, entries)` pairs of `records`.
+    """
+    for (ngram_string, entries) in records:
+        yield (ngram_string, run_number, entries)
+
+
+################################################################################
+
+class SketchHandler(filetype.InputHandler):
+    r"""An InputHandler that counts candidates in `sketch` (--sketch)."""
+
+    def before_file(self, fileobj, info={}):
+        self.current_corpus_name = corpus_name(fileobj)
+
+    def handle_sentence(self, sentence, info={}):
+        self.handle_matches(sentence_matches(sentence))
+
+    def handle_matches(self, matches):
+        for (ngram, occur, sentence_id, wordnums) in matches:
+            sketch.add(symbols_to_string(ngram))
+
+    def _fallback(self, obj, info):
+        pass
+
+
+################################################################################
+
+def sentence_matches(sentence):
+    """
+        Generates a `(ngram, occur, sentence_id, wordnums)` tuple for each
+        candidate that matches at least one pattern in the sentence, where
+        `ngram` is the tuple of the words of the candidate (e.g. its lemmas),
+        `occur` the tuple of the words of the occurrence (with surface
+        forms), both as numbers of `intern_word`, and `wordnums` the list of
+        the (0-based) numbers of the words of the occurrence.
+
+        @param sentence A `Sentence` that is being read from the XML file.
+    """
+    global pattern_set, ignore_pos, surface_instead_lemmas, \
+           longest_pattern, shortest_pattern
+
+    if window_ngrams:
+        for match in window_matches([intern_word(word.surface, word.lemma,
+                word.pos) for word in sentence], sentence.id_number):
+            yield match
+        return
+
+    already_matched = set()
+
+    for (pattern, match_ngram, wordnums) in pattern_set.matches(sentence,
+            match_distance=match_distance, id_order=id_order,
+            overlapping=not non_overlapping):
+        wordnums = tuple(wordnums)
+        if wordnums in already_matched:
+            continue
+        already_matched.add( wordnums )
+
+        words = [intern_word(word.surface, word.lemma, word.pos)
+                 for word in match_ngram]
+        yield (tuple(base for (base, real) in words),
+               tuple(real for (base, real) in words),
+               sentence.id_number, wordnums)
+
+
+################################################################################
+
+def intern_word(surface, lemma, pos):
+    """
+        Returns the numbers in `word_symbols` of the strings of a word in
+        a candidate and in its occurrences: the occurrences have all the
+        attributes (but the POS with -g), while candidates have the lemma,
+        or the surface form with -s or if the lemma is unavailable.
+    """
+    if ignore_pos:
+        pos = WILDCARD
+    real = SEPARATOR.join((surface, lemma, pos))
+    if surface_instead_lemmas:
+        base = SEPARATOR.join((surface, WILDCARD, pos))
+    elif lemma != WILDCARD:
+        base = SEPARATOR.join((WILDCARD, lemma, pos))
+    else:
+        base = real
+    return (word_symbols.intern(base), word_symbols.intern(real))
+
+
+def symbols_to_string(words):
+    """
+        Returns the string of the ngram `words`, a tuple of numbers of
+        `intern_word`, as built by `Ngram.to_string`.
+    """
+    return WORD_SEPARATOR.join(map(word_symbols.number_to_symbol.__getitem__,
+                                   words))
+
+
+def source_string(sentence_id, wordnums):
+    """
+        Returns the string of the source of an occurrence, such as "3:1,2,4"
+        for the (0-based) words 0, 1 and 3 of the sentence 3.
+    """
+    return unicode(sentence_id) + ":" + ",".join(unicode(wordnum + 1)
+                                                 for wordnum in wordnums)
+
+
+################################################################################
+
+def ngram_windows(n_words):
+    """
+        Generates the `(start, end)` word ranges of the ngrams extracted by
+        -n in a sentence of `n_words` words, in the order in which the
+        generic pattern of `build_generic_pattern` would match them.
+    """
+    i = 0
+    while n_words - i >= shortest_pattern:
+        longest = min(longest_pattern, n_words - i)
+        if match_distance == "All":
+            for end in xrange(i + longest, i + shortest_pattern - 1, -1):
+                yield (i, end)
+            i += 1
+        else:
+            length = longest if match_distance == "Longest" \
+                    else shortest_pattern
+            yield (i, i + length)
+            i += length if non_overlapping else 1
+
+
+################################################################################
+
+def window_matches(words, sentence_id):
+    """
+        Generates the tuples of `sentence_matches` for the ngrams extracted
+        by -n, sliding windows over the words instead of matching the generic
+        pattern.
+
+        @param words The `(base, real)` pairs of `intern_word` for each word
+        of the sentence.
+
+        @param sentence_id The `id_number` of the sentence.
+    """
+    bases = tuple(base for (base, real) in words)
+    reals = tuple(real for (base, real) in words)
+    for (start, end) in ngram_windows(len(words)):
+        yield (bases[start:end], reals[start:end], sentence_id,
+               xrange(start, end))
+
+
+################################################################################
+
+def sentence_ends(index):
+    """
+        Returns the sorted list of the positions of the ends of the
+        sentences (symbol 0) in the corpus of a `BinaryIndex`.
+    """
+    guide = index.arrays[index.used_word_attributes[0]].corpus
+    return [i for (i, symbol) in enumerate(guide) if symbol == 0]
+
+
+def index_matches(index, start=0, end=None, ends=None):
+    """
+        Generates the tuples of `window_matches` for the sentences of a
+        `BinaryIndex`, read from its arrays of symbols instead of building a
+        `Sentence` for each of them. Each distinct word (a tuple of symbols
+        of the index) is only interned once.
+
+        @param start, end Only read the sentences that start between these
+        positions of the corpus (by default, all of them).
+
+        @param ends The `sentence_ends` of the index, required if `start`
+        is not 0. They are computed once for all the ranges of --jobs, so
+        that a range is found without reading the corpus before it.
+    """
+    arrays = [index.arrays.get(attr) for attr in ("surface", "lemma", "pos")]
+    columns = [array.corpus for array in arrays if array is not None]
+    guide = index.arrays[index.used_word_attributes[0]].corpus
+    if end is None:
+        end = len(guide)
+    sentence_number = 0
+    if start > 0:
+        # Skip the sentence that starts before `start`, if any
+        sentence_number = bisect.bisect_left(ends, start - 1)
+        start = ends[sentence_number] + 1 \
+                if sentence_number < len(ends) else len(guide)
+        sentence_number = bisect.bisect_left(ends, start)
+    if start >= end:
+        return
+    word_cache = {}  # tuple of symbols -> intern_word
+    sentence_id = SentenceFactory.FIRST_ID + sentence_number
+    words = []
+    for i in xrange(start, len(guide)):
+        if guide[i] == 0:
+            for match in window_matches(words, sentence_id):
+                yield match
+            sentence_id += 1
+            words = []
+            if i + 1 >= end:
+                break
+            continue
+        key = tuple(column[i] for column in columns)
+        word = word_cache.get(key)
+        if word is None:
+            symbols = iter(key)
+            word = word_cache[key] = intern_word(*[
+                    array.symbols.number_to_symbol[next(symbols)]
+                    if array is not None else WILDCARD for array in arrays])
+        words.append(word)
+
+
+################################################################################
+
+class IndexPatternMatcher(object):
+    r"""Matches the patterns in the sentences of a `BinaryIndex` (if the
+    ids are not reordered by --id-order).
+
+    The patterns that match a fixed sequence of words (see
+    `ParsedPattern.word_sequence`) are not matched sentence by sentence:
+    the values of each attribute that their words accept are looked up in
+    the symbols of the index, and their positions in the whole corpus are
+    found from its suffix arrays (see `Index.sequence_positions`). Only
+    the words of their matches are read. The other patterns are matched
+    against the sentences, which are then rebuilt from the index.
+    """
+    def __init__(self, index):
+        self.index = index
+        self.arrays = [index.arrays.get(attr)
+                       for attr in ("surface", "lemma", "pos")]
+        self.columns = [array.corpus for array in self.arrays
+                        if array is not None]
+        self.ends = sentence_ends(index)
+        self.word_cache = {}  # tuple of symbols -> intern_word
+        self.symbol_sets = {}  # (predicate number, attr) -> see symbol_set
+        self.sequences = []  # (pattern number, length, sorted positions)
+        self.lengths = {}  # pattern number -> length of its sequence
+        self.pattern_numbers = {}  # id(pattern) -> number, for the others
+        other_patterns = []
+        for (number, pattern) in enumerate(pattern_set.patterns):
+            predicates = pattern.word_sequence()
+            if predicates is None:
+                self.pattern_numbers[id(pattern)] = number
+                other_patterns.append(pattern)
+                continue
+            constraints = []
+            for (offset, predicate) in enumerate(predicates):
+                for attr in predicate.attributes():
+                    symbols = self.symbol_set(predicate, attr)
+                    if symbols is not None:
+                        constraints.append((offset, attr, symbols))
+            self.lengths[number] = len(predicates)
+            self.sequences.append((number, len(predicates),
+                    index.sequence_positions(constraints, len(predicates))))
+        verbose("Matching %d patterns in the suffix arrays and %d in the "
+                "sentences" % (len(self.sequences), len(other_patterns)))
+        self.other_patterns = PatternSet(other_patterns) \
+                if other_patterns else None
+
+
+    def symbol_set(self, predicate, attr):
+        """
+            Returns the frozenset of the symbols of the index whose values
+            of `attr` pass the tests of `predicate`, or None if the index
+            lacks `attr` and its value in all the words, `WILDCARD`, passes
+            them.
+        """
+        key = (predicate.number, attr)
+        if key not in self.symbol_sets:
+            array = self.index.arrays.get(attr) \
+                    if attr in self.index.used_word_attributes else None
+            if array is None:
+                symbols = None if predicate.accepts(attr, WILDCARD) \
+                        else frozenset()
+            else:
+                values = array.symbols.number_to_symbol
+                literal = predicate.literal(attr) if attr != "syn" else None
+                if literal is not None:
+                    # Symbol 0 (the end of a sentence) is no word
+                    candidates = [array.symbols.symbol_to_number.get(literal,
+                                                                     0)]
+                else:
+                    candidates = xrange(1, len(values))
+                symbols = frozenset(number for number in candidates
+                                    if number and predicate.accepts(attr,
+                                                               values[number]))
+            self.symbol_sets[key] = symbols
+        return self.symbol_sets[key]
+
+
+    def word_at(self, position):
+        """Returns the `intern_word` of the word at `position`."""
+        key = tuple(column[position] for column in self.columns)
+        word = self.word_cache.get(key)
+        if word is None:
+            symbols = iter(key)
+            word = self.word_cache[key] = intern_word(*[
+                    array.symbols.number_to_symbol[next(symbols)]
+                    if array is not None else WILDCARD
+                    for array in self.arrays])
+        return word
+
+
+    def sentence_words(self, start, end):
+        """Returns the list of the `Word`s from `start` to `end`, as
+        `Index.iterate_sentences` builds them."""
+        arrays = [self.index.arrays[attr]
+                  if attr in self.index.used_word_attributes else None
+                  for attr in WORD_ATTRIBUTES]
+        return [Word(*[array.symbols.number_to_symbol[array.corpus[i]]
+                       if array is not None else WILDCARD
+                       for array in arrays])
+                for i in xrange(start, end)]
+
+
+    def sequence_starts(self, number, positions, start, end):
+        """Generates a `(sentence number, pattern number, position)` triple
+        for each of the `positions` of the pattern `number` between the
+        positions `start` and `end`."""
+        first = bisect.bisect_left(positions, start)
+        last = bisect.bisect_left(positions, end)
+        sentence_number = bisect.bisect_left(self.ends, start)
+        for position in itertools.islice(positions, first, last):
+            while self.ends[sentence_number] < position:
+                sentence_number += 1
+            yield (sentence_number, number, position)
+
+
+    def matches(self, start=0, end=None):
+        """
+            Generates the tuples of `sentence_matches` for the sentences that
+            start between the positions `start` and `end` of the corpus (by
+            default, all of them), as `index_matches` does.
+        """
+        ends = self.ends
+        first = bisect.bisect_left(ends, start - 1) + 1 if start > 0 else 0
+        last = len(ends) if end is None \
+                else min(len(ends), bisect.bisect_left(ends, end - 1) + 1)
+        if first >= last:
+            return
+        begin = ends[first - 1] + 1 if first > 0 else 0
+        found = itertools.groupby(heapq.merge(*[self.sequence_starts(number,
+                positions, begin, ends[last - 1])
+                for (number, length, positions) in self.sequences]),
+                key=lambda triple: triple[0])
+        if self.other_patterns is None:
+            for (sentence_number, starts) in found:
+                for match in self.sentence_matches(sentence_number, starts):
+                    yield match
+            return
+        (next_number, starts) = next(found, (None, ()))
+        for sentence_number in xrange(first, last):
+            if sentence_number == next_number:
+                sentence_starts = list(starts)
+                (next_number, starts) = next(found, (None, ()))
+            else:
+                sentence_starts = []
+            for match in self.sentence_matches(sentence_number,
+                                               sentence_starts):
+                yield match
+
+
+    def sentence_matches(self, sentence_number, starts):
+        """
+            Generates the tuples of `sentence_matches` for a sentence, given
+            the `(sentence number, pattern number, position)` triples of the
+            sequences that start in it, in the order of the patterns.
+        """
+        start = self.ends[sentence_number - 1] + 1 if sentence_number else 0
+        lengths = self.lengths
+        wordnums_of = collections.defaultdict(list)  # pattern number -> list
+        free = {}  # pattern number -> first position after its last match
+        for (_, number, position) in starts:
+            # A sequence matches once at most at each word
+            if non_overlapping and position < free.get(number, 0):
+                continue
+            free[number] = position + lengths[number]
+            wordnums_of[number].append(tuple(xrange(position - start,
+                    position - start + lengths[number])))
+        if self.other_patterns is not None:
+            words = self.sentence_words(start, self.ends[sentence_number])
+            for (pattern, match_ngram, wordnums) in \
+                    self.other_patterns.matches(words,
+                            match_distance=match_distance, id_order=id_order,
+                            overlapping=not non_overlapping):
+                wordnums_of[self.pattern_numbers[id(pattern)]].append(
+                        tuple(wordnums))
+
+        already_matched = set()
+        sentence_id = SentenceFactory.FIRST_ID + sentence_number
+        for number in sorted(wordnums_of):
+            for wordnums in wordnums_of[number]:
+                if wordnums in already_matched:
+                    continue
+                already_matched.add(wordnums)
+                words = [self.word_at(start + wordnum)
+                         for wordnum in wordnums]
+                yield (tuple(base for (base, real) in words),
+                       tuple(real for (base, real) in words),
+                       sentence_id, wordnums)
+
+
+################################################################################
+
+def is_binary_index(path):
+    """
+        Returns whether the corpus `path` is a BinaryIndex, according to
+        --from or to its extension and header.
+    """
+    if input_filetype_ext is not None:
+        return input_filetype_ext == "BinaryIndex"
+    if path == "-" or not path.endswith((".info", CONTAINER_EXT)):
+        return False
+    with open(path, "rb") as fileobj:
+        header = fileobj.read(20)
+    return header.startswith((b"corpus_size int", CONTAINER_MAGIC))
+
+
+def parse_corpora(handler):
+    """
+        Reads the corpora in `arg` into `handler`. BinaryIndex corpora are
+        read from their arrays with -n (see `index_matches`) and with
+        patterns that match fixed sequences of words (see
+        `IndexPatternMatcher`), in ranges of `JOBS_INDEX_CHUNK_SIZE` words
+        with --jobs.
+    """
+    global current_index_matches
+    if not (window_ngrams or index_patterns) or not arg \
+            or not all(is_binary_index(path) for path in arg):
+        filetype.parse(arg, handler, input_filetype_ext)
+        return
+    for path in arg:
+        index = Index(index_basepath(path))
+        index.load_main()
+        if window_ngrams:
+            verbose("Extracting ngrams from index " + path)
+            index_matcher = functools.partial(index_matches, index,
+                    ends=sentence_ends(index) if jobs > 1 else None)
+        else:
+            verbose("Matching patterns in index " + path)
+            index_matcher = IndexPatternMatcher(index).matches
+        with open(path, "rb") as fileobj:
+            handler.before_file(fileobj)
+            if jobs > 1 and isinstance(handler, CandidatesGeneratorHandler):
+                # Workers are forked once the index is loaded, to share it
+                current_index_matches = index_matcher
+                parallel_extractor = ParallelExtractor(jobs,
+                                                       handler.add_partial)
+                n_words = len(index.arrays[index.used_word_attributes[0]]
+                              .corpus)
+                for start in xrange(0, n_words, JOBS_INDEX_CHUNK_SIZE):
+                    parallel_extractor.submit(extract_index_range,
+                            (start, start + JOBS_INDEX_CHUNK_SIZE))
+                parallel_extractor.finish()
+                current_index_matches = None
+            else:
+                handler.handle_matches(index_matcher())
+            handler.after_file(fileobj)
+    handler.finish()
+
+
+################################################################################
+
+def corpus_name(fileobj):
+    """
+        Returns the name of the corpus in the file `fileobj`, used to name
+        the frequencies of the candidates.
+    """
+    return re.sub(".*/", "", re.sub("\.(xml|info|mwi)", "", fileobj.name))
+
+
+################################################################################
+
+def print_sketch_candidates(estimates, name):
+    """
+        Prints the candidates kept by the sketch, with their estimated
+        frequency in the corpus `name` (--sketch without --exact).
+
+        @param estimates A list of `(ngram_basestring, estimate)` pairs.
+    """
+    verbose("Outputting candidates file...")
+    printer = filetype.printer_class(output_filetype_ext)("candidates")
+    printer.handle_meta(Meta(None,None,None))
+    candidate_factory = CandidateFactory()
+    for ngram_basestring, estimate in estimates:
+        cand = candidate_factory.make()
+        cand.from_string(ngram_basestring)
+        cand.add_frequency(Frequency(name, estimate))
+        printer.handle_candidate(cand)
+    printer.finish()
+
+
 ################################################################################  
 
 def create_patterns_file( ngram_range ) :
@@ -299,6 +1219,8 @@ def treat_options( opts, arg, n_arg, usage_string ) :
     global input_filetype_ext
     global output_filetype_ext
     global id_order
+    global sketch_size, sketch_error, sketch_min_freq, exact_recount
+    global max_memory, jobs, pattern_set, window_ngrams, index_patterns
     
     treat_options_simplest( opts, arg, n_arg, usage_string )
         
@@ -332,6 +1254,41 @@ def treat_options( opts, arg, n_arg, usage_string ) :
             input_filetype_ext = a
         elif o == "--to" :
             output_filetype_ext = a
+        elif o == "--sketch":
+            try:
+                sketch_size = int(float(a) * 1024 * 1024)
+                if sketch_size <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --sketch must be a positive number")
+        elif o == "--sketch-freq":
+            try:
+                sketch_min_freq = int(a)
+            except ValueError:
+                error("Argument of --sketch-freq must be an integer")
+        elif o == "--sketch-error":
+            try:
+                sketch_error = float(a)
+                if not 0 < sketch_error < 1:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --sketch-error must be between 0 and 1")
+        elif o == "--exact":
+            exact_recount = True
+        elif o == "--jobs":
+            try:
+                jobs = int(a)
+                if jobs <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --jobs must be a positive integer")
+        elif o == "--max-memory":
+            try:
+                max_memory = int(float(a) * 1024 * 1024)
+                if max_memory <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --max-memory must be a positive number")
         else:
             raise Exception("Bad flag")
 
@@ -341,14 +1298,50 @@ def treat_options( opts, arg, n_arg, usage_string ) :
 
     if len(mode) != 1 :
         error("Exactly one option, -p or -n, must be provided")
+    if sketch_size is None and (sketch_error is not None or exact_recount):
+        error("Options --sketch-error and --exact only work with --sketch")
+    if sketch_size is not None:
+        if exact_recount and (not arg or "-" in arg):
+            error("Option --exact cannot read the corpus from standard input")
+        if not exact_recount and len(arg) > 1:
+            error("Option --sketch without --exact only works with a single "
+                  "corpus file")
+        if not exact_recount and max_memory is not None:
+            error("Option --max-memory does not work with --sketch without "
+                  "--exact")
     if "patterns" in mode:
         global patterns
         patterns = filetype.parse_entities([patterns_file])
+    pattern_set = PatternSet(patterns)
+    window_ngrams = "ngram" in mode and id_order == ["*"] \
+            and match_distance in ("All", "Longest", "Shortest")
+    index_patterns = not window_ngrams and id_order == ["*"] \
+            and any(pattern.word_sequence() is not None
+                    for pattern in patterns)
 
 ################################################################################  
 # MAIN SCRIPT
 
 longopts = [ "from=", "to=", "patterns=", "ngram=", "index", "match-distance=",
-        "non-overlapping", "freq", "ignore-pos", "surface", "source", "id-order=" ]
+        "non-overlapping", "freq", "ignore-pos", "surface", "source", "id-order=",
+        "sketch=", "sketch-freq=", "sketch-error=", "exact", "max-memory=",
+        "jobs=" ]
 arg = read_options( "p:n:id:NfgsS", longopts, treat_options, -1, usage_string )
-filetype.parse(arg, CandidatesGeneratorHandler(), input_filetype_ext)
+if sketch_size is None:
+    parse_corpora(CandidatesGeneratorHandler())
+else:
+    sketch = NgramSketch(sketch_size, sketch_error)
+    sketch_handler = SketchHandler()
+    parse_corpora(sketch_handler)
+    verbose(sketch.describe())
+    estimates = sketch.heavy_hitters(sketch_min_freq)
+    if exact_recount:
+        heavy_hitters = set(tuple(word_symbols.symbol_to_number[word]
+                                  for word in ngram_basestring.split(
+                                  WORD_SEPARATOR))
+                            for (ngram_basestring, estimate) in estimates)
+        parse_corpora(CandidatesGeneratorHandler())
+    else:
+        print_sketch_candidates(estimates, sketch_handler.current_corpus_name)
+if not window_ngrams:
+    verbose(pattern_set.describe())
@@ -40,18 +40,27 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 
 import sys
+import os
 import re
 import subprocess
+import collections
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 from libs.base.frequency import Frequency
 from libs.base.googleFreq import GoogleFreq
 from libs.base.googleFreqUniv import GoogleFreqUniv
+from libs.base.webFreq import RateLimiter
 from libs.base.corpus_size import CorpusSize
+from libs.base.freq_cache import FreqCache, LRUCache
+from libs.base.web1tFreq import Web1TStore, WEB1T_STORE_NAME
+from libs.base.freq_client import FreqServerClient, SERVER_PATH_PREFIX
+from libs.base.ngram_automaton import NgramAutomaton
 from libs.util import read_options, treat_options_simplest, \
         verbose, error, warn
-from libs.base.__common import DEFAULT_LANG
+from libs.base.__common import DEFAULT_LANG, WILDCARD, WEB_QUERY_THREADS
 from libs import filetype
-from libs.filetype.indexlib import Index, ATTRIBUTE_SEPARATOR
+from libs.filetype.indexlib import Index, ATTRIBUTE_SEPARATOR, index_basepath
 
 ################################################################################
 # GLOBALS    
@@ -63,7 +72,11 @@ python {program} [-w | -u <id> | -T <dir> | -i <index-corpus>] OPTIONS <candidat
 -i <index-corpus> OR --index <index-corpus>
     Calculate frequencies of individual words in given corpus.
     The corpus must be given as the path to the `.info` file
-    in a BinaryIndex instance.
+    (or `.mwi` container) in a BinaryIndex instance, or as
+    "unix:<socket>" to query a `freq_server.py` process listening on
+    <socket> (add "#<name>" to choose among the indices of the server).
+    This option can be repeated, and combined with -T, to count in several
+    corpora in a single pass over the candidates.
 
 -y OR --yahoo
     Search for frequencies in the Web using Yahoo Web Search as approximator for
@@ -84,13 +97,26 @@ python {program} [-w | -u <id> | -T <dir> | -i <index-corpus>] OPTIONS <candidat
 -T <dir> OR --web1t <dir>
     Use Google's Web 1T 5-gram corpus. <dir> is the a directory containing the
     union of the contents of the data/ directories of each corpus CD as
-    distributed by Google.
+    distributed by Google. If the directory has been converted with
+    `index_web1t.py`, the converted store is used, which is much faster.
+    The path of a store created elsewhere can also be given.
+
+--corpus <corpus>
+    Count in the corpus file <corpus> without indexing it, by reading it
+    once after all the candidates have been read. Use this for a corpus in
+    which you will not count again: memory depends on the number of
+    candidates, not on the size of the corpus. The corpus may be in any
+    of the filetypes accepted by --corpus-from. This option can be
+    repeated, and combined with -i and -T.
 
 The <candidates> input file must be in one of the filetype
 formats accepted by the `--candidates-from` switch.
 
-You must choose exactly one of -u, -w or -i
-(more than one is not allowed at the same time).
+You must choose at least one of -u, -w, -T, -i or --corpus. When several
+corpora are given, each one gets its own frequencies and `CorpusSize`, named
+after the index or corpus file (or "google", "web1t"), so their names must be
+different. Corpora that are not in local files (e.g. frequency servers) are
+queried concurrently.
 
     
 OPTIONS may be:
@@ -103,7 +129,8 @@ OPTIONS may be:
 --corpus-from <corpus-filetype>
     Only works if the `--corpus` switch has been given as well.
     Force reading corpus from given filetype extension.
-    XXX Currently, only "BinaryIndex" is accepted.
+    (By default, file type is automatically detected):
+    {descriptions.input[corpus]}
 
 --to <corpus-filetype>
     Output candidates in given filetype format
@@ -141,6 +168,47 @@ OPTIONS may be:
 
 -o OR --old
     Use the old (slower) Python indexer, even when the C indexer is available.
+
+--filter-limit <n>
+    When counting lemma+pos (or surface+pos) in an index that does not have
+    the corresponding fused array, n-grams whose lemma (or surface) sequence
+    occurs at most <n> times are counted by checking the POS of each of these
+    occurrences, without building the fused array. The fused array is only
+    built if a larger range is found. Use 0 to always build the fused array.
+    With --jobs, the fused array is not built by the worker processes: build
+    it at start with 0, or all the n-grams are counted by filtering.
+    Default 100000.
+
+--web-threads <n>
+    With -w or -u, send at most <n> Web queries at once. The queries of all
+    the candidates are collected first, and only those that are not in the
+    cache are sent. Default 4.
+
+--web-rate <n>
+    With -w or -u, send at most <n> Web queries per second, on average.
+    Use 0 for no limit. Default 2.
+
+--cache-size <n>
+    Keep the frequencies of the <n> most recently counted words and ngrams
+    in memory, so that words shared by many candidates are only counted
+    once. Each entry takes around 300 bytes. Use 0 to disable. Default
+    100000.
+
+--jobs <n>
+    Count candidates in <n> worker processes, which share the loaded index
+    with the main process. Candidates are sent to the workers in chunks, and
+    output in their original order. Only works with -i, -T and
+    --corpus. Default 1.
+
+--freq-cache <file>
+    Keep the frequencies computed from the index in the persistent cache
+    <file> (created if it does not exist), and read them from there in later
+    runs. Entries are only used with the same index contents: if the index
+    is rebuilt from another corpus, they are recomputed. Only works with -i.
+
+--freq-cache-size <megabytes>
+    Maximum size of the --freq-cache file. When it grows larger, the least
+    recently used entries are evicted. Default 64.
     
 {common_options}
 """
@@ -149,13 +217,18 @@ OPTIONS may be:
     #Generate indices only for the specified attributes. <attrs> is a
     #colon-separated list of attributes (e.g. lemma:pos:lemma+pos).
 
-index = None  # Index()
-suffix_array = None  # SuffixArray()
+backends = []  # FreqBackend() for each -i, -T, -w or -u option
+thread_pool = None  # ThreadPool() querying the backends concurrently
+thread_pool_pid = None  # Process in which thread_pool was created
+filter_limit = 100000
+freq_cache = None  # FreqCache(), shared by all the index backends
+memo_size = 100000
+jobs = 1
+web_threads = WEB_QUERY_THREADS
+web_rate = None  # Queries per second (default: WEB_QUERY_RATE)
+# Number of candidates sent at once to a worker process (--jobs)
+JOBS_CHUNK_SIZE = 256
 
-get_freq_function = None
-freq_name = "?"
-web_freq = None
-the_corpus_size = -1
 low_limit = -1
 up_limit = -1
 count_vars = False
@@ -163,7 +236,7 @@ count_joint_frequency = True
 count_bigrams = False
 language = DEFAULT_LANG
 
-filetype_corpus_ext = "BinaryIndex"
+filetype_corpus_ext = None
 filetype_candidates_ext = None
 output_filetype_ext = "XML"
 
@@ -171,45 +244,733 @@ output_filetype_ext = "XML"
 ################################################################################
 
 class CounterPrinter(filetype.ChainedInputHandler):
-    r"""Adds info and outputs the result."""
+    r"""Adds info and outputs the result.
+
+    If some backend only counts after reading all the candidates (e.g.
+    --corpus), the candidates, metas and comments are kept in `deferred`,
+    and handled in `finish`, after these backends have counted.
+    """
+    def __init__(self):
+        self.parallel_counter = None
+        self.deferred = None
+        self.streaming = [backend for backend in backends
+                          if backend.streaming]
+        if self.streaming:
+            self.deferred = []  # list of (method, args)
+
     def before_file(self, fileobj, info={}):
         if not self.chain:
             self.chain = self.make_printer(info, output_filetype_ext)
         self.chain.before_file(fileobj, info)
         self.entity_counter = 0
 
+    def _fallback(self, entity, info={}):
+        if self.deferred is not None:
+            self.deferred.append((self.chain.handle, (entity, info)))
+        else:
+            self.chain.handle(entity, info)
+
     def handle_meta(self, meta, info={}):
-        """Adds a `CorpusSize` meta-information to the header and prints the 
-        header. The corpus size is important to allow the calculation of 
+        """Adds a `CorpusSize` meta-information to the header and prints the
+        header. The corpus size is important to allow the calculation of
         statistical Association Measures by the `feat_association.py` script.
-        
-        @param meta The `Meta` header that is being read from the XML file.        
+        There is one `CorpusSize` for each corpus in which we count.
+
+        @param meta The `Meta` header that is being read from the XML file.
         """
-        global freq_name, the_corpus_size
-        meta.add_corpus_size(CorpusSize(name=freq_name, value=the_corpus_size))
+        if self.deferred is not None:
+            self.deferred.append((self.handle_meta, (meta, info)))
+            return
+        for backend in backends:
+            meta.add_corpus_size(CorpusSize(name=backend.name,
+                                            value=backend.corpus_size))
         self.chain.handle_meta(meta, info)
 
     def handle_candidate(self, candidate, info={}):
         """For each candidate, searches for the individual word frequencies of the
         base ngram. The corresponding function, for a corpus index or for yahoo,
-        will be called, depending on the -i or -w/-u options. The frequencies 
-        are added as a child element of the word and then the candidate is 
+        will be called, depending on the -i or -w/-u options. The frequencies
+        are added as a child element of the word and then the candidate is
         printed.
-        
+
         @param candidate The `Candidate` that is being read from the XML file.
         """
         global low_limit, up_limit
         global count_vars
+        ngrams = []
         if ( self.entity_counter >= low_limit or low_limit < 0 ) and \
                 ( self.entity_counter <= up_limit or up_limit < 0 ):
             if count_vars:
-                for var in candidate.vars:
-                    append_counters(var)
+                ngrams = candidate.vars
             else:
-                append_counters(candidate)
-        self.chain.handle_candidate(candidate, info)
+                ngrams = [candidate]
         self.entity_counter += 1
 
+        if self.deferred is not None:
+            for ngram in ngrams:
+                queries = ngram_queries(ngram)
+                for backend in self.streaming:
+                    backend.add_queries(queries)
+            self.deferred.append((self.count_candidate,
+                                  (candidate, ngrams, info)))
+        else:
+            self.count_candidate(candidate, ngrams, info)
+
+    def count_candidate(self, candidate, ngrams, info):
+        """Adds the frequencies of `ngrams` to them and outputs `candidate`.
+        """
+        if jobs > 1:
+            if self.parallel_counter is None:
+                # Forked only now, so that workers inherit the loaded index
+                self.parallel_counter = ParallelCounter(jobs,
+                        self.chain.handle_candidate)
+            self.parallel_counter.add(candidate, ngrams, info)
+        else:
+            for ngram in ngrams:
+                append_counters(ngram)
+            self.chain.handle_candidate(candidate, info)
+
+    def finish(self):
+        if self.deferred is not None:
+            for backend in self.streaming:
+                backend.scan()
+            (deferred, self.deferred) = (self.deferred, None)
+            for method, args in deferred:
+                method(*args)
+        if self.parallel_counter is not None:
+            self.parallel_counter.finish()
+        for backend in backends:
+            backend.report()
+        self.chain.finish()
+
+
+################################################################################
+
+class ParallelCounter(object):
+    r"""Counts candidates in worker processes (option --jobs).
+
+    Candidates are buffered into chunks of `JOBS_CHUNK_SIZE`, and the
+    queries of each chunk (see `ngram_queries`) are sent to a worker.
+    Workers are forked from the main process, so they share the index
+    that has already been loaded. Chunks whose results are pending are kept
+    in a FIFO (reorder buffer), so that candidates are passed to `output`
+    in their original order, after their counts have been added.
+    """
+    def __init__(self, n_jobs, output):
+        verbose("Counting in %d worker processes" % n_jobs)
+        for backend in backends:
+            backend.before_fork()
+        if freq_cache is not None:
+            # Hits are sent back by the workers (see count_chunk)
+            freq_cache.hit_keys = set()
+        self.pool = multiprocessing.Pool(n_jobs)
+        self.output = output
+        self.max_pending = 2 * n_jobs
+        self.chunk = []  # list of (candidate, ngrams, info)
+        self.pending = collections.deque()  # of (chunk, AsyncResult)
+
+    def add(self, candidate, ngrams, info):
+        self.chunk.append((candidate, ngrams, info))
+        if len(self.chunk) >= JOBS_CHUNK_SIZE:
+            self.submit()
+
+    def submit(self):
+        queries = [[ngram_queries(ngram) for ngram in ngrams]
+                   for (candidate, ngrams, info) in self.chunk]
+        result = self.pool.apply_async(count_chunk, (queries,))
+        self.pending.append((self.chunk, result))
+        self.chunk = []
+        while len(self.pending) > self.max_pending:
+            self.collect()
+
+    def collect(self):
+        """Waits for the oldest pending chunk and outputs its candidates."""
+        chunk, result = self.pending.popleft()
+        (counts, cache_entries, cache_hits, statistics) = result.get()
+        add_statistics(statistics)
+        for key in cache_hits:
+            freq_cache.touch(key)
+        for key, freq in cache_entries:
+            freq_cache.put(key, freq)
+        for (candidate, ngrams, info), ngrams_freqs in zip(chunk, counts):
+            for ngram, freqs in zip(ngrams, ngrams_freqs):
+                add_counts(ngram, freqs)
+            self.output(candidate, info)
+
+    def finish(self):
+        if self.chunk:
+            self.submit()
+        while self.pending:
+            self.collect()
+        self.pool.close()
+        self.pool.join()
+
+
+################################################################################
+
+class FreqBackend(object):
+    r"""A corpus in which frequencies are counted, given by one of the
+    options -i, -T, -w or -u. Its frequencies and `CorpusSize` are
+    named after `name`.
+
+    Subclasses implement `get_freq`, which counts a single
+    `(surfaces, lemmas, pos)` query, and/or `get_freqs`, which counts a
+    list of them at once. Both search for the entries built by
+    `build_entry` from each word. Backends that spend their time waiting
+    for I/O (e.g. for a server) have `local` set to False, and are queried
+    concurrently with the other backends (see `count_queries`).
+    """
+    local = True
+    # If True, `add_queries` is called with every query before `scan`, and
+    # `get_freq` or `get_freqs` are only called after `scan`.
+    streaming = False
+
+    def __init__(self, name, corpus_size, build_entry):
+        self.name = name
+        self.corpus_size = corpus_size
+        self.build_entry = build_entry
+        self.memo = None  # LRUCache()
+        if memo_size > 0:
+            self.memo = LRUCache(memo_size)
+
+    def get_freq(self, surfaces, lemmas, pos):
+        return self.get_freqs([(surfaces, lemmas, pos)])[0]
+
+    def get_freqs(self, queries):
+        return [self.get_freq(*query) for query in queries]
+
+    def count(self, queries):
+        """
+            Returns the list of frequencies of a list of
+            `(surfaces, lemmas, pos)` queries. The queries that are not in
+            the in-memory cache of recently counted words and ngrams (see
+            option --cache-size) are all sent to `get_freqs` at once. The
+            entries built by `build_entry` are used as the cache key.
+        """
+        if self.memo is None:
+            return self.get_freqs(queries)
+        keys = [tuple(map(self.build_entry, *query)) for query in queries]
+        freqs = [self.memo.get(key) for key in keys]
+        missing = [i for (i, freq) in enumerate(freqs) if freq is None]
+        if missing:
+            found = self.get_freqs([queries[i] for i in missing])
+            for i, freq in zip(missing, found):
+                freqs[i] = freq
+                self.memo.put(keys[i], freq)
+        return freqs
+
+    def before_fork(self):
+        """Called before worker processes are forked (option --jobs)."""
+        pass
+
+    def report(self):
+        """Prints statistics about the counting, in verbose mode."""
+        if self.memo is not None:
+            self.memo.report("In-memory frequency cache for " + self.name)
+
+    def statistics(self):
+        """
+            Returns the `(object, names of counters)` pairs of the counters
+            printed by `report`, which worker processes (option --jobs) send
+            to the main process (see `take_statistics`).
+        """
+        if self.memo is None:
+            return []
+        return [(self.memo, ("hits", "lookups", "evictions"))]
+
+    def close(self):
+        pass
+
+
+################################################################################
+
+class IndexBackend(FreqBackend):
+    r"""Counts in a corpus index created by `index.py` (option -i)."""
+    def __init__(self, path, surface_flag, ignorepos_flag):
+        """
+            Opens the index files (valid index created by the `index.py`
+            script).
+
+            @param path The path of the `.info` or `.mwi` file of the index.
+        """
+        prefix = index_basepath(path)
+        try:
+            verbose("Loading index files... this may take some time.")
+            self.index = Index(prefix)
+            self.index.load_metadata()
+            corpus_size = self.index.metadata["corpus_size"]
+        except (IOError, KeyError):
+            error("Error opening the index.\nTry again with another index filename")
+        (build_entry, self.attr) = make_build_entry(surface_flag,
+                                                    ignorepos_flag)
+        FreqBackend.__init__(self, re.sub(".*/", "", prefix), corpus_size,
+                             build_entry)
+        self.suffix_array = None  # SuffixArray()
+        # e.g. "lemma+pos", loaded lazily if absent from the index
+        self.fused_attr = None
+        self.may_build_fused = True  # See before_fork
+        if '+' not in self.attr:
+            self.suffix_array = self.index.load(self.attr)
+        else:
+            self.fused_attr = self.attr
+            if self.index.array_file_exists(self.fused_attr) \
+                    or filter_limit <= 0:
+                self.suffix_array = self.index.load(self.fused_attr)
+            else:
+                verbose("No fused array for %s; counting by filtering "
+                        "suffix ranges" % self.fused_attr)
+        self.checksum = None
+        if freq_cache is not None:
+            self.checksum = self.index.content_checksum()
+
+    def get_freq(self, surfaces, lemmas, pos):
+        """
+            Gets the frequency (number of occurrences) of a token (word) in
+            the index file.
+
+            @param surfaces A string corresponding to the surface form of a word.
+
+            @param lemmas A string corresponding to the lemma of a word.
+
+            @param pos A string corresponding to the Part Of Speech of a word.
+
+            Any of them may be `WILDCARD` (e.g. the POS of candidates
+            extracted with `candidates.py -g`), which matches any value.
+        """
+        entries = map(self.build_entry, surfaces, lemmas, pos)
+        if any(WILDCARD in entry for entry in entries):
+            return self.index.wildcard_frequency(self.attr, entries)
+        if self.suffix_array is None:
+            return self.get_freq_filtered(surfaces, lemmas, pos)
+        ngram_ids = []
+        for word in entries:
+            wordid = self.suffix_array.symbols.symbol_to_number.get(word, None)
+            if wordid:
+                ngram_ids.append(wordid)
+            else:
+                return 0
+        return self.get_freq_cached(self.attr, ngram_ids,
+                                    self.suffix_array.frequency)
+
+    def get_freq_cached(self, attr, ngram_ids, get_frequency):
+        """
+            Returns `get_frequency(ngram_ids)`, reading it from (or storing
+            it in) the persistent frequency cache, if the --freq-cache option
+            was given.
+
+            @param attr The attribute of the symbol numbers in `ngram_ids`.
+
+            @param ngram_ids A list of symbol numbers.
+
+            @param get_frequency A function that computes the frequency of
+            `ngram_ids` from the index.
+        """
+        if freq_cache is None:
+            return get_frequency(ngram_ids)
+        key = FreqCache.make_key(self.checksum, attr, ngram_ids)
+        freq = freq_cache.get(key)
+        if freq is None:
+            freq = get_frequency(ngram_ids)
+            freq_cache.put(key, freq)
+        return freq
+
+    def get_freq_filtered(self, surfaces, lemmas, pos):
+        """
+            Gets the frequency of an n-gram over a combined attribute (e.g.
+            lemma+pos) whose fused array is absent from the index. The range
+            of the first attribute (e.g. lemma) is looked up in its suffix
+            array, and its occurrences are then filtered against the corpus
+            array of the second one (e.g. POS). If the range is larger than
+            `filter_limit`, the fused array is built and used from then on.
+
+            Parameters are the same as in `get_freq`.
+        """
+        values = {"surface": surfaces, "lemma": lemmas, "pos": pos}
+        (base_attr, filter_attr) = self.fused_attr.split("+")
+        base_array = self.index.load(base_attr)
+        filter_array = self.index.load(filter_attr)
+        base_ids = []
+        filter_ids = []
+        for (base_value, filter_value) in zip(values[base_attr],
+                                              values[filter_attr]):
+            base_id = base_array.symbols.symbol_to_number.get(base_value, None)
+            filter_id = filter_array.symbols.symbol_to_number.get(filter_value,
+                                                                  None)
+            if not base_id or not filter_id:
+                return 0
+            base_ids.append(base_id)
+            filter_ids.append(filter_id)
+
+        def get_frequency(ngram_ids):
+            indexrange = base_array.find_ngram_range(base_ids)
+            if indexrange is None:
+                return 0
+            first, last = indexrange
+            if last - first + 1 > filter_limit and self.may_build_fused:
+                verbose("Range of %d occurrences is too large for filtering; "
+                        "using fused array %s" % (last - first + 1,
+                                                  self.fused_attr))
+                self.suffix_array = self.index.load(self.fused_attr)
+                return self.get_freq(surfaces, lemmas, pos)
+            positions = self.index.filter_positions(
+                    base_array.ngram_positions(indexrange),
+                    [(filter_attr, filter_ids)])
+            return len(positions)
+
+        # Symbol numbers of both attributes, as the fused ones are not known
+        return self.get_freq_cached(base_attr + "," + filter_attr,
+                                    base_ids + filter_ids, get_frequency)
+
+    def before_fork(self):
+        """
+            Worker processes never build the fused array, as they would all
+            write its files at once: ranges that are too large for
+            filtering are filtered anyway. The fused array is used if it
+            was already in the index, or built with --filter-limit 0.
+        """
+        if self.suffix_array is None:
+            verbose("Fused array %s is not built by worker processes; "
+                    "counting by filtering suffix ranges" % self.fused_attr)
+            self.may_build_fused = False
+
+    def report(self):
+        """
+            Also prints how many index queries were answered by the table of
+            top ngrams (see `index.py --top-ngrams`).
+        """
+        FreqBackend.report(self)
+        suffix_array = self.suffix_array
+        if suffix_array is not None and suffix_array.top_ngrams is not None:
+            lookups = suffix_array.top_ngram_lookups
+            hits = suffix_array.top_ngram_hits
+            verbose("Top ngram table: %d hits in %d lookups (%.1f%%)" % (hits,
+                    lookups, 100.0 * hits / lookups if lookups else 0.0))
+
+    def statistics(self):
+        """Also returns the counters of the table of top ngrams."""
+        counters = FreqBackend.statistics(self)
+        if self.suffix_array is not None:
+            counters.append((self.suffix_array, ("top_ngram_lookups",
+                                                 "top_ngram_hits")))
+        return counters
+
+
+################################################################################
+
+class ServerBackend(FreqBackend):
+    r"""Counts in an index kept in memory by a `freq_server.py` process
+    (option -i unix:<socket>)."""
+    local = False
+
+    def __init__(self, path, surface_flag, ignorepos_flag):
+        """
+            @param path A path of the form "unix:<socket>" or
+            "unix:<socket>#<index-name>".
+        """
+        self.server = FreqServerClient.from_path(path)
+        (build_entry, self.attr) = make_build_entry(surface_flag,
+                                                    ignorepos_flag)
+        FreqBackend.__init__(self, self.server.index_name,
+                             self.server.corpus_size, build_entry)
+
+    def get_freqs(self, queries):
+        """Gets the frequencies of the queries with a single request."""
+        return self.server.frequencies(self.attr,
+                [map(self.build_entry, *query) for query in queries])
+
+
+################################################################################
+
+class Web1TStoreBackend(FreqBackend):
+    r"""Counts in a Web 1T store created by `index_web1t.py` (option -T)."""
+    def __init__(self, store_path, surface_flag):
+        verbose("Using Web 1T store " + store_path)
+        self.store = Web1TStore(store_path)
+        FreqBackend.__init__(self, "web1t", self.store.total,
+                             make_build_entry(surface_flag, True)[0])
+
+    def get_freqs(self, queries):
+        """Gets the frequencies of the queries with a single lookup."""
+        search_terms = []
+        for (surfaces, lemmas, pos) in queries:
+            if len(surfaces) > 5:
+                warn("Cannot count the frequency of an n-gram, n>5!")
+            search_terms.append(' '.join(map(self.build_entry, surfaces,
+                                             lemmas, pos)))
+        return self.store.frequencies(search_terms)
+
+    def close(self):
+        self.store.close()
+
+
+################################################################################
+
+class Web1TBackend(FreqBackend):
+    r"""Counts in the original files of Google's Web 1T 5-gram Corpus
+    (option -T, when no store was created by `index_web1t.py`)."""
+    local = False
+
+    def __init__(self, data_path, surface_flag):
+        self.data_path = data_path
+        FreqBackend.__init__(self, "web1t",
+                             int(read_file(data_path + "/1gms/total")),
+                             make_build_entry(surface_flag, True)[0])
+
+    def get_freq(self, surfaces, lemmas, pos):
+        """
+            Gets the frequency (number of occurrences) of an ngram in Google's
+            Web 1T 5-gram Corpus.
+        """
+        length = len(surfaces)
+
+        if length > 5:
+            warn("Cannot count the frequency of an n-gram, n>5!")
+            return 0
+
+        search_term = ' '.join(map(self.build_entry, surfaces, lemmas, pos))
+
+        # Find the file in which to look for the ngram.
+        if length == 1:
+            filename = self.data_path + "/1gms/vocab.gz"
+        else:
+            indexfile = self.data_path + "/%dgms/%dgm.idx" % (length, length)
+            filenames = [x.split("\t") for x in read_file(indexfile).split("\n")]
+            filename = None
+            for (name, first) in filenames:
+                # Assumes byte-value-based ordering!
+                if first > search_term:
+                    break
+                else:
+                    filename = name
+
+            if filename is None:
+                return 0
+            filename = "%s/%dgms/%s" % (self.data_path, length, filename)
+
+        verbose("WEB1T: Opening %s, looking for %s" % (filename, search_term))
+
+        # This has been absurdly slow in Python.
+        #file = gzip.open(filename, "rb")
+        #
+        #search_term += "\t"
+        #freq = 0
+        #
+        #for line in file:
+        #    if line.startswith(search_term):
+        #        freq = int(line.split("\t")[1])
+        #        break
+        #
+        #print >>sys.stderr, "buenito: %d" % freq
+        #
+        #file.close()
+
+        file = subprocess.Popen(
+            ["zgrep", "--", "^" + re.escape(search_term) + "\t", filename],
+            stdout=subprocess.PIPE).stdout
+        line = file.read()
+        file.close()
+        if line:
+            freq = int(line.split("\t")[1])
+        else:
+            freq = 0
+        verbose("freq =" + str(freq))
+        return freq
+
+
+################################################################################
+
+class WebBackend(FreqBackend):
+    r"""Counts in the Web through Google's index (options -w and -u).
+
+    All the search terms are collected before counting, and those that are
+    not in the cache are sent at once, concurrently, by `scan` (see
+    `WebFreq.search_frequencies`)."""
+    local = False
+    streaming = True
+
+    def __init__(self, web_freq, surface_flag):
+        """
+            @param web_freq A `GoogleFreq` or `GoogleFreqUniv`.
+        """
+        self.web_freq = web_freq
+        if web_rate is not None:
+            web_freq.rate_limiter = RateLimiter(web_rate) \
+                    if web_rate > 0 else None
+        FreqBackend.__init__(self, "google", web_freq.corpus_size(),
+                             make_build_entry(surface_flag, True)[0])
+        self.search_terms = set()
+
+    def search_term(self, surfaces, lemmas, pos):
+        """Returns the Web search term of a query."""
+        return " ".join(map(self.build_entry, surfaces, lemmas, pos))
+
+    def add_queries(self, queries):
+        for query in queries:
+            self.search_terms.add(self.search_term(*query))
+
+    def scan(self):
+        self.web_freq.search_frequencies(self.search_terms, language,
+                                         web_threads)
+        self.search_terms = set()
+
+    def get_freq(self, surfaces, lemmas, pos):
+        """
+            Gets the frequency (number of occurrences) of a token (word) in the
+            Web through Yahoo's or Google's index.
+
+            @param surfaces A list corresponding to the surface forms of a word.
+
+            @param lemmas A list corresponding to the lemmas of a word.
+
+            @param pos A list corresponding to the Part Of Speeches of a word.
+            This parameter is ignored since Web search engines dos no provide
+            linguistic information.
+        """
+        return self.web_freq.search_frequency(
+                self.search_term(surfaces, lemmas, pos), language)
+
+    def close(self):
+        self.web_freq.flush_cache()  # VERY IMPORTANT!
+
+
+################################################################################
+
+class CorpusBackend(FreqBackend):
+    r"""Counts in a corpus file that is read only once, after all the
+    queries are known, with an `NgramAutomaton` (option --corpus)."""
+    streaming = True
+
+    def __init__(self, path, surface_flag, ignorepos_flag):
+        """
+            @param path The path of the corpus file, in any filetype
+            accepted by --corpus-from.
+        """
+        self.path = path
+        name = re.sub(r"\..*", "", os.path.basename(path))
+        FreqBackend.__init__(self, name, 0,
+                             make_build_entry(surface_flag, ignorepos_flag)[0])
+        self.automaton = NgramAutomaton()
+
+    def add_queries(self, queries):
+        for query in queries:
+            self.automaton.add(map(self.build_entry, *query))
+
+    def scan(self):
+        """
+            Reads the corpus file, counting the words and the occurrences of
+            the queries added so far.
+        """
+        verbose("Counting in corpus " + self.path)
+        filetype.parse([self.path], CorpusScanner(self), filetype_corpus_ext)
+
+    def get_freq(self, surfaces, lemmas, pos):
+        return self.automaton.frequency(map(self.build_entry, surfaces,
+                                            lemmas, pos))
+
+
+################################################################################
+
+class CorpusScanner(filetype.InputHandler):
+    r"""Passes the sentences of a corpus to `CorpusBackend`."""
+    def __init__(self, backend):
+        self.backend = backend
+
+    def handle_sentence(self, sentence, info={}):
+        build_entry = self.backend.build_entry
+        self.backend.automaton.scan([build_entry(w.surface, w.lemma, w.pos)
+                                     for w in sentence])
+        self.backend.corpus_size += len(sentence)
+
+    def _fallback(self, obj, info):
+        pass  # Metas and comments of the corpus are not counted
+
+
+################################################################################
+
+def make_build_entry(surface_flag, ignorepos_flag):
+    """
+        Returns a `(build_entry, attr)` pair, where `build_entry` builds the
+        entry searched for a word from its surface, lemma and POS, and `attr`
+        is the index attribute of these entries (e.g. "lemma+pos").
+
+        @param surface_flag Whether surface forms are counted (option -s).
+
+        @param ignorepos_flag Whether POS is ignored (option -g).
+    """
+    if surface_flag and ignorepos_flag:
+        return (lambda surface, lemma, pos: surface, "surface")
+    elif surface_flag:
+        return (lambda surface, lemma, pos: surface + ATTRIBUTE_SEPARATOR + pos,
+                "surface+pos")
+    elif ignorepos_flag:
+        return (lambda surface, lemma, pos: lemma, "lemma")
+    else:
+        return (lambda surface, lemma, pos: lemma + ATTRIBUTE_SEPARATOR + pos,
+                "lemma+pos")
+
+
+################################################################################
+
+def count_chunk(chunk_queries):
+    """
+        Worker function for option --jobs. Returns the frequencies for a
+        chunk of candidates, plus the entries that were added to the
+        persistent frequency cache of the worker and the keys of those that
+        were hit, so that the main process can store them and keep track of
+        their use, and the `take_statistics` of the chunk.
+
+        @param chunk_queries A list with, for each candidate, the list of
+        `ngram_queries` of each ngram to count.
+    """
+    counts = [[count_queries(queries) for queries in candidate_queries]
+              for candidate_queries in chunk_queries]
+    cache_entries = []
+    cache_hits = []
+    if freq_cache is not None:
+        cache_entries = [(key, freq_cache.entries[key])
+                         for key in freq_cache.new_entries]
+        cache_hits = list(freq_cache.hit_keys)
+        freq_cache.new_entries = []
+        freq_cache.hit_keys = set()
+    return (counts, cache_entries, cache_hits, take_statistics())
+
+
+def statistics_counters():
+    """
+        Returns the `(object, names of counters)` pairs of the statistics
+        printed in verbose mode, for all the backends and for the persistent
+        frequency cache, in the same order in every process.
+    """
+    counters = [pair for backend in backends for pair in backend.statistics()]
+    if freq_cache is not None:
+        counters.append((freq_cache, ("hits", "lookups")))
+    return counters
+
+
+def take_statistics():
+    """
+        Returns the list of the values of the `statistics_counters`, and
+        resets them. Used by worker processes (option --jobs), whose
+        counters are added to those of the main process by `add_statistics`.
+    """
+    values = []
+    for (holder, names) in statistics_counters():
+        for name in names:
+            values.append(getattr(holder, name))
+            setattr(holder, name, 0)
+    return values
+
+
+def add_statistics(values):
+    """
+        Adds the `take_statistics` of a worker process to the counters of
+        the main process.
+    """
+    values = iter(values)
+    for (holder, names) in statistics_counters():
+        for name in names:
+            setattr(holder, name, getattr(holder, name) + next(values))
+
 
 ################################################################################
 
@@ -221,203 +982,147 @@ def append_counters(ngram):
 
         If the option "--bigrams" is active, calls the frequency function for
         each bigram in the 'Ngram'.
-        
+
+        @param ngram The `Ngram` that is being counted.
+    """
+    add_counts(ngram, count_queries(ngram_queries(ngram)))
+
+
+################################################################################
+
+def ngram_queries(ngram):
+    """
+        Returns the list of `(surfaces, lemmas, pos)` queries whose
+        frequencies are added to `ngram` by `add_counts`, in the same order:
+        each word, then the whole n-gram and each bigram, if requested.
+
         @param ngram The `Ngram` that is being counted.
     """
-    global get_freq_function, freq_name, count_joint_frequency, count_bigrams
+    global count_joint_frequency, count_bigrams
     ( c_surfaces, c_lemmas, c_pos ) = ( [], [], [] )
+    queries = []
     for w in ngram:
         c_surfaces.append(w.surface)
         c_lemmas.append(w.lemma)
         c_pos.append(w.pos)
-        freq_value = get_freq_function([w.surface],
-                                       [w.lemma],
-                                       [w.pos])
-        w.add_frequency(Frequency(freq_name, freq_value))
+        queries.append(([w.surface], [w.lemma], [w.pos]))
     # Global frequency
     if count_joint_frequency:
-        freq_value = get_freq_function(c_surfaces, c_lemmas, c_pos)
-        ngram.add_frequency(Frequency(freq_name, freq_value))
+        queries.append((c_surfaces, c_lemmas, c_pos))
     # Bigrams frequency
     if count_bigrams:
         i = 0
         while i < len(ngram) - 1:
-            freq_value = get_freq_function(c_surfaces[i:i + 2],
-                                           c_lemmas[i:i + 2], c_pos[i:i + 2])
+            queries.append((c_surfaces[i:i + 2], c_lemmas[i:i + 2],
+                            c_pos[i:i + 2]))
             i = i + 1
-            ngram.add_bigram(Frequency(freq_name, freq_value))
+    return queries
 
 
 ################################################################################
 
-def get_freq_index(surfaces, lemmas, pos):
+def add_counts(ngram, backend_freqs):
     """
-        Gets the frequency (number of occurrences) of a token (word) in the
-        index file. Calling this function assumes that you called the script
-        with the -i option and with a valid index file.
-        
-        @param surfaces A string corresponding to the surface form of a word.
-
-        @param lemmas A string corresponding to the lemma of a word.
-        
-        @param pos A string corresponding to the Part Of Speech of a word.
-    """
-    global build_entry, suffix_array
-    ngram_ids = []
-    #pdb.set_trace()
-    for i in range(len(surfaces)):
-        word = build_entry(surfaces[i], lemmas[i], pos[i])
-        wordid = suffix_array.symbols.symbol_to_number.get(word, None)
-        if wordid:
-            ngram_ids.append(wordid)
-        else:
-            return 0
+        Appends the frequencies of the queries returned by `ngram_queries`
+        to the frequency lists of `ngram` and of its words.
 
-    #i_last = binary_search(ng_ids, ngrams_file,corpus_file,lambda a, b:a > b)
-    #i_first = binary_search(ng_ids, ngrams_file,corpus_file,lambda a, b:a >= b)
-    indexrange = suffix_array.find_ngram_range(ngram_ids)
-    if indexrange is not None:
-        first, last = indexrange
-        return last - first + 1
-    else:
-        return 0
+        @param ngram The `Ngram` that is being counted.
+
+        @param backend_freqs A list with, for each backend, the list of
+        frequencies of the queries, as returned by `count_queries`.
+    """
+    global count_joint_frequency, count_bigrams
+    for backend, freqs in zip(backends, backend_freqs):
+        freqs = iter(freqs)
+        for w in ngram:
+            w.add_frequency(Frequency(backend.name, next(freqs)))
+        if count_joint_frequency:
+            ngram.add_frequency(Frequency(backend.name, next(freqs)))
+        if count_bigrams:
+            for i in range(len(ngram) - 1):
+                ngram.add_bigram(Frequency(backend.name, next(freqs)))
 
 
 ################################################################################
 
-def get_freq_web(surfaces, lemmas, pos):
+def count_queries(queries):
     """
-        Gets the frequency (number of occurrences) of a token (word) in the
-        Web through Yahoo's or Google's index. Calling this function assumes 
-        that you called the script with the -u or -w option.
-        
-        @param surfaces A list corresponding to the surface forms of a word.
-
-        @param lemmas A list corresponding to the lemmas of a word.
-        
-        @param pos A list corresponding to the Part Of Speeches of a word. This
-        parameter is ignored since Web search engines dos no provide linguistic 
-        information.
+        Returns, for each backend, the list of frequencies of a list of
+        `(surfaces, lemmas, pos)` queries. When there are several backends,
+        those that wait for I/O are queried in threads, while the local ones
+        are queried in the meantime.
     """
-    # POS is ignored
-    global web_freq, build_entry, language
-    search_term = ""
-    for i in range(len(surfaces)):
-        search_term = search_term + build_entry(surfaces[i], lemmas[i],
-                                                pos[i]) + " "
-    return web_freq.search_frequency(search_term.strip(), language)
+    pool = get_thread_pool()
+    if pool is None:
+        return [backend.count(queries) for backend in backends]
+    results = [pool.apply_async(count_in_thread, (backend, queries))
+               if not backend.local else None for backend in backends]
+    backend_freqs = []
+    for backend, result in zip(backends, results):
+        if result is None:
+            backend_freqs.append(backend.count(queries))
+        else:
+            (ok, value) = result.get()
+            if not ok:
+                raise value[0], value[1], value[2]
+            backend_freqs.append(value)
+    return backend_freqs
 
 
 ################################################################################
 
-def read_file(path):
-    fh = open(path)
-    txt = fh.read()
-    fh.close()
-    return txt
+def count_in_thread(backend, queries):
+    """
+        Thread function for `count_queries`. Returns `(True, freqs)`, or
+        `(False, exc_info)` if `backend.count` raised any exception
+        (including the `SystemExit` of `error`, which would otherwise kill
+        the thread silently), to be raised again in the calling thread.
+    """
+    try:
+        return (True, backend.count(queries))
+    except BaseException:
+        return (False, sys.exc_info())
 
 
 ################################################################################
 
-def get_freq_web1t(surfaces, lemmas, pos):
+def get_thread_pool():
     """
-        Gets the frequency (number of occurrences) of an ngram in Google's
-        Web 1T 5-gram Corpus.
+        Returns the thread pool used by `count_queries`, or None if the
+        backends are not worth querying concurrently. The pool is created in
+        each process that needs it, as threads do not survive a fork
+        (see option --jobs).
     """
-
-    global build_entry, web1t_data_path
-
-    length = len(surfaces)
-
-    if length > 5:
-        warn("Cannot count the frequency of an n-gram, n>5!")
-        return 0
-
-    search_term = ' '.join(map(build_entry, surfaces, lemmas, pos))
-
-    # Find the file in which to look for the ngram.
-    if length == 1:
-        filename = web1t_data_path + "/1gms/vocab.gz"
-    else:
-        indexfile = web1t_data_path + "/%dgms/%dgm.idx" % (length, length)
-        filenames = [x.split("\t") for x in read_file(indexfile).split("\n")]
-        filename = None
-        for (name, first) in filenames:
-            # Assumes byte-value-based ordering!
-            if first > search_term:
-                break
-            else:
-                filename = name
-
-        if filename is None:
-            return 0
-        filename = "%s/%dgms/%s" % (web1t_data_path, length, filename)
-
-    verbose("WEB1T: Opening %s, looking for %s" % (filename, search_term))
-
-    # This has been absurdly slow in Python.
-    #file = gzip.open(filename, "rb")
-    #
-    #search_term += "\t"
-    #freq = 0
-    #
-    #for line in file:
-    #    if line.startswith(search_term):
-    #        freq = int(line.split("\t")[1])
-    #        break
-    #
-    #print >>sys.stderr, "buenito: %d" % freq
-    #
-    #file.close()
-
-    file = subprocess.Popen(
-        ["zgrep", "--", "^" + re.escape(search_term) + "\t", filename],
-        stdout=subprocess.PIPE).stdout
-    line = file.read()
-    file.close()
-    if line:
-        freq = int(line.split("\t")[1])
-    else:
-        freq = 0
-    verbose("freq =" + str(freq))
-    return freq
+    global thread_pool, thread_pool_pid
+    n_threads = len([backend for backend in backends if not backend.local])
+    if len(backends) < 2 or n_threads == 0:
+        return None
+    if thread_pool is None or thread_pool_pid != os.getpid():
+        thread_pool = ThreadPool(n_threads)
+        thread_pool_pid = os.getpid()
+    return thread_pool
 
 
 ################################################################################
 
-def open_index(prefix):
-    """
-    Open the index files (valid index created by the `index.py` script). 
-    @param prefix The string name of the index file.
-    """
-    global freq_name, the_corpus_size
-    global index, suffix_array
-    assert prefix.endswith(".info")
-    prefix = prefix[:-len(".info")]
-    try:
-        verbose("Loading index files... this may take some time.")
-        index = Index(prefix)
-        index.load_metadata()
-        freq_name = re.sub(".*/", "", prefix)
-        #pdb.set_trace()
-        the_corpus_size = index.metadata["corpus_size"]
-    except IOError:
-        error("Error opening the index.\nTry again with another index filename")
-    except KeyError:
-        error("Error opening the index.\nTry again with another index filename")
+def read_file(path):
+    fh = open(path)
+    txt = fh.read()
+    fh.close()
+    return txt
+
 
 ################################################################################
 
 def treat_text( line ):
     """
-        Treats a text file by getting the frequency of the lines. Useful for 
+        Treats a text file by getting the frequency of the lines. Useful for
         quick web queries from a text file containing one query per line.
-        
+
         @param line Lines (queries) being read from file or stdin.
     """
-    global web_freq
     query = line.strip()
-    count = str(web_freq.search_frequency(query))
+    count = str(backends[0].web_freq.search_frequency(query))
     print(query + "\t" + count)
 
 ################################################################################
@@ -425,67 +1130,53 @@ def treat_text( line ):
 def treat_options(opts, arg, n_arg, usage_string):
     """
         Callback function that handles the command line options of this script.
-        
+
         @param opts The options parsed by getopts. Ignored.
-        
+
         @param arg The argument list parsed by getopts.
-        
-        @param n_arg The number of arguments expected for this script.    
+
+        @param n_arg The number of arguments expected for this script.
     """
-    global cache_file, get_freq_function, build_entry, web_freq
-    global the_corpus_size, freq_name
     global low_limit, up_limit
     global count_vars
     global language
-    global suffix_array
     global count_joint_frequency
     global count_bigrams
-    global web1t_data_path
+    global filter_limit, freq_cache
+    global memo_size, jobs
+    global web_threads, web_rate
     global filetype_corpus_ext
     global filetype_candidates_ext
     global output_filetype_ext
 
     surface_flag = False
     ignorepos_flag = False
-    mode = []
+    sources = []  # (option, argument) of each backend, in the given order
+    freq_cache_path = None
+    freq_cache_size = None
 
     treat_options_simplest(opts, arg, n_arg, usage_string)
 
     for ( o, a ) in opts:
         if o in ( "-i", "--index" ):
-            open_index(a)
-            get_freq_function = get_freq_index
-            mode.append("index")
+            sources.append(("index", a))
         elif o in ( "-y", "--yahoo" ):
             error("THIS OPTION IS DEPRECATED AS YAHOO SHUT DOWN THEIR FREE "
                   "SEARCH API")
-            #web_freq = YahooFreq()          
+            #web_freq = YahooFreq()
             #freq_name = "yahoo"
-            #ignorepos_flag = True 
-            #the_corpus_size = web_freq.corpus_size()         
+            #ignorepos_flag = True
+            #the_corpus_size = web_freq.corpus_size()
             #get_freq_function = get_freq_web
-            #mode.append( "yahoo" )   
+            #mode.append( "yahoo" )
         elif o in ( "-w", "--google" ):
-            web_freq = GoogleFreq()
-            freq_name = "google"
-            ignorepos_flag = True
-            the_corpus_size = web_freq.corpus_size()
-            get_freq_function = get_freq_web
-            mode.append("google")
+            sources.append(("google", None))
         elif o in ( "-u", "--univ" ):
-            web_freq = GoogleFreqUniv(a)
-            freq_name = "google"
-            ignorepos_flag = True
-            the_corpus_size = web_freq.corpus_size()
-            get_freq_function = get_freq_web
-            mode.append("google")
+            sources.append(("univ", a))
         elif o in ("-T", "--web1t"):
-            ignorepos_flag = True
-            freq_name = "web1t"
-            web1t_data_path = a
-            the_corpus_size = int(read_file(web1t_data_path + "/1gms/total"))
-            get_freq_function = get_freq_web1t
-            mode.append("web1t")
+            sources.append(("web1t", a))
+        elif o == "--corpus":
+            sources.append(("corpus", a))
         elif o in ("-s", "--surface" ):
             surface_flag = True
         elif o in ("-g", "--ignore-pos"):
@@ -517,6 +1208,50 @@ def treat_options(opts, arg, n_arg, usage_string):
             count_bigrams = True
         elif o in ("-o", "--old"):
             Index.use_c_indexer(False)
+        elif o == "--filter-limit":
+            try:
+                filter_limit = int(a)
+            except ValueError:
+                error("Argument of --filter-limit must be an integer")
+        elif o == "--cache-size":
+            try:
+                memo_size = int(a)
+                if memo_size < 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --cache-size must be a non-negative "
+                      "integer")
+        elif o == "--web-threads":
+            try:
+                web_threads = int(a)
+                if web_threads <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --web-threads must be a positive integer")
+        elif o == "--web-rate":
+            try:
+                web_rate = float(a)
+                if web_rate < 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --web-rate must be a non-negative number")
+        elif o == "--jobs":
+            try:
+                jobs = int(a)
+                if jobs <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --jobs must be a positive integer")
+        elif o == "--freq-cache":
+            freq_cache_path = a
+        elif o == "--freq-cache-size":
+            try:
+                freq_cache_size = int(a) * 1024 * 1024
+                if freq_cache_size <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --freq-cache-size must be a positive "
+                      "integer")
         elif o == "--corpus-from":
             filetype_corpus_ext = a
         elif o == "--candidates-from":
@@ -526,30 +1261,47 @@ def treat_options(opts, arg, n_arg, usage_string):
         else:
             raise Exception("Bad arg: " + o)
 
-    if mode == ["index"]:
-        if surface_flag and ignorepos_flag:
-            build_entry = lambda surface, lemma, pos: surface
-            suffix_array = index.load("surface")
-        elif surface_flag:
-            build_entry = lambda surface, lemma, pos: surface +\
-                                                      ATTRIBUTE_SEPARATOR + pos
-            suffix_array = index.load("surface+pos")
-        elif ignorepos_flag:
-            build_entry = lambda surface, lemma, pos: lemma
-            suffix_array = index.load("lemma")
+    if not sources:
+        error("At least one option -u, -w, -T, -i or --corpus must be "
+              "provided")
+    kinds = [kind if not (kind == "index" and a.startswith(SERVER_PATH_PREFIX))
+             else "server" for (kind, a) in sources]
+    if jobs > 1 and not set(kinds) <= set(["index", "server", "web1t",
+                                           "corpus"]):
+        error("Option --jobs only works with -i, -T and --corpus")
+    if freq_cache_path is not None:
+        if "index" not in kinds:
+            error("Option --freq-cache only works with -i")
+        if freq_cache_size is None:
+            freq_cache = FreqCache(freq_cache_path)
         else:
-            build_entry = lambda surface, lemma, pos: lemma +\
-                                                      ATTRIBUTE_SEPARATOR + pos
-            suffix_array = index.load("lemma+pos")
-
-    else:  # Web search, entries are single surface or lemma forms
-        if surface_flag:
-            build_entry = lambda surface, lemma, pos: surface
+            freq_cache = FreqCache(freq_cache_path, freq_cache_size)
+
+    for kind, (_, a) in zip(kinds, sources):
+        if kind == "index":
+            backend = IndexBackend(a, surface_flag, ignorepos_flag)
+        elif kind == "server":
+            backend = ServerBackend(a, surface_flag, ignorepos_flag)
+        elif kind == "corpus":
+            backend = CorpusBackend(a, surface_flag, ignorepos_flag)
+        elif kind == "google":
+            backend = WebBackend(GoogleFreq(), surface_flag)
+        elif kind == "univ":
+            backend = WebBackend(GoogleFreqUniv(a), surface_flag)
         else:
-            build_entry = lambda surface, lemma, pos: lemma
-
-    if len(mode) != 1:
-        error("Exactly one option -u, -w or -i, must be provided")
+            store_path = os.path.join(a, WEB1T_STORE_NAME)
+            if os.path.isfile(a):
+                store_path = a
+            if os.path.isfile(store_path):
+                backend = Web1TStoreBackend(store_path, surface_flag)
+            else:
+                warn("No Web 1T store found in {path}; run index_web1t.py "
+                     "on it for much faster counting", path=a)
+                backend = Web1TBackend(a, surface_flag)
+        if backend.name in [other.name for other in backends]:
+            error("Two corpora are named {name}: their frequencies would "
+                  "be mixed up", name=backend.name)
+        backends.append(backend)
     #elif text_input and web_freq is None:
     #    warn("-x option is recommended for web queries, not textual indices")
 
@@ -560,7 +1312,9 @@ def treat_options(opts, arg, n_arg, usage_string):
 longopts = ["candidates-from=", "corpus-from=", "to=",
             "yahoo", "google", "index=", "ignore-pos", "surface", "old",
             "lower=", "upper=", "vars", "lang=", "no-joint", "bigrams",
-            "univ=", "web1t="]
+            "univ=", "web1t=", "filter-limit=", "cache-size=", "jobs=",
+            "freq-cache=", "freq-cache-size=", "corpus=", "web-threads=",
+            "web-rate="]
 args = read_options("ywi:gsoal:Jbu:T:", longopts,
         treat_options, -1, usage_string)
 
@@ -568,5 +1322,7 @@ try:
     verbose("Counting ngrams in candidates file")
     filetype.parse(args, CounterPrinter(), filetype_candidates_ext)
 finally:
-    if web_freq:
-        web_freq.flush_cache()  # VERY IMPORTANT!
+    for backend in backends:
+        backend.close()
+    if freq_cache:
+        freq_cache.flush()
@@ -0,0 +1,211 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# freq_server.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This script loads one or more indices (created by `index.py`) and keeps
+    them in memory, answering frequency queries over a Unix domain socket.
+    This avoids reloading big indices in every `counter.py` run: use
+    `counter.py -i unix:<socket>` to count from the server.
+
+    For more information, call the script with no parameter and read the
+    usage instructions.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import os
+import re
+import signal
+import stat
+import sys
+import SocketServer
+import threading
+
+from libs.util import read_options, treat_options_simplest, verbose, error
+from libs.base.freq_client import send_message, read_message
+from libs.filetype.indexlib import Index, index_basepath
+
+################################################################################
+# GLOBALS
+
+usage_string = """Usage:
+
+python {program} OPTIONS -s <socket> -i <index> [-i <index> ...]
+
+-i <index> OR --index <index>
+    Serve the frequencies of this index. It must be given as the path to the
+    `.info` file (or `.mwi` container) of a BinaryIndex. The index is known by
+    the name of the file without its extension (e.g. "corpus" for
+    "dir/corpus.info"). This option can be repeated.
+
+-s <socket> OR --socket <socket>
+    Listen on the Unix domain socket <socket>. Clients connect to it with
+    `counter.py -i unix:<socket>`, or `unix:<socket>#<name>` if the server
+    has several indices.
+
+OPTIONS may be:
+
+-a <attrs> OR --attributes <attrs>
+    Load the given attributes (colon-separated, e.g. lemma:pos:lemma+pos)
+    of every index at startup. Other attributes are loaded on their first
+    query. By default, nothing is loaded before the first query.
+
+{common_options}
+
+The server runs until it is interrupted (e.g. with Ctrl+C or SIGTERM).
+"""
+indexes = {}  # name -> Index
+socket_path = None
+preload_attributes = []
+index_lock = threading.Lock()
+
+
+################################################################################
+
+class FreqRequestHandler(SocketServer.StreamRequestHandler):
+    """
+        Answers the requests of one client connection, until the client
+        closes it. See `libs.base.freq_client` for the protocol.
+    """
+
+    def handle(self):
+        while True:
+            try:
+                message = read_message(self.rfile)
+            except ValueError:
+                send_message(self.wfile, {"error": "Malformed request"})
+                continue
+            if message is None:
+                return
+            try:
+                send_message(self.wfile, answer(message))
+            except Exception as err:
+                send_message(self.wfile, {"error": unicode(err)})
+
+
+################################################################################
+
+class FreqServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+
+################################################################################
+
+def answer(message):
+    """
+        Returns the response to a request message.
+    """
+    op = message.get("op")
+    if op == "info":
+        return {"indexes": dict((name, index.metadata["corpus_size"])
+                                for (name, index) in indexes.iteritems())}
+    elif op == "count":
+        index = indexes.get(message.get("index"))
+        if index is None:
+            return {"error": "Unknown index: %s" % message.get("index")}
+        attr = message["attr"]
+        # Loading (or fusing) an attribute must only be done once
+        with index_lock:
+            if index.load(attr) is None:
+                return {"error": "Attribute %s not in index" % attr}
+        return {"freqs": [index.frequency(attr, ngram)
+                          for ngram in message["ngrams"]]}
+    else:
+        return {"error": "Unknown operation: %s" % op}
+
+
+################################################################################
+
+def open_index(path):
+    """
+        Opens an index given the path of its `.info` or `.mwi` file.
+    """
+    prefix = index_basepath(path)
+    name = re.sub(".*/", "", prefix)
+    if name in indexes:
+        error("Two indices are named {name}", name=name)
+    verbose("Loading index " + path)
+    index = Index(prefix)
+    try:
+        index.load_metadata()
+    except IOError:
+        error("Error opening the index {path}", path=path)
+    indexes[name] = index
+
+
+################################################################################
+
+def treat_options( opts, arg, n_arg, usage_string ) :
+    """
+        Callback function that handles the command line options of this script.
+
+        @param opts The options parsed by getopts. Ignored.
+
+        @param arg The argument list parsed by getopts.
+
+        @param n_arg The number of arguments expected for this script.
+    """
+    global socket_path, preload_attributes
+
+    treat_options_simplest( opts, arg, n_arg, usage_string )
+
+    for ( o, a ) in opts:
+        if o in ("-i", "--index"):
+            open_index(a)
+        elif o in ("-s", "--socket"):
+            socket_path = a
+        elif o in ("-a", "--attributes"):
+            preload_attributes = a.split(":")
+
+    if not indexes:
+        error("You must provide at least one index with -i")
+    if socket_path is None:
+        error("You must provide the path of the socket with -s")
+
+
+################################################################################
+# MAIN SCRIPT
+
+longopts = ["index=", "socket=", "attributes="]
+arg = read_options( "i:s:a:", longopts, treat_options, 0, usage_string )
+
+for index in indexes.values():
+    for attr in preload_attributes:
+        index.load(attr)
+
+if os.path.exists(socket_path):
+    if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+        error("{path} exists and is not a socket", path=socket_path)
+    os.remove(socket_path)  # Left by a previous server
+server = FreqServer(socket_path, FreqRequestHandler)
+signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+verbose("Listening on " + socket_path)
+try:
+    server.serve_forever()
+finally:
+    server.server_close()
+    os.remove(socket_path)
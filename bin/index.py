@@ -61,6 +61,24 @@ OPTIONS may be:
 -o OR --old
     Use the old (slower) Python indexer, even when the C indexer is available.
 
+-r OR --reverse
+    Also generate reverse suffix arrays (<index>.<attr>.rsuffix), sorted by
+    the words read from right to left. They allow ngrams to be extended to
+    the left as efficiently as to the right.
+
+-t <n> OR --top-ngrams <n>
+    Also generate a table of the <n> most frequent unigrams and bigrams of
+    each attribute (<index>.<attr>.topngrams). Their frequencies are then
+    read directly from the table, without searching the suffix array.
+    Each entry takes 12 bytes.
+
+-C OR --container
+    Store the whole index in a single container file, <index>.mwi, instead
+    of one file per attribute. The container can be given wherever a
+    BinaryIndex `.info` file is accepted. Fused attributes of a previous
+    container at the same path are kept, and rebuilt on demand if the corpus
+    has changed.
+
 --from <input-filetype-ext>
     Force reading of corpus with given filetype extension.
     (By default, file type is automatically detected):
@@ -96,6 +114,9 @@ OPTIONS may be:
 use_text_format = None
 input_filetype_ext = None
 basename = None
+use_container = False
+build_reverse = False
+top_ngrams_budget = 0
 
 
 ################################################################################
@@ -115,6 +136,9 @@ def treat_options( opts, arg, n_arg, usage_string ) :
     global build_entry
     global use_text_format
     global input_filetype_ext
+    global use_container
+    global build_reverse
+    global top_ngrams_budget
 
     treat_options_simplest( opts, arg, n_arg, usage_string )
 
@@ -132,6 +156,17 @@ def treat_options( opts, arg, n_arg, usage_string ) :
             use_text_format = "conll"            
         elif o in ("-o", "--old"):
             indexlib.Index.use_c_indexer(False)
+        elif o in ("-r", "--reverse"):
+            build_reverse = True
+        elif o in ("-t", "--top-ngrams"):
+            try:
+                top_ngrams_budget = int(a)
+                if top_ngrams_budget <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of " + o + " must be a positive integer")
+        elif o in ("-C", "--container"):
+            use_container = True
             
     if basename is None:     
         error("You must provide a filename for the index.\n"
@@ -141,8 +176,9 @@ def treat_options( opts, arg, n_arg, usage_string ) :
 ################################################################################
 # MAIN SCRIPT
 
-longopts = ["from=", "index=", "attributes=", "old", "moses", "conll" ]
-arg = read_options( "i:a:omc", longopts, treat_options, -1, usage_string )
+longopts = ["from=", "index=", "attributes=", "old", "moses", "conll",
+            "reverse", "top-ngrams=", "container" ]
+arg = read_options( "i:a:omcrt:C", longopts, treat_options, -1, usage_string )
 
 simple_attrs = [a for a in used_attributes if '+' not in a]
 composite_attrs = [a for a in used_attributes if '+' in a]
@@ -157,5 +193,13 @@ index = indexlib.Index(basename, simple_attrs)
 indexlib.populate_index(index, arg, input_filetype_ext)
 for attr in composite_attrs:
     index.make_fused_array(attr.split('+'))
+if build_reverse:
+    for attr in simple_attrs + composite_attrs:
+        index.make_reverse_array(attr)
+if top_ngrams_budget:
+    for attr in simple_attrs + composite_attrs:
+        index.make_top_ngrams(attr, top_ngrams_budget)
+if use_container:
+    index.pack(remove_files=True)
 #index.build_suffix_arrays()
 #index.save_main()
@@ -0,0 +1,100 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# index_web1t.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This script converts a copy of Google's Web 1T 5-gram corpus into a
+    compact local store of ngram counts, which `counter.py -T` searches
+    instead of decompressing the original gzipped files on every query.
+    The conversion only needs to be done once.
+
+    For more information, call the script with no parameter and read the
+    usage instructions.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import os
+
+from libs.util import read_options, treat_options_simplest, verbose
+from libs.base.web1tFreq import build_web1t_store, WEB1T_STORE_NAME
+
+################################################################################
+# GLOBALS
+
+usage_string = """Usage:
+
+python {program} OPTIONS <web1t-dir>
+
+The <web1t-dir> directory must contain the union of the contents of the
+data/ directories of each corpus CD as distributed by Google, i.e. the
+1gms/ to 5gms/ subdirectories.
+
+OPTIONS may be:
+
+-o <store> OR --output <store>
+    Write the store to the file <store>. The default is to write it to
+    <web1t-dir>/""" + WEB1T_STORE_NAME + """, where `counter.py -T <web1t-dir>`
+    finds it automatically. Otherwise, give the store file itself to -T.
+
+{common_options}
+"""
+store_path = None
+
+
+################################################################################
+
+def treat_options( opts, arg, n_arg, usage_string ) :
+    """
+        Callback function that handles the command line options of this script.
+
+        @param opts The options parsed by getopts. Ignored.
+
+        @param arg The argument list parsed by getopts.
+
+        @param n_arg The number of arguments expected for this script.
+    """
+    global store_path
+
+    treat_options_simplest( opts, arg, n_arg, usage_string )
+
+    for ( o, a ) in opts:
+        if o in ("-o", "--output"):
+            store_path = a
+
+
+################################################################################
+# MAIN SCRIPT
+
+longopts = ["output="]
+arg = read_options( "o:", longopts, treat_options, 1, usage_string )
+
+web1t_path = arg[0]
+if store_path is None:
+    store_path = os.path.join(web1t_path, WEB1T_STORE_NAME)
+verbose("Converting %s into %s" % (web1t_path, store_path))
+build_web1t_store(web1t_path, store_path)
+verbose("Done.")
@@ -23,11 +23,12 @@
 #
 ################################################################################
 """
-    This script joins two web frequency cache files. These files are generated
-    by counter.py and store the Google or Yahoo word and ngram counts. If two
-    cache entries have the same value, the newest one is kept. Joining cache
-    files from Yahoo and from Google in a single file is not recommended since
-    these two search engines have different index sizes and counts.
+    This script joins two or more web frequency cache files. These files are
+    generated by counter.py and store the Google or Yahoo word and ngram
+    counts. If several cache entries have the same key, the newest one is
+    kept. Joining cache files from Yahoo and from Google in a single file is
+    not recommended since these two search engines have different index
+    sizes and counts.
     
     For more information, call the script with no parameter and read the
     usage instructions.
@@ -38,9 +39,13 @@ from __future__ import print_function
 from __future__ import unicode_literals
 from __future__ import absolute_import
 
-import cPickle
+import heapq
+import itertools
+import os
 
-from libs.util import read_options, treat_options_simplest, verbose
+from libs.util import read_options, treat_options_simplest, verbose, \
+    error
+from libs.base.web_cache import WebCache
                  
 #from base.__common import TEMP_PREFIX, TEMP_FOLDER
      
@@ -49,54 +54,69 @@ from libs.util import read_options, treat_options_simplest, verbose
      
 usage_string = """Usage: 
     
-python {program} OPTIONS <cache1.dat> <cache2.dat> <cache_out.dat>
+python {program} OPTIONS <cache1.dat> <cache2.dat> [<cache3.dat> ...] <cache_out.dat>
 
 OPTIONS may be:
 
 {common_options}
 
     The <cache*.dat> files must be generated by counter.py, and should be
-    different from each other.
+    different from each other. Cache files of the old (pickled) format are
+    converted when read. If <cache_out.dat> exists, it is overwritten, so
+    it must not be one of the input caches.
+    The caches are read in the order of their keys and merged as they are
+    read, so memory does not depend on their size.
 """       
 
 ################################################################################
 
-def combine_caches( cache1, cache2, cache_out ) :
+def combine_caches( caches, cache_out ) :
     """
-        Given two web caches, generates a third one which is the union of the
-        first two. If a key is contained in both caches, then the value of the
-        most recent one is kept and the oldest is discarded. If they are both
-        from the same date, the value from cache1 is kept.
+        Given several web caches, generates another one which is their
+        union. If a key is contained in several caches, then the value of the
+        most recent one is kept and the oldest are discarded. If they are
+        from the same date, the value from the first of these caches is kept.
+
+        Entries are read from each cache sorted by key (see
+        `WebCache.iteritems`), and merged in a single pass (k-way merge), so
+        that each key is written to `cache_out` as soon as all of its entries
+        have been read.
     """    
-    # First, copy all entries from cache1 to cache_out
-    for k1 in cache1.keys() :
-        cache_out[ k1 ] = cache1[ k1 ]   
-    # Update entries in cache_out if corresponding entry in cache_2 is newer
-    for k2 in cache2.keys() :        
-        ( freq2, date2 ) = cache2[ k2 ]
-        ( freq_out, date_out ) = cache_out.get( k2, ( -1, None ) )
-        if date_out is None :
-            cache_out[ k2 ] = ( freq2, date2 )
-        elif date2 < date_out :
-            cache_out[ k2 ] = ( freq2, date2 )
+    # ( key, number of the cache, ( freq, date ) ), sorted by key then cache
+    entries = heapq.merge( *[ ( ( key, i, entry )
+                                for ( key, entry ) in cache.iteritems() )
+                              for ( i, cache ) in enumerate( caches ) ] )
+    def newest_entries() :
+        for key, group in itertools.groupby( entries, lambda e: e[ 0 ] ) :
+            ( freq, date ) = next( group )[ 2 ]
+            for ( _, _, ( other_freq, other_date ) ) in group :
+                if other_date > date :
+                    ( freq, date ) = ( other_freq, other_date )
+            yield ( key, ( freq, date ) )
+    cache_out.update( newest_entries() )
 
 ################################################################################     
 # MAIN SCRIPT
 
 longopts = []
-arg = read_options( "", longopts, treat_options_simplest, 3, usage_string )
+arg = read_options( "", longopts, treat_options_simplest, -1, usage_string )
+if len( arg ) < 3 :
+    error( "You must provide at least two input caches and an output cache" )
 
 verbose( "Opening files and checking consistency" )
-cache1_desc = open( arg[ 0 ], "r" )
-cache2_desc = open( arg[ 1 ], "r" )
-cache_out_desc = open( arg[ 2 ], "w" )
-cache1 = cPickle.load( cache1_desc )
-cache2 = cPickle.load( cache2_desc )
-cache_out = {}
+for path in arg[ :-1 ] :
+    if not os.path.isfile( path ) :
+        error( "Web cache file {path} not found", path=path )
+    if os.path.exists( arg[ -1 ] ) and os.path.samefile( path, arg[ -1 ] ) :
+        error( "Output cache {path} is also an input cache", path=path )
+caches = [ WebCache( path ) for path in arg[ :-1 ] ]
+if os.path.exists( arg[ -1 ] ) :
+    os.remove( arg[ -1 ] )
+cache_out = WebCache( arg[ -1 ] )
 verbose( "Combining cache files..." )
-combine_caches( cache1, cache2, cache_out )
-verbose( "Writing new cache file..." )
-cPickle.dump( cache_out, cache_out_desc )
-verbose( "{c} had {n} entries".format(c=arg[ 0 ], n=len(cache1)) )
-verbose( "{c} had {n} entries".format(c=arg[ 1 ], n=len(cache2)) )
+combine_caches( caches, cache_out )
+for path, cache in zip( arg, caches ) :
+    verbose( "{c} had {n} entries".format(c=path, n=len(cache)) )
 verbose( "Result has {n} entries".format(n=len(cache_out)) )
+for cache in caches + [ cache_out ] :
+    cache.close()
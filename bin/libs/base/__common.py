@@ -53,6 +53,25 @@ DEFAULT_LANG = "en"
 """
 MAX_CACHE_DAYS = -1
 
+"""
+    Number of Web queries sent at once when counting a list of candidates,
+    and maximum number of queries per second (zero or negative for no limit).
+    Queries that fail are tried again up to `WEB_QUERY_TRIES` times, waiting
+    `WEB_RETRY_DELAY` seconds, then twice as long each time.
+"""
+WEB_QUERY_THREADS = 4
+WEB_QUERY_RATE = 2
+WEB_QUERY_TRIES = 5
+WEB_RETRY_DELAY = 2
+
+"""
+    URL of the search service of the Google University Research Program
+    (counter.py -u). The environment variable MWETOOLKIT_GOOGLE_UNIV_URL
+    replaces it, e.g. to test against a local stand-in server.
+"""
+GOOGLE_UNIV_URL = os.environ.get("MWETOOLKIT_GOOGLE_UNIV_URL",
+        "https://research.google.com/university/search/service")
+
 """
     Application ID to be used with Yahoo Web Search API (see specific doc. for
     more details)
@@ -74,6 +93,13 @@ C_INDEXER_PROGRAM = os.path.dirname(__file__.decode('utf-8')) + "/../../c-indexe
 YAHOO_CACHE_FILENAME = "yahoo_cache.dat"
 GOOGLE_CACHE_FILENAME = "google_cache.dat"
 
+"""
+    Default maximum size, in bytes, of the frequency cache file of counter.py
+    (option --freq-cache). The least recently used entries are evicted when
+    the file grows larger than this.
+"""
+FREQ_CACHE_MAX_SIZE = 64 * 1024 * 1024
+
 """
     Characters internally used as attribute and word separators.
     Must not appear in the corpus, neither as a word, nor as POS tag etc!
@@ -0,0 +1,297 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# freq_cache.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This module provides the `FreqCache` class, a persistent cache of ngram
+    frequencies computed from an index. It allows repeated runs of
+    `counter.py` over overlapping candidate lists to skip the frequencies
+    that have already been computed for the same index. It also provides
+    `LRUCache`, a bounded in-memory cache used within a single run.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import array
+import collections
+import os
+import struct
+import tempfile
+
+from .__common import FREQ_CACHE_MAX_SIZE
+from ..util import verbose, error
+
+################################################################################
+
+FREQ_CACHE_MAGIC = b"MWETKFQ1"
+# Length of the key, frequency
+FREQ_CACHE_RECORD = struct.Struct(b"<Hq")
+
+################################################################################
+
+class FreqCache(object):
+    """
+        A `FreqCache` is stored as an append-only log of `(key, frequency)`
+        records, which is read into a hash table when the cache is opened.
+        New entries are appended to the log when the cache is flushed, so
+        the log grows with the number of entries, not of lookups. A hit only
+        moves its entry to the end of the in-memory order (least recently
+        used first), which is written to disk when the log exceeds its
+        maximum size and is compacted, keeping only the most recently used
+        entries. Between compactions, a reopened cache has its entries in
+        the order in which they were added: the hits of the runs since the
+        last compaction are not remembered. Keys contain the content
+        checksum of the index (see `Index.content_checksum`), so entries
+        computed from an older version of an index are never served: they
+        are simply not used anymore, and are among the first to go when
+        the log is compacted.
+    """
+
+################################################################################
+
+    def __init__(self, path, max_size=FREQ_CACHE_MAX_SIZE):
+        """
+            Opens the cache stored at `path`, creating it if it does not
+            exist.
+
+            @param path The path of the cache file.
+
+            @param max_size Maximum size of the cache file, in bytes.
+        """
+        self.path = path
+        self.max_size = max_size
+        # key -> frequency, least recently used first
+        self.entries = collections.OrderedDict()
+        self.new_entries = []
+        self.hit_keys = None  # Set of the keys hit by `get`, if recorded
+        self.log_size = 0
+        self.hits = 0
+        self.lookups = 0
+        if os.path.isfile(path):
+            self.read_log()
+
+################################################################################
+
+    def read_log(self):
+        """
+            Loads the entries of the log into the hash table. A truncated
+            record at the end of the log (e.g. after a crash) is ignored and
+            will be overwritten by the next flush.
+        """
+        with open(self.path, "rb") as log:
+            data = log.read()
+        if data[:len(FREQ_CACHE_MAGIC)] != FREQ_CACHE_MAGIC:
+            error("{path} is not a frequency cache file", path=self.path)
+        position = len(FREQ_CACHE_MAGIC)
+        while position + FREQ_CACHE_RECORD.size <= len(data):
+            key_length, freq = FREQ_CACHE_RECORD.unpack_from(data, position)
+            end = position + FREQ_CACHE_RECORD.size + key_length
+            if end > len(data):
+                break
+            key = data[position + FREQ_CACHE_RECORD.size:end]
+            self.entries.pop(key, None)
+            self.entries[key] = freq
+            position = end
+        self.log_size = position
+        verbose("Frequency cache %s: %d entries" % (self.path,
+                                                    len(self.entries)))
+
+################################################################################
+
+    def make_key(checksum, attr, ngram_ids):
+        """
+            Static method that returns the cache key of an ngram.
+
+            @param checksum The content checksum of the index.
+
+            @param attr The attribute (e.g. "lemma+pos") of the ngram.
+
+            @param ngram_ids A list of symbol numbers of `attr`.
+        """
+        return checksum + attr.encode("utf-8") + b"\0" + \
+                array.array(b"i", ngram_ids).tostring()
+
+    make_key = staticmethod(make_key)
+
+################################################################################
+
+    def get(self, key):
+        """
+            Returns the cached frequency for `key`, or None. Its key is added
+            to `self.hit_keys`, if it is not None.
+        """
+        self.lookups += 1
+        freq = self.touch(key)
+        if freq is not None:
+            self.hits += 1
+            if self.hit_keys is not None:
+                self.hit_keys.add(key)
+        return freq
+
+################################################################################
+
+    def touch(self, key):
+        """
+            Marks the entry of `key` as the most recently used one, and
+            returns its frequency, or None if there is no such entry.
+        """
+        freq = self.entries.pop(key, None)
+        if freq is not None:
+            self.entries[key] = freq
+        return freq
+
+################################################################################
+
+    def put(self, key, freq):
+        """
+            Adds an entry to the cache. It is written to the log by `flush`.
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = freq
+        self.new_entries.append(key)
+
+################################################################################
+
+    def flush(self):
+        """
+            Appends the new entries to the log, compacting it if it grows
+            larger than `self.max_size`. Should be called in a "finally"
+            block, so that entries are kept even if an exception occurs.
+        """
+        verbose("Frequency cache: %d hits in %d lookups" % (self.hits,
+                                                           self.lookups))
+        new_keys = collections.OrderedDict.fromkeys(self.new_entries)
+        records = [self.record(key, self.entries[key])
+                   for key in new_keys if key in self.entries]
+        self.new_entries = []
+        new_size = self.log_size + sum(len(r) for r in records)
+        if self.log_size and new_size <= self.max_size:
+            with open(self.path, "r+b") as log:
+                log.seek(self.log_size)
+                log.truncate()
+                for record in records:
+                    log.write(record)
+            self.log_size = new_size
+        else:
+            self.compact()
+
+################################################################################
+
+    def compact(self):
+        """
+            Rewrites the log with the most recently used entries that fit in
+            `self.max_size` bytes.
+        """
+        records = []
+        size = len(FREQ_CACHE_MAGIC)
+        for key in reversed(self.entries):
+            record = self.record(key, self.entries[key])
+            if size + len(record) > self.max_size:
+                break
+            records.append(record)
+            size += len(record)
+        if len(records) < len(self.entries):
+            verbose("Frequency cache: evicting %d entries" %
+                    (len(self.entries) - len(records)))
+        records.reverse()
+
+        dirname = os.path.dirname(os.path.abspath(self.path))
+        (fd, tmppath) = tempfile.mkstemp(dir=dirname, prefix=".freqcache-")
+        log = os.fdopen(fd, "wb")
+        try:
+            log.write(FREQ_CACHE_MAGIC)
+            for record in records:
+                log.write(record)
+            log.close()
+            os.chmod(tmppath, 0o644)
+            os.rename(tmppath, self.path)
+        except:
+            log.close()
+            os.remove(tmppath)
+            raise
+        self.log_size = size
+
+################################################################################
+
+    def record(self, key, freq):
+        """
+            Returns the log record of an entry, as a byte string.
+        """
+        return FREQ_CACHE_RECORD.pack(len(key), freq) + key
+
+
+################################################################################
+################################################################################
+
+class LRUCache(object):
+    """
+        A dictionary holding at most `max_entries` entries. When it is full,
+        adding an entry evicts the least recently used one. Lookups and hits
+        are counted in `self.lookups` and `self.hits`.
+    """
+
+################################################################################
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.lookups = 0
+        self.evictions = 0
+
+################################################################################
+
+    def get(self, key):
+        """
+            Returns the value for `key`, or None.
+        """
+        self.lookups += 1
+        value = self.entries.pop(key, None)
+        if value is not None:
+            self.entries[key] = value  # Most recently used
+            self.hits += 1
+        return value
+
+################################################################################
+
+    def put(self, key, value):
+        """
+            Adds an entry, evicting the least recently used one if needed.
+        """
+        self.entries.pop(key, None)
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+################################################################################
+
+    def report(self, name):
+        """
+            Prints the hit/miss statistics in verbose mode.
+        """
+        verbose("%s: %d hits, %d misses, %d evictions" % (name, self.hits,
+                self.lookups - self.hits, self.evictions))
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# freq_client.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This module provides the `FreqServerClient` class, which queries the
+    frequencies of ngrams from a `freq_server.py` process, and the functions
+    implementing the protocol between them.
+
+    Messages are JSON objects, one per line, over a Unix domain socket.
+    Each request gets exactly one response:
+
+    * {"op": "info"} -> {"indexes": {<name>: <corpus size>, ...}}
+    * {"op": "count", "index": <name>, "attr": <attribute>,
+       "ngrams": [[<value>, ...], ...]} -> {"freqs": [<freq>, ...]}
+
+    Values are those of `attr` for each word (e.g. for "lemma+pos", lemma and
+    POS joined by `ATTRIBUTE_SEPARATOR`). Errors are reported as
+    {"error": <message>}.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import json
+import os
+import socket
+
+from ..util import error
+
+################################################################################
+
+"""
+    Prefix of the index paths given to `counter.py -i` that designate a
+    frequency server, as in "unix:/path/to/socket".
+"""
+SERVER_PATH_PREFIX = "unix:"
+
+################################################################################
+
+def send_message(fileobj, message):
+    """
+        Writes a message (a JSON-serializable dictionary) to a socket file.
+    """
+    fileobj.write(json.dumps(message, ensure_ascii=True) + b"\n")
+    fileobj.flush()
+
+
+################################################################################
+
+def read_message(fileobj):
+    """
+        Reads a message from a socket file. Returns None at end of file.
+    """
+    line = fileobj.readline()
+    if not line:
+        return None
+    return json.loads(line)
+
+
+################################################################################
+
+class FreqServerClient(object):
+    """
+        Connection to a `freq_server.py` process. The connection is opened
+        on the first query of each process, so that a client can be shared
+        with processes forked afterwards (e.g. `counter.py --jobs`).
+    """
+
+################################################################################
+
+    def __init__(self, socket_path, index_name=None):
+        """
+            @param socket_path The path of the Unix domain socket on which
+            the server listens.
+
+            @param index_name The name of the index to query, among those
+            loaded by the server. May be None if the server has only one.
+        """
+        self.socket_path = socket_path
+        self.fileobj = None
+        self.pid = None
+        indexes = self.request({"op": "info"})["indexes"]
+        if index_name is None:
+            if len(indexes) != 1:
+                error("Server at {path} has several indexes ({names}); "
+                      "choose one with unix:{path}#<name>", path=socket_path,
+                      names=", ".join(sorted(indexes)))
+            index_name = indexes.keys()[0]
+        elif index_name not in indexes:
+            error("Server at {path} has no index named {name}",
+                  path=socket_path, name=index_name)
+        self.index_name = index_name
+        self.corpus_size = indexes[index_name]
+
+################################################################################
+
+    def from_path(path):
+        """
+            Static method that returns a client for a path of the form
+            "unix:<socket-path>" or "unix:<socket-path>#<index-name>".
+        """
+        path = path[len(SERVER_PATH_PREFIX):]
+        if "#" in path:
+            (path, index_name) = path.rsplit("#", 1)
+            return FreqServerClient(path, index_name)
+        return FreqServerClient(path)
+
+    from_path = staticmethod(from_path)
+
+################################################################################
+
+    def request(self, message):
+        """
+            Sends a request and returns the response.
+        """
+        if self.fileobj is None or self.pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+            except socket.error as err:
+                error("Cannot connect to frequency server at {path}: {err}",
+                      path=self.socket_path, err=err)
+            self.fileobj = sock.makefile("rwb")
+            sock.close()  # The file object keeps the connection open
+            self.pid = os.getpid()
+        send_message(self.fileobj, message)
+        response = read_message(self.fileobj)
+        if response is None:
+            error("Frequency server at {path} closed the connection",
+                  path=self.socket_path)
+        if "error" in response:
+            error("Frequency server error: {message}",
+                  message=response["error"])
+        return response
+
+################################################################################
+
+    def frequencies(self, attr, ngrams):
+        """
+            Returns the list of frequencies of `ngrams` (lists of values of
+            `attr`) in the index, with a single request.
+        """
+        return self.request({"op": "count", "index": self.index_name,
+                             "attr": attr, "ngrams": ngrams})["freqs"]
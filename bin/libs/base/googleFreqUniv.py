@@ -31,7 +31,7 @@
 import urllib
 import xml.dom.minidom
 
-from __common import GOOGLE_CACHE_FILENAME
+from __common import GOOGLE_CACHE_FILENAME, GOOGLE_UNIV_URL
 import webFreq
 
 
@@ -79,7 +79,7 @@ class GoogleFreqUniv( webFreq.WebFreq ) :
         """
   
         #### CACHE MECHANISM ####
-        url = ('https://research.google.com/university/search/service?' +\
+        url = (GOOGLE_UNIV_URL + '?' +\
                         urllib.urlencode({"rsz": "small",
                                           "q": "QUERYPLACEHOLDER",
                                           "lr": "LANGPLACEHOLDER",
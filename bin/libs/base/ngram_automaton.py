@@ -0,0 +1,143 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# ngram_automaton.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This module provides the `NgramAutomaton` class, which counts the
+    occurrences of a fixed set of ngrams in a single pass over a corpus.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import collections
+
+################################################################################
+
+class NgramAutomaton(object):
+    """
+        Aho-Corasick automaton over sequences of words (any hashable values,
+        e.g. lemmas). All the ngrams are added with `add` before the corpus
+        is scanned with `scan`. The memory used is proportional to the total
+        length of the ngrams, whatever the size of the corpus.
+
+        Instead of reporting every match, `scan` only counts how many times
+        each state is reached. Since an ngram ends at a given position iff
+        its state is reached there or is a suffix (through failure links) of
+        the state reached, the counts are propagated along the failure links
+        once, by `frequency`, after the whole corpus is scanned.
+    """
+
+################################################################################
+
+    def __init__(self):
+        self.vocab = {}  # word -> number, for words in some ngram
+        self.goto = [{}]  # For each state: word number -> next state
+        self.fail = None  # For each state: failure state
+        self.visits = None  # For each state: number of times reached
+        self.counted = False
+
+################################################################################
+
+    def add(self, ngram):
+        """
+            Adds the sequence of words `ngram` to the automaton (if it is not
+            there already).
+        """
+        assert self.fail is None, "Cannot add ngrams after scanning"
+        state = 0
+        for word in ngram:
+            word_id = self.vocab.setdefault(word, len(self.vocab) + 1)
+            next_state = self.goto[state].get(word_id)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][word_id] = next_state
+                self.goto.append({})
+            state = next_state
+
+################################################################################
+
+    def build(self):
+        """
+            Computes the failure links, in breadth-first order. Called
+            automatically by the first `scan`.
+        """
+        self.fail = [0] * len(self.goto)
+        self.visits = [0] * len(self.goto)
+        self.order = []  # States in breadth-first order
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            self.order.append(state)
+            for word_id, next_state in self.goto[state].iteritems():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and word_id not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(word_id, 0)
+
+################################################################################
+
+    def scan(self, words):
+        """
+            Counts the ngrams occurring in the sequence `words` (e.g. a
+            sentence). No ngram is matched across two calls.
+        """
+        assert not self.counted, "Cannot scan after counting"
+        if self.fail is None:
+            self.build()
+        vocab, goto, fail, visits = self.vocab, self.goto, self.fail, \
+                self.visits
+        state = 0
+        for word in words:
+            word_id = vocab.get(word)
+            if word_id is None:
+                state = 0  # No ngram contains this word
+                continue
+            while state and word_id not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word_id, 0)
+            visits[state] += 1
+
+################################################################################
+
+    def frequency(self, ngram):
+        """
+            Returns the number of occurrences of `ngram` in the scanned words.
+            It must have been added (or be the prefix of an ngram added)
+            before scanning, otherwise 0 is returned.
+        """
+        if self.fail is None:
+            self.build()
+        if not self.counted:
+            for state in reversed(self.order):
+                self.visits[self.fail[state]] += self.visits[state]
+            self.counted = True
+        state = 0
+        for word in ngram:
+            state = self.goto[state].get(self.vocab.get(word))
+            if state is None:
+                return 0
+        return self.visits[state] if state else 0
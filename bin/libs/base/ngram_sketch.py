@@ -0,0 +1,206 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# ngram_sketch.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This module provides the `NgramSketch` class, which counts ngrams
+    approximately within a fixed memory budget, keeping track of the most
+    frequent ones (heavy hitters).
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import array
+import heapq
+import math
+
+from ..util import error
+
+################################################################################
+
+"""
+    Default probability that an estimate exceeds the error bound of an
+    `NgramSketch`.
+"""
+DEFAULT_SKETCH_DELTA = 0.01
+
+# Approximate memory taken by each entry of the table of heavy hitters
+SKETCH_ENTRY_SIZE = 200
+# Size of a counter of the sketch
+SKETCH_COUNTER_SIZE = array.array(b"L").itemsize
+
+################################################################################
+
+class NgramSketch(object):
+    """
+        Count-min sketch with a table of heavy hitters. Each key (e.g. an
+        ngram joined into a string) is counted in one cell of each of the
+        `depth` rows of `width` counters, and its estimate is the smallest of
+        these cells (with conservative update, only the cells below the new
+        estimate are increased). An estimate is never below the exact count,
+        and with probability `1 - delta` it is at most `epsilon * total`
+        above it, where `total` is the number of keys added.
+
+        The keys with the largest estimates are kept in a table of at most
+        `capacity` entries: a key replaces the smallest entry of a full table
+        when its estimate becomes larger (as in the space-saving algorithm).
+        Since the estimates of the keys in the table are always up to date,
+        every key whose exact count reaches a threshold is reported by
+        `heavy_hitters`, unless the table overflowed.
+    """
+
+################################################################################
+
+    def __init__(self, max_bytes, epsilon=None, delta=DEFAULT_SKETCH_DELTA):
+        """
+            @param max_bytes The memory budget, shared between the counters
+            and the table of heavy hitters.
+
+            @param epsilon The error bound relative to the total count. By
+            default, the counters take three quarters of `max_bytes`, and
+            the bound follows from their number.
+
+            @param delta The probability of exceeding the error bound.
+        """
+        self.depth = max(1, int(math.ceil(math.log(1 / delta))))
+        if epsilon is None:
+            self.width = int(max_bytes * 3 / 4 /
+                             (self.depth * SKETCH_COUNTER_SIZE))
+        else:
+            self.width = int(math.ceil(math.e / epsilon))
+        table_bytes = max_bytes - self.width * self.depth * SKETCH_COUNTER_SIZE
+        self.capacity = int(table_bytes / SKETCH_ENTRY_SIZE)
+        if self.width < 1 or self.capacity < 1:
+            error("Memory budget of {n} bytes is too small for the sketch",
+                  n=max_bytes)
+        self.epsilon = math.e / self.width
+        self.delta = delta
+        self.counters = array.array(b"L", [0]) * (self.width * self.depth)
+        # (row number, offset of the row in `counters`)
+        self.rows = [(row, row * self.width) for row in xrange(self.depth)]
+        self.total = 0
+        self.table = {}  # key -> estimate
+        self.heap = []  # (estimate, key), some of them outdated
+        self.overflowed = False
+
+################################################################################
+
+    def cells(self, key):
+        """
+            Returns the positions in `counters` of the cells of `key`. The
+            hash function of each row is a combination of two hashes of `key`
+            (double hashing), which avoids hashing `key` once per row.
+        """
+        h1 = hash(key)
+        h2 = hash((key, 1)) | 1
+        width = self.width
+        return [offset + (h1 + row * h2) % width
+                for (row, offset) in self.rows]
+
+################################################################################
+
+    def add(self, key, count=1):
+        """
+            Adds `count` occurrences of `key`.
+        """
+        counters = self.counters
+        cells = self.cells(key)
+        estimate = min(map(counters.__getitem__, cells)) + count
+        for cell in cells:
+            if counters[cell] < estimate:
+                counters[cell] = estimate
+        self.total += count
+
+        table = self.table
+        if key in table:
+            table[key] = estimate
+        elif len(table) < self.capacity:
+            table[key] = estimate
+            heapq.heappush(self.heap, (estimate, key))
+        elif estimate > self.table_min():
+            (old_estimate, old_key) = heapq.heapreplace(self.heap,
+                                                        (estimate, key))
+            del table[old_key]
+            table[key] = estimate
+            self.overflowed = True
+
+################################################################################
+
+    def table_min(self):
+        """
+            Returns the smallest estimate in the table, updating the
+            outdated entries of the heap on the way.
+        """
+        heap, table = self.heap, self.table
+        while heap[0][0] != table[heap[0][1]]:
+            key = heap[0][1]
+            heapq.heapreplace(heap, (table[key], key))
+        return heap[0][0]
+
+################################################################################
+
+    def estimate(self, key):
+        """
+            Returns the estimated count of `key`, which is never smaller than
+            its exact count.
+        """
+        counters = self.counters
+        return min(map(counters.__getitem__, self.cells(key)))
+
+################################################################################
+
+    def heavy_hitters(self, min_count):
+        """
+            Returns the list of `(key, estimate)` pairs of the table whose
+            estimate is at least `min_count`, by decreasing estimate.
+        """
+        return sorted(((key, estimate) for (key, estimate)
+                       in self.table.iteritems() if estimate >= min_count),
+                      key=lambda pair: -pair[1])
+
+################################################################################
+
+    def error_bound(self):
+        """
+            Returns the maximum overestimation of a count, with probability
+            `1 - delta`.
+        """
+        return int(math.ceil(self.epsilon * self.total))
+
+################################################################################
+
+    def describe(self):
+        """
+            Returns a one-line description of the accuracy of the sketch.
+        """
+        description = "Sketch of %dx%d counters: %d occurrences; estimates " \
+                "exceed counts by at most %d with probability %g" % (
+                self.depth, self.width, self.total, self.error_bound(),
+                1 - self.delta)
+        if self.overflowed:
+            description += "; table of %d heavy hitters overflowed" \
+                    % self.capacity
+        return description
@@ -0,0 +1,355 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# web1tFreq.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This module provides the `Web1TStore` class, a compact local store of the
+    ngram counts of Google's Web 1T 5-gram corpus that can be searched
+    without decompressing the original files, and `build_web1t_store`, which
+    creates such a store from a Web 1T directory.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import array
+import glob
+import gzip
+import itertools
+import mmap
+import os
+import struct
+import tempfile
+
+from ..util import verbose, error
+
+################################################################################
+
+"""
+    Name of the store file that `counter.py -T <dir>` looks for in <dir>.
+"""
+WEB1T_STORE_NAME = "mwetk-web1t.store"
+
+WEB1T_MAGIC = b"MWETKW1T"
+WEB1T_VERSION = 1
+WEB1T_MAX_ORDER = 5
+# Approximate size of a block of records, in bytes
+WEB1T_BLOCK_SIZE = 4096
+# magic, version, corpus size
+WEB1T_HEADER = struct.Struct(b"<8sIq")
+# For each order: offset of the block index, number of blocks
+WEB1T_ORDER_ENTRY = struct.Struct(b"<QQ")
+# Block index entry: offset of the block, length of the block
+WEB1T_BLOCK_ENTRY = struct.Struct(b"<QI")
+# A block starts with its number of records, followed by their counts and
+# by their UTF-8 keys, each one preceded and followed by a newline.
+WEB1T_BLOCK_HEADER = struct.Struct(b"<I")
+WEB1T_COUNT = struct.Struct(b"<q")
+
+################################################################################
+
+class Web1TStore(object):
+    """
+        Read-only view of a Web 1T store. For each ngram order, the store
+        holds the ngrams sorted by their UTF-8 bytes, with their counts, in
+        blocks of about `WEB1T_BLOCK_SIZE` bytes, followed by an index with
+        the position of each block. A lookup is a binary search over the first
+        key of each block, followed by a search for the key in the keys of a
+        single block, whose position gives the index of the count. The whole
+        file is accessed through a single `mmap`.
+    """
+
+################################################################################
+
+    def __init__(self, path):
+        self.path = path
+        store_file = open(path, "rb")
+        try:
+            self.mmap = mmap.mmap(store_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            store_file.close()
+
+        magic, version, self.total = WEB1T_HEADER.unpack_from(self.mmap, 0)
+        if magic != WEB1T_MAGIC:
+            error("{path} is not a Web 1T store", path=path)
+        if version != WEB1T_VERSION:
+            error("Unsupported Web 1T store version {v} in {path}",
+                  v=version, path=path)
+        self.orders = {}  # n -> (index offset, number of blocks)
+        for n in xrange(1, WEB1T_MAX_ORDER + 1):
+            self.orders[n] = WEB1T_ORDER_ENTRY.unpack_from(self.mmap,
+                    WEB1T_HEADER.size + (n - 1) * WEB1T_ORDER_ENTRY.size)
+
+################################################################################
+
+    def block(self, n, i):
+        """
+            Returns the `(offset, length)` of the `i`-th block of order `n`.
+        """
+        index_offset, n_blocks = self.orders[n]
+        return WEB1T_BLOCK_ENTRY.unpack_from(self.mmap,
+                index_offset + i * WEB1T_BLOCK_ENTRY.size)
+
+################################################################################
+
+    def first_key(self, n, i):
+        """
+            Returns the first key of the `i`-th block of order `n`.
+        """
+        offset, length = self.block(n, i)
+        n_records, = WEB1T_BLOCK_HEADER.unpack_from(self.mmap, offset)
+        start = offset + WEB1T_BLOCK_HEADER.size + \
+                n_records * WEB1T_COUNT.size + 1
+        return self.mmap[start:self.mmap.find(b"\n", start)]
+
+################################################################################
+
+    def find_block(self, n, key):
+        """
+            Returns the number of the block of order `n` that would contain
+            `key`, or None if `key` is smaller than all keys.
+        """
+        first, last = 0, self.orders[n][1]
+        # Least block whose first key is greater than `key`
+        while first < last:
+            mid = (first + last) // 2
+            if self.first_key(n, mid) > key:
+                last = mid
+            else:
+                first = mid + 1
+        if first == 0:
+            return None
+        return first - 1
+
+################################################################################
+
+    def read_block(self, n, i):
+        """
+            Returns the contents of the `i`-th block of order `n`, as a
+            `(counts, keys)` pair of byte strings.
+        """
+        offset, length = self.block(n, i)
+        n_records, = WEB1T_BLOCK_HEADER.unpack_from(self.mmap, offset)
+        keys_start = offset + WEB1T_BLOCK_HEADER.size + \
+                n_records * WEB1T_COUNT.size
+        return (self.mmap[offset + WEB1T_BLOCK_HEADER.size:keys_start],
+                self.mmap[keys_start:offset + length])
+
+################################################################################
+
+    def block_frequency(self, block, key):
+        """
+            Returns the count of `key` in a block returned by `read_block`,
+            or 0 if it is not there.
+        """
+        counts, keys = block
+        position = keys.find(b"\n" + key + b"\n")
+        if position < 0:
+            return 0
+        record = keys.count(b"\n", 0, position)
+        return WEB1T_COUNT.unpack_from(counts,
+                                       record * WEB1T_COUNT.size)[0]
+
+################################################################################
+
+    def frequency(self, ngram):
+        """
+            Returns the count of `ngram`, a unicode string with words
+            separated by single spaces, or 0 if it is not in the store.
+        """
+        key = ngram.encode("utf-8")
+        n = len(ngram.split(" "))
+        if n > WEB1T_MAX_ORDER or not self.orders[n][1]:
+            return 0
+        block_number = self.find_block(n, key)
+        if block_number is None:
+            return 0
+        return self.block_frequency(self.read_block(n, block_number), key)
+
+################################################################################
+
+    def frequencies(self, ngrams):
+        """
+            Returns the list of counts of the `ngrams`, in the same order.
+            Each block is searched for and decoded only once, however many
+            ngrams it contains.
+        """
+        keys = [ngram.encode("utf-8") for ngram in ngrams]
+        lengths = [len(ngram.split(" ")) for ngram in ngrams]
+        result = [0] * len(keys)
+        order = sorted(xrange(len(keys)), key=lambda i: (lengths[i], keys[i]))
+        n, block_number, block = None, None, None
+        for i in order:
+            if lengths[i] > WEB1T_MAX_ORDER or not self.orders[lengths[i]][1]:
+                continue
+            if lengths[i] != n or block_number is None or \
+                    block_number + 1 < self.orders[n][1] and \
+                    keys[i] >= self.first_key(n, block_number + 1):
+                n = lengths[i]
+                block_number = self.find_block(n, keys[i])
+                if block_number is not None:
+                    block = self.read_block(n, block_number)
+            if block_number is not None:
+                result[i] = self.block_frequency(block, keys[i])
+        return result
+
+################################################################################
+
+    def close(self):
+        self.mmap.close()
+
+
+################################################################################
+################################################################################
+
+def read_web1t_lines(path):
+    """
+        Returns an iterator over the `(key, count)` pairs of a gzipped Web 1T
+        file, where `key` is the ngram as a byte string.
+    """
+    data_file = gzip.open(path, "rb")
+    try:
+        for line in data_file:
+            key, count = line.rstrip(b"\n").rsplit(b"\t", 1)
+            yield (key, int(count))
+    finally:
+        data_file.close()
+
+
+################################################################################
+
+def web1t_order_files(web1t_path, n):
+    """
+        Returns the list of data files for ngrams of order `n` in a Web 1T
+        directory, in the order of their keys.
+    """
+    if n == 1:
+        return [os.path.join(web1t_path, "1gms", "vocab.gz")]
+    return sorted(glob.glob(os.path.join(web1t_path, "%dgms" % n,
+                                         "%dgm-*.gz" % n)))
+
+
+################################################################################
+
+def build_web1t_store(web1t_path, store_path):
+    """
+        Builds a `Web1TStore` at `store_path` from the Web 1T directory
+        `web1t_path`. Unigrams are sorted in memory (the vocabulary file is
+        sorted by frequency); the other orders must already be sorted, as in
+        the original distribution.
+    """
+    with open(os.path.join(web1t_path, "1gms", "total")) as total_file:
+        total = int(total_file.read())
+    dirname = os.path.dirname(os.path.abspath(store_path))
+    (fd, tmppath) = tempfile.mkstemp(dir=dirname, prefix=".web1t-")
+    output = os.fdopen(fd, "wb")
+    try:
+        position = WEB1T_HEADER.size + WEB1T_MAX_ORDER * WEB1T_ORDER_ENTRY.size
+        output.write(b"\0" * position)
+        orders = []
+        for n in xrange(1, WEB1T_MAX_ORDER + 1):
+            paths = web1t_order_files(web1t_path, n)
+            if not paths or not os.path.isfile(paths[0]):
+                verbose("No %d-grams found in %s" % (n, web1t_path))
+                orders.append((0, 0))
+                continue
+            verbose("Storing %d-grams from %d file(s)..." % (n, len(paths)))
+            records = (record for path in paths
+                       for record in read_web1t_lines(path))
+            if n == 1:
+                records = iter(sorted(records))
+            position, order = write_web1t_order(output, position, records, n)
+            orders.append(order)
+
+        output.seek(0)
+        output.write(WEB1T_HEADER.pack(WEB1T_MAGIC, WEB1T_VERSION, total))
+        for order in orders:
+            output.write(WEB1T_ORDER_ENTRY.pack(*order))
+        output.close()
+        os.chmod(tmppath, 0o644)
+        os.rename(tmppath, store_path)
+    except:
+        output.close()
+        os.remove(tmppath)
+        raise
+
+
+################################################################################
+
+def write_web1t_order(output, position, records, n):
+    """
+        Writes the blocks and block index of one ngram order. Returns the new
+        position in `output` and the `(index offset, number of blocks)` entry
+        of the order.
+
+        @param records A sorted iterable of `(key, count)` pairs.
+    """
+    block_offsets = array.array(b"L")
+    block_lengths = array.array(b"L")
+    block = []
+    block_length = 0
+    previous = None
+    for key, count in records:
+        if previous is not None and key <= previous:
+            error("{n}-grams are not sorted at \"{key}\"", n=n,
+                  key=key.decode("utf-8", "replace"))
+        previous = key
+        if b"\n" in key:
+            error("Invalid {n}-gram: \"{key}\"", n=n,
+                  key=key.decode("utf-8", "replace"))
+        record_length = len(key) + 1 + WEB1T_COUNT.size
+        if block and block_length + record_length > WEB1T_BLOCK_SIZE:
+            position = write_web1t_block(output, position, block,
+                                         block_offsets, block_lengths)
+            block, block_length = [], 0
+        block.append((key, count))
+        block_length += record_length
+    if block:
+        position = write_web1t_block(output, position, block,
+                                     block_offsets, block_lengths)
+
+    index_offset = position
+    for offset, length in itertools.izip(block_offsets, block_lengths):
+        output.write(WEB1T_BLOCK_ENTRY.pack(offset, length))
+    position += len(block_offsets) * WEB1T_BLOCK_ENTRY.size
+    return position, (index_offset, len(block_offsets))
+
+
+################################################################################
+
+def write_web1t_block(output, position, block, block_offsets, block_lengths):
+    """
+        Writes a block of `(key, count)` records at `position` in `output`,
+        and appends its position and length to the block index arrays.
+        Returns the new position in `output`.
+    """
+    data = WEB1T_BLOCK_HEADER.pack(len(block)) + \
+            b"".join(WEB1T_COUNT.pack(count) for (key, count) in block) + \
+            b"\n" + b"".join(key + b"\n" for (key, count) in block)
+    output.write(data)
+    block_offsets.append(position)
+    block_lengths.append(len(data))
+    return position + len(data)
@@ -34,13 +34,17 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 
 import sys
-import cPickle # Cache is pickled to/from a file
+import threading
 from datetime import date
+from multiprocessing.pool import ThreadPool
 import urllib2
 import urllib
 import time
 
-from libs.base.__common import MAX_CACHE_DAYS, DEFAULT_LANG
+from libs.base.__common import MAX_CACHE_DAYS, DEFAULT_LANG, \
+        WEB_QUERY_THREADS, WEB_QUERY_RATE, WEB_QUERY_TRIES, WEB_RETRY_DELAY
+from libs.base.web_cache import WebCache
+from libs.util import verbose
 
 ################################################################################
 
@@ -72,8 +76,8 @@ class WebFreq( object ) :
 
             @param cache_filename The string corresonding to the name of the
             cache file in/from which you would like to store/retrieve recent
-            queries. You should have write permission in the current directory
-            in order to create and update the cache file.
+            queries (see `WebCache`). You should have write permission in the
+            current directory in order to create and update the cache file.
 
             @param url The URL of the web service that allows access to the
             search engine index. The URL is generally in the provider's
@@ -97,14 +101,10 @@ class WebFreq( object ) :
         #### CACHE MECHANISM ####
         self.MAX_DAYS = MAX_CACHE_DAYS
         self.today = date.today()
-        try :
-            cache_file = open( self.cache_filename, "r" )
-            self.cache = cPickle.load( cache_file )
-            cache_file.close()
-        except IOError :
-            cache_file = open( self.cache_filename, "w" )
-            cache_file.close()
-            self.cache = {}
+        self.cache = WebCache( self.cache_filename )
+        self.rate_limiter = None
+        if WEB_QUERY_RATE > 0 :
+            self.rate_limiter = RateLimiter( WEB_QUERY_RATE )
 
 ################################################################################
 
@@ -163,68 +163,188 @@ class WebFreq( object ) :
         term = in_term.lower().strip()
         if not lang :
             lang = DEFAULT_LANG
-        # Look into the cache
+        freq = self.cached_frequency( lang, term )
+        if freq is not None :
+            return freq
         try :
-            ( freq, time_searched ) = self.cache[ lang + "___" + term ]
-            dayspassed = self.today - time_searched
-            if dayspassed.days >= self.MAX_DAYS and self.MAX_DAYS >= 0 :
-                raise KeyError # TTL expired, must search again :-(
-            else :
-                return freq # TTL not expired :-)
-        except KeyError :
-            search_term = term
-            if isinstance( search_term, unicode ) :
-                search_term = search_term.encode( 'utf-8' )
-            search_term = "\"" + search_term + "\""
-            tries = 0
-            max_tries = 5
-            result_count = None
-            while result_count is None :
-                try:
-                    tries = tries + 1
-                    result_count = self.send_query( lang, search_term )
-                    if result_count is None :
-                        raise Exception("Result was None")
-                except urllib2.HTTPError as err:
-                    print( "Got an error ->" + str( err ), file=sys.stderr)
-                    if tries < max_tries :
-                        print("Will retry in 30s...", file=sys.stderr)
-                        time.sleep( 30 )
-                        #result_count = None
-                    else :
-                        print("Stopped at search term: " + search_term,
-                              file=sys.stderr)
-                        #print >> sys.stderr, request.get_full_url()
-                        if err.code == 403 : #Forbidden
-                            print("Probably your ID for the Google university "
-                                  "research program is not correct or is "
-                                  "associated to another IP address",
-                                  file=sys.stderr)
-                            print("Check \"http://research.google.com/"
-                                  "university/search/\" for further "
-                                  "information",file=sys.stderr)
-                        print("PLEASE VERIFY YOUR INTERNET CONNECTION",
-                              file=sys.stderr)
-                        sys.exit( -1 )
-            
-            self.cache[ lang + "___" + term ] = ( result_count, self.today )
-            return result_count
+            result_count = self.fetch( lang, term )
+        except ( IOError, ValueError ) as err :
+            self.report_failure( term, err )
+        self.cache[ lang + "___" + term ] = ( result_count, self.today )
+        return result_count
+
+################################################################################
+
+    def search_frequencies( self, in_terms, lang=None,
+                            threads=WEB_QUERY_THREADS ) :
+        """
+            Searches for the number of Web pages of all the `in_terms` at
+            once, as `search_frequency` does for a single term, so that the
+            answers are in the cache when `search_frequency` is called. The
+            terms are deduplicated, and those that are not in the cache are
+            sent to the search engine concurrently, by `threads` threads, at
+            the pace allowed by `self.rate_limiter`. Each answer is written to
+            the cache as soon as it arrives.
+
+            @param in_terms An iterable of strings, as `in_term` in
+            `search_frequency`.
+
+            @param lang As in `search_frequency`.
+
+            @param threads The maximum number of queries sent at once.
+        """
+        if not lang :
+            lang = DEFAULT_LANG
+        terms = set( in_term.lower().strip() for in_term in in_terms )
+        terms = sorted( term for term in terms
+                        if self.cached_frequency( lang, term ) is None )
+        if not terms :
+            return
+        verbose( "Sending %d Web queries in %d threads" % ( len( terms ),
+                                                           threads ) )
+        pool = ThreadPool( threads )
+        try :
+            results = pool.imap_unordered( self.fetch_in_thread,
+                                           [ ( lang, term ) for term in terms ] )
+            for i, ( term, ok, value ) in enumerate( results ) :
+                if not ok :
+                    self.report_failure( term, value )
+                self.cache[ lang + "___" + term ] = ( value, self.today )
+                if ( i + 1 ) % 100 == 0 :
+                    verbose( "%d of %d Web queries answered" % ( i + 1,
+                                                                len( terms ) ) )
+        finally :
+            pool.terminate()
+            pool.join()
+
+################################################################################
+
+    def cached_frequency( self, lang, term ) :
+        """
+            Returns the frequency of `term` in the cache, or None if it is
+            absent or expired.
+        """
+        entry = self.cache.get( lang + "___" + term )
+        if entry is None :
+            return None
+        ( freq, time_searched ) = entry
+        dayspassed = self.today - time_searched
+        if dayspassed.days >= self.MAX_DAYS and self.MAX_DAYS >= 0 :
+            return None # TTL expired, must search again :-(
+        return freq # TTL not expired :-)
+
+################################################################################
+
+    def fetch( self, lang, term ) :
+        """
+            Sends the exact query of `term` to the search engine, retrying
+            up to `WEB_QUERY_TRIES` times on errors, after waiting
+            `WEB_RETRY_DELAY` seconds, then twice as long each time
+            (exponential backoff). The last error is raised if all the tries
+            fail.
+
+            @return The frequency of `term`.
+        """
+        search_term = term
+        if isinstance( search_term, unicode ) :
+            search_term = search_term.encode( 'utf-8' )
+        search_term = b"\"" + search_term + b"\""
+        delay = WEB_RETRY_DELAY
+        for tries in range( 1, WEB_QUERY_TRIES + 1 ) :
+            try:
+                if self.rate_limiter is not None :
+                    self.rate_limiter.acquire()
+                result_count = self.send_query( lang, search_term )
+                if result_count is None :
+                    raise ValueError( "Result was None" )
+                return result_count
+            except ( IOError, ValueError ) as err :
+                print( "Got an error ->" + str( err ), file=sys.stderr)
+                if tries == WEB_QUERY_TRIES :
+                    raise
+                print( "Will retry in %gs..." % delay, file=sys.stderr )
+                time.sleep( delay )
+                delay *= 2
+
+    def fetch_in_thread( self, query ) :
+        """
+            Thread function for `search_frequencies`, where `query` is a
+            `( lang, term )` pair. Returns `( term, True, frequency )`, or
+            `( term, False, error )` if `fetch` failed, so that the error is
+            reported by the main thread.
+        """
+        ( lang, term ) = query
+        try :
+            return ( term, True, self.fetch( lang, term ) )
+        except ( IOError, ValueError ) as err :
+            return ( term, False, err )
+
+################################################################################
+
+    def report_failure( self, term, err ) :
+        """
+            Explains why the query of `term` failed with `err`, and exits.
+        """
+        print("Stopped at search term: " + term, file=sys.stderr)
+        if getattr( err, "code", None ) == 403 : #Forbidden
+            print("Probably your ID for the Google university "
+                  "research program is not correct or is "
+                  "associated to another IP address",
+                  file=sys.stderr)
+            print("Check \"http://research.google.com/"
+                  "university/search/\" for further "
+                  "information",file=sys.stderr)
+        print("PLEASE VERIFY YOUR INTERNET CONNECTION",
+              file=sys.stderr)
+        sys.exit( -1 )
 
 ################################################################################
 
     def flush_cache( self ) :
         """
-            Explicit destructor, flushes the cache content to a file before
-            closing the connection. Thus, the cache entries will be available
-            the next time the search engine is called and, if they are not
-            expired, will avoid repeated queries.
+            Explicit destructor, closes the cache file before closing the
+            connection. Each cache entry is written to the file as soon as
+            its query is answered, so the entries will be available the next
+            time the search engine is called and, if they are not expired,
+            will avoid repeated queries, even if the process is killed.
 
-            IMPORTANT: If you want the cache mechanism to be used properly,
-            NEVER FORGET to call this function in a "finally" block, in order
-            to guarantee that, even if an exceptioon occurs (like pressing
-            Ctrl+C), the cache will be flushed.
+            This function should still be called in a "finally" block, in
+            order to close the cache file properly.
+        """
+        self.cache.close()
+
+################################################################################
+################################################################################
+
+class RateLimiter( object ) :
+    """
+        Token bucket shared by the threads that send Web queries: on average,
+        at most `rate` queries are sent per second, with bursts of at most
+        `burst` queries.
+    """
+
+################################################################################
+
+    def __init__( self, rate, burst=1 ) :
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last_time = time.time()
+        self.lock = threading.Lock()
+
+################################################################################
+
+    def acquire( self ) :
+        """
+            Takes a token, waiting until one is available. The token is
+            reserved before waiting, so that concurrent threads wait in turn.
         """
-        # Flush cache content to file
-        cache_file = open( self.cache_filename, "w" )
-        cPickle.dump( self.cache, cache_file )
-        cache_file.close()
+        with self.lock :
+            now = time.time()
+            self.tokens = min( self.burst,
+                               self.tokens + ( now - self.last_time ) * self.rate )
+            self.last_time = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate
+        if wait > 0 :
+            time.sleep( wait )
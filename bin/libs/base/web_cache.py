@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# web_cache.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    This module provides the `WebCache` class, the on-disk cache of Web
+    frequencies used by `WebFreq` and merged by `join_web_cache.py`.
+"""
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import cPickle
+import os
+import sqlite3
+import threading
+from datetime import date
+
+from ..util import verbose, error
+
+################################################################################
+
+SQLITE_MAGIC = b"SQLite format 3\0"
+# Extension given to a cache file of the old (pickled) format once converted
+PICKLED_CACHE_EXT = ".pickle"
+
+################################################################################
+
+class WebCache(object):
+    """
+        A `WebCache` maps search terms, of the form `lang + "___" + term`, to
+        `(frequency, date)` pairs, where `date` is the day of the search. It
+        is stored in an SQLite database indexed by term, so that opening it
+        does not read it, and each entry is committed as soon as it is added:
+        the queries already paid for are kept even if the process dies.
+
+        Cache files of the old format (a pickled dictionary) are converted
+        when opened, the old file being kept with the extension ".pickle".
+
+        A cache may be used by several threads (e.g. by counter.py, which
+        queries the Web in a thread of its own while counting in an index):
+        the connection is shared, and only used by one thread at a time.
+    """
+
+################################################################################
+
+    def __init__(self, path):
+        """
+            Opens the cache stored at `path`, creating it if it does not
+            exist.
+
+            @param path The path of the cache file.
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        if os.path.isfile(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as cache_file:
+                is_sqlite = cache_file.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+            if not is_sqlite:
+                self.convert_pickled()
+                return
+        self.connect()
+
+################################################################################
+
+    def connect(self):
+        """
+            Opens the database, creating the table of entries if needed.
+        """
+        try:
+            self.connection = sqlite3.connect(self.path,
+                                              check_same_thread=False)
+            self.connection.execute("CREATE TABLE IF NOT EXISTS web_cache ("
+                    "term TEXT PRIMARY KEY, freq INTEGER NOT NULL, "
+                    "day INTEGER NOT NULL)")
+            self.connection.commit()
+        except sqlite3.DatabaseError as err:
+            error("Cannot open web cache {path}: {err}", path=self.path,
+                  err=unicode(err))
+
+################################################################################
+
+    def convert_pickled(self):
+        """
+            Converts the old-format cache file `self.path` into a database.
+        """
+        with open(self.path, "rb") as cache_file:
+            try:
+                entries = cPickle.load(cache_file)
+            except Exception:
+                error("{path} is not a web cache file", path=self.path)
+        old_path = self.path + PICKLED_CACHE_EXT
+        verbose("Converting web cache %s (%d entries); the old file is "
+                "kept as %s" % (self.path, len(entries), old_path))
+        os.rename(self.path, old_path)
+        self.connect()
+        self.update(entries.iteritems())
+
+################################################################################
+
+    def get(self, term, default=None):
+        """
+            Returns the `(frequency, date)` pair of `term`, or `default`.
+        """
+        with self.lock:
+            row = self.connection.execute("SELECT freq, day FROM web_cache "
+                    "WHERE term = ?", (term,)).fetchone()
+        if row is None:
+            return default
+        return (row[0], date.fromordinal(row[1]))
+
+    def __getitem__(self, term):
+        entry = self.get(term)
+        if entry is None:
+            raise KeyError(term)
+        return entry
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+################################################################################
+
+    def __setitem__(self, term, entry):
+        """
+            Adds (or replaces) the `(frequency, date)` pair of `term`, and
+            commits it. A commit per entry costs nothing next to the Web
+            query that computed it.
+        """
+        self.update([(term, entry)])
+
+    def update(self, entries):
+        """
+            Adds (or replaces) the `(term, (frequency, date))` pairs of the
+            iterable `entries` in a single transaction.
+        """
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO web_cache "
+                    "VALUES (?, ?, ?)", ((term, freq, day.toordinal())
+                                         for (term, (freq, day)) in entries))
+
+################################################################################
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM web_cache"
+                                           ).fetchone()[0]
+
+    def iteritems(self):
+        """
+            Returns an iterator over the `(term, (frequency, date))` pairs,
+            sorted by term. Entries are read from disk as they are needed.
+        """
+        with self.lock:
+            cursor = self.connection.execute("SELECT term, freq, day "
+                                             "FROM web_cache ORDER BY term")
+        while True:
+            with self.lock:
+                rows = cursor.fetchmany(1000)
+            if not rows:
+                return
+            for (term, freq, day) in rows:
+                yield (term, (freq, date.fromordinal(day)))
+
+################################################################################
+
+    def close(self):
+        """
+            Commits any pending entry and closes the database.
+        """
+        with self.lock:
+            self.connection.commit()
+            self.connection.close()
@@ -443,3 +443,35 @@ class Word(object):
         """
         return ";".join("{}:{}".format(rel, index+1)
                 for (rel, index) in syn_pairs)
+
+
+################################################################################
+
+class WordView(Word):
+    """
+        A copy-on-write view of a `Word`. Its attributes are read from the
+        viewed word until they are assigned, which only changes the view,
+        and its frequencies are copied when first accessed (since they may
+        be modified in place). Pattern matches are made of views of the
+        words of the sentence, so that they are not copied unless they are
+        modified.
+    """
+
+################################################################################
+
+    def __init__(self, word):
+        """
+            @param word The `Word` seen through this view.
+        """
+        self._word = word
+
+################################################################################
+
+    def __getattr__(self, name):
+        # Only called for the attributes that were not assigned to the view
+        if name == "freqs":
+            self.freqs = self._word.freqs.copy()
+            return self.freqs
+        if name == "_word" or name.startswith("__"):
+            raise AttributeError(name)
+        return getattr(self._word, name)
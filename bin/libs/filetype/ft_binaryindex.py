@@ -42,7 +42,8 @@ import sys
 
 class BinaryIndexInfo(common.FiletypeInfo):
     r"""FiletypeInfo subclass for BinaryIndex files."""
-    description = "The `.info` file for binary index created by index.py"
+    description = "The `.info` file (or `.mwi` container) for binary index " \
+            "created by index.py"
     filetype_ext = "BinaryIndex"
 
     def operations(self):
@@ -55,13 +56,18 @@ class BinaryIndexChecker(common.AbstractChecker):
     def check(self):
         if self.fileobj.name == "<stdin>":
             util.error("Cannot read BinaryIndex file from stdin!")
-        if not self.fileobj.name.endswith(".info"):
-            util.error("BinaryIndex file should have extension .info!")
+        from .indexlib import CONTAINER_EXT
+        if not self.fileobj.name.endswith((".info", CONTAINER_EXT)):
+            util.error("BinaryIndex file should have extension .info "
+                    "or " + CONTAINER_EXT + "!")
         super(BinaryIndexChecker, self).check()
 
     def matches_header(self, strict):
         # Check is always strict because the absence of header means file is wrong
-        return self.fileobj.peek(20).startswith(b"corpus_size int")
+        from .indexlib import CONTAINER_MAGIC
+        header = self.fileobj.peek(20)
+        return header.startswith(b"corpus_size int") \
+                or header.startswith(CONTAINER_MAGIC)
 
 
 class BinaryIndexParser(common.AbstractParser):
@@ -70,9 +76,8 @@ class BinaryIndexParser(common.AbstractParser):
     def _parse_file(self, fileobj):
         info = {"parser": self, "category": "corpus"}
         with common.ParsingContext(fileobj, self.handler, info):
-            from .indexlib import Index
-            assert fileobj.name.endswith(".info")
-            index = Index(fileobj.name[:-len(".info")])
+            from .indexlib import Index, index_basepath
+            index = Index(index_basepath(fileobj.name))
             index.load_main()
             for sentence, progress in index.iterate_sentences_and_progress():
                 info["progress"] = progress
@@ -51,10 +51,16 @@ from __future__ import absolute_import
 import sys
 import os
 import array
+import binascii
+import itertools
+import shutil
+import mmap
+import hashlib
 import xml.sax
 import tempfile
 import subprocess
 import struct
+import heapq
 
 from ..base.sentence import SentenceFactory
 from ..util import verbose, warn, error
@@ -64,6 +70,28 @@ from .. import filetype
 
 
 NGRAM_LIMIT = 16
+# Sets of more symbols are not looked up in suffix arrays, but only tested
+# against the corpus (see `Index.sequence_positions`)
+MAX_LOOKUP_SYMBOLS = 256
+
+# Files that make up the suffix array of a single attribute.
+ARRAY_FILE_SUFFIXES = [".corpus", ".suffix", ".symbols"]
+# Optional files of a single attribute (see `SuffixArray.rsuffix` and
+# `SuffixArray.top_ngrams`).
+OPTIONAL_ARRAY_FILE_SUFFIXES = [".rsuffix", ".topngrams"]
+
+# Single-file index container (see `IndexContainer`).
+CONTAINER_EXT = ".mwi"
+CONTAINER_MAGIC = b"MWETKIDX"
+CONTAINER_VERSION = 1
+CONTAINER_ALIGNMENT = 4096
+# magic, version, number of sections, offset of the TOC, content checksum
+CONTAINER_HEADER = struct.Struct(b"<8sIIQ16s")
+# section name, offset, length, checksum of the contents it was built from
+CONTAINER_TOC_ENTRY = struct.Struct(b"<64sQQ16s")
+# Content checksum of an index stored as separate files, kept beside them
+# (see `Index.content_checksum`)
+CHECKSUM_EXT = ".checksum"
 
 ################################################################################
 
@@ -115,19 +143,27 @@ def load_symbols_from_file(symbols, path):
     """
         Fills an existing symbol table with the contents of a file.
     """
-
     file = open(path, "rb")
+    load_symbols_from_lines(symbols, file)
+    file.close()
+
+
+################################################################################
+
+def load_symbols_from_lines(symbols, lines):
+    """
+        Fills an existing symbol table with an iterable of UTF-8 encoded
+        lines, one symbol per line.
+    """
     id = 0
     symbols.number_to_symbol = []
     symbols.symbol_to_number = {}
-    for line in file:
+    for line in lines:
         sym = line.rstrip('\n').decode("utf-8")
         symbols.symbol_to_number[sym] = id
         symbols.number_to_symbol.append(sym)
         id += 1
 
-    file.close()
-
 
 ################################################################################
 
@@ -158,11 +194,60 @@ def read_attribute_from_index(attr, path):
         ## Assuming 32-bit int! (right in x86 and x86-64)
         wordcode = corpus_file.read(4)
         if wordcode == "":
+            corpus_file.close()
             return
         wordnum = struct.unpack('i', wordcode)[0]
         yield symbols.number_to_symbol[wordnum]
 
-    corpus_file.close()
+
+################################################################################
+
+def checksum_corpus_arrays(named_chunks):
+    """
+        Returns the content checksum of an index, i.e. the MD5 digest of the
+        corpus arrays of its non-fused attributes. Two indices with the same
+        checksum have the same corpus, so fused arrays built for one of them
+        are valid for the other.
+
+        @param named_chunks An iterable of `(attr, chunks)` pairs, where
+        `chunks` is an iterable of byte strings with the contents of the
+        `.corpus` array of `attr`. Pairs must be sorted by attribute name.
+    """
+    digest = hashlib.md5()
+    for attr, chunks in named_chunks:
+        digest.update(attr.encode("utf-8") + b"\0")
+        for chunk in chunks:
+            digest.update(chunk)
+    return digest.digest()
+
+
+################################################################################
+
+def read_file_chunks(path, chunk_size=1 << 20):
+    """
+        Returns an iterator over the contents of a file in blocks of at most
+        `chunk_size` bytes.
+    """
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+################################################################################
+
+def index_basepath(path):
+    """
+        Returns the base path of the index whose `.info` file or `.mwi`
+        container is at `path`.
+    """
+    for ext in [".info", CONTAINER_EXT]:
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    error("Index path must end in .info or {ext}: {path}",
+          ext=CONTAINER_EXT, path=path)
 
 
 ################################################################################
@@ -209,6 +294,34 @@ def compare_ngrams(ngram1, pos1, ngram2, pos2, ngram1_exhausted=-1,
         return int(ngram1[pos1] - ngram2[pos2])
 
 
+################################################################################
+
+def count_symbol_runs(symbols, sorted=True):
+    """
+        Returns a list of `(symbol, frequency)` pairs for an iterable of
+        symbol numbers, leaving out symbol 0 (end of sentence).
+
+        @param sorted If True, equal symbols are assumed to be adjacent, so
+        they are counted in runs; otherwise, the counts are merged and sorted
+        afterwards.
+    """
+    counts = []
+    previous = None
+    for sym in symbols:
+        if sym == previous:
+            counts[-1][1] += 1
+        elif sym != 0:
+            counts.append([sym, 1])
+            previous = sym
+    if not sorted:
+        merged = {}
+        for sym, freq in counts:
+            merged[sym] = merged.get(sym, 0) + freq
+        counts = merged.items()
+        counts.sort()
+    return [(sym, freq) for (sym, freq) in counts]
+
+
 ################################################################################
 
 def fuse_suffix_arrays(array1, array2):
@@ -267,6 +380,17 @@ class SuffixArray(object):
         self.corpus = make_array()  # List of word numbers
         self.suffix = make_array()  # List of word positions
         self.symbols = SymbolTable()  # word<->number conversion table
+        # Optional list of word positions, sorted by the words read from
+        # right to left (i.e. the suffix array of the reversed corpus, but
+        # holding positions in the original corpus). Used to extend ngrams
+        # to the left.
+        self.rsuffix = None
+        # Optional table of the most frequent unigrams and bigrams, mapping
+        # tuples of word numbers to their frequencies. Checked before
+        # searching the suffix array.
+        self.top_ngrams = None
+        self.top_ngram_lookups = 0
+        self.top_ngram_hits = 0
 
 ################################################################################
 
@@ -278,6 +402,8 @@ class SuffixArray(object):
         self.corpus_path = basepath + ".corpus"
         self.suffix_path = basepath + ".suffix"
         self.symbols_path = basepath + ".symbols"
+        self.rsuffix_path = basepath + ".rsuffix"
+        self.top_ngrams_path = basepath + ".topngrams"
 
 ################################################################################
 
@@ -288,6 +414,33 @@ class SuffixArray(object):
         load_array_from_file(self.corpus, self.corpus_path)
         load_array_from_file(self.suffix, self.suffix_path)
         load_symbols_from_file(self.symbols, self.symbols_path)
+        if os.path.isfile(self.rsuffix_path):
+            self.rsuffix = make_array()
+            load_array_from_file(self.rsuffix, self.rsuffix_path)
+        if os.path.isfile(self.top_ngrams_path):
+            table = make_array()
+            load_array_from_file(table, self.top_ngrams_path)
+            self.set_top_ngrams_array(table)
+
+################################################################################
+
+    def load_from_container(self, container, name):
+        """
+            Loads the suffix array from the sections `<name>.corpus`,
+            `<name>.suffix` and `<name>.symbols` (plus `<name>.rsuffix`, if
+            present) and `<name>.topngrams` (likewise) of an `IndexContainer`.
+        """
+        self.corpus.fromstring(container.section(name + ".corpus"))
+        self.suffix.fromstring(container.section(name + ".suffix"))
+        load_symbols_from_lines(self.symbols,
+                container.section(name + ".symbols").splitlines(True))
+        if container.has_section(name + ".rsuffix"):
+            self.rsuffix = make_array()
+            self.rsuffix.fromstring(container.section(name + ".rsuffix"))
+        if container.has_section(name + ".topngrams"):
+            table = make_array()
+            table.fromstring(container.section(name + ".topngrams"))
+            self.set_top_ngrams_array(table)
 
 ################################################################################
 
@@ -298,6 +451,10 @@ class SuffixArray(object):
         save_array_to_file(self.corpus, self.corpus_path)
         save_array_to_file(self.suffix, self.suffix_path)
         save_symbols_to_file(self.symbols, self.symbols_path)
+        if self.rsuffix is not None:
+            save_array_to_file(self.rsuffix, self.rsuffix_path)
+        if self.top_ngrams is not None:
+            save_array_to_file(self.top_ngrams_array(), self.top_ngrams_path)
 
 ################################################################################
 
@@ -326,6 +483,155 @@ class SuffixArray(object):
                                                      self.corpus, b)))
         self.suffix = make_array(tmpseq)
 
+################################################################################
+
+    def build_reverse_suffix_array(self, c_indexer_program=None):
+        """
+            Builds the reverse suffix array (`self.rsuffix`) from the corpus
+            array. Position `p` is sorted by the words `corpus[p]`,
+            `corpus[p-1]`, ..., `corpus[0]`, so the positions where an ngram
+            *ends* form a contiguous range, as the positions where it starts
+            do in `self.suffix`. Symbol numbers are shared with `self.suffix`.
+
+            @param c_indexer_program Path of the C indexer, which sorts the
+            positions instead of Python (see `CSuffixArray`), or None.
+        """
+        if c_indexer_program is not None:
+            self.build_reverse_suffix_array_c(c_indexer_program)
+            return
+        last = len(self.corpus) - 1
+        reversed_corpus = make_array(reversed(self.corpus))
+        tmpseq = range(0, len(self.corpus))
+        tmpseq.sort(cmp=(lambda a, b: compare_ngrams(reversed_corpus, a,
+                                                     reversed_corpus, b)))
+        self.rsuffix = make_array(last - pos for pos in tmpseq)
+
+################################################################################
+
+    def build_reverse_suffix_array_c(self, c_indexer_program):
+        """
+            Builds `self.rsuffix` with the C indexer. The indexer numbers the
+            symbols in their order of appearance and sorts by these numbers,
+            so the reversed corpus is given to it (as symbol numbers) after
+            one occurrence of each symbol, in increasing order: its symbol
+            numbers are then those of `self.symbols`. The positions of these
+            leading words are dropped from the result.
+        """
+        n_leading = len(self.symbols.number_to_symbol) - 1
+        last = n_leading + len(self.corpus) - 1
+        tmpdir = tempfile.mkdtemp(prefix="mwetk-rsuffix-")
+        try:
+            wordlist_file = tempfile.TemporaryFile(dir=tmpdir)
+            for number in itertools.chain(xrange(1, n_leading + 1),
+                                          reversed(self.corpus)):
+                # Symbol 0 is the empty string for both indexers
+                wordlist_file.write(b"%d\n" % number if number else b"\n")
+            wordlist_file.seek(0)
+            basepath = os.path.join(tmpdir, "reversed")
+            verbose("Using C indexer to build reverse suffix array")
+            status = subprocess.call([c_indexer_program, basepath],
+                                     stdin=wordlist_file)
+            wordlist_file.close()
+            if status != 0:
+                error("C indexer failed with status {status}", status=status)
+            tmpseq = make_array()
+            load_array_from_file(tmpseq, basepath + ".suffix")
+        finally:
+            shutil.rmtree(tmpdir)
+        self.rsuffix = make_array(last - pos for pos in tmpseq
+                                  if pos >= n_leading)
+
+################################################################################
+
+    def build_top_ngrams(self, budget):
+        """
+            Builds the table of the `budget` most frequent unigrams and
+            bigrams (`self.top_ngrams`) in a single scan of the suffix array.
+            Ngrams spanning a sentence end are not considered. Ties are
+            broken in favour of the ngram found first in the suffix array.
+        """
+        heap = []  # (frequency, -rank, ngram): the least frequent on top
+        corpus = self.corpus
+        size = len(corpus)
+        # Current [ngram, frequency, rank] of unigram and bigram
+        counts = [None, None]
+        rank = 0
+
+        def flush(entry):
+            if entry is not None:
+                item = (entry[1], -entry[2], entry[0])
+                if len(heap) < budget:
+                    heapq.heappush(heap, item)
+                elif heap and item > heap[0]:
+                    heapq.heapreplace(heap, item)
+
+        for pos in self.suffix:
+            word1 = corpus[pos]
+            word2 = corpus[pos + 1] if pos + 1 < size else 0
+            for n, ngram in [(0, (word1,)), (1, (word1, word2))]:
+                if 0 in ngram:
+                    continue
+                if counts[n] is not None and counts[n][0] == ngram:
+                    counts[n][1] += 1
+                else:
+                    flush(counts[n])
+                    rank += 1
+                    counts[n] = [ngram, 1, rank]
+        for entry in counts:
+            flush(entry)
+
+        self.top_ngrams = dict((ngram, freq) for (freq, r, ngram) in heap)
+
+################################################################################
+
+    def top_ngrams_array(self):
+        """
+            Returns `self.top_ngrams` as a flat array of `(word1, word2,
+            frequency)` triples, most frequent first. `word2` is 0 (end of
+            sentence) for unigrams.
+        """
+        table = make_array()
+        entries = sorted(self.top_ngrams.items(), key=lambda e: -e[1])
+        for ngram, freq in entries:
+            table.extend((ngram + (0,))[:2])
+            table.append(freq)
+        return table
+
+################################################################################
+
+    def set_top_ngrams_array(self, table):
+        """
+            Sets `self.top_ngrams` from an array in the format returned by
+            `top_ngrams_array`.
+        """
+        self.top_ngrams = {}
+        for i in xrange(0, len(table), 3):
+            word1, word2, freq = table[i:i + 3]
+            ngram = (word1, word2) if word2 else (word1,)
+            self.top_ngrams[ngram] = freq
+
+################################################################################
+
+    def frequency(self, ngram):
+        """
+            Returns the number of occurrences of `ngram`, a list of symbol
+            numbers. The table of top ngrams, if present, is checked before
+            searching the suffix array. Lookups and hits are counted in
+            `self.top_ngram_lookups` and `self.top_ngram_hits`.
+        """
+        if self.top_ngrams is not None:
+            self.top_ngram_lookups += 1
+            freq = self.top_ngrams.get(tuple(ngram))
+            if freq is not None:
+                self.top_ngram_hits += 1
+                return freq
+
+        indexrange = self.find_ngram_range(ngram)
+        if indexrange is None:
+            return 0
+        first, last = indexrange
+        return last - first + 1
+
 ################################################################################
 
     def find_ngram_range(self, ngram, min=0, max=None):
@@ -356,10 +662,97 @@ class SuffixArray(object):
 
 ################################################################################
 
-    def binary_search_ngram(self, ngram, first, last, cmp):
+    def find_reverse_ngram_range(self, ngram, min=0, max=None):
+        """
+            Returns a tuple `(first, last)` of entries of the reverse suffix
+            array holding the positions where `ngram` ends, or `None` if there
+            is no match. The ngram is given in its normal (left to right)
+            order. Requires `self.rsuffix`.
+        """
+        if max is None:
+            max = len(self.rsuffix) - 1
+
+        rngram = list(reversed(ngram))
+        first = self.binary_search_ngram(rngram, min, max, array.array.__ge__,
+                                         reverse=True)
+        last = self.binary_search_ngram(rngram, min, max, array.array.__gt__,
+                                        reverse=True)
+
+        if first is None:
+            return None
+        if last is None:
+            last = max
+        else:
+            last -= 1
+
+        if first <= last:
+            return (first, last)
+        else:
+            return None
+
+################################################################################
+
+    def right_extensions(self, indexrange, length):
+        """
+            Returns a list of `(symbol, frequency)` pairs, sorted by symbol,
+            for the words that follow the ngram of `length` words whose
+            suffix array range is `indexrange` (as returned by
+            `find_ngram_range`). Sentence ends are not listed. The range is
+            scanned once: since suffixes are sorted, occurrences followed by
+            the same word are adjacent.
+        """
+        first, last = indexrange
+        corpus = self.corpus
+        size = len(corpus)
+        return count_symbol_runs((corpus[pos + length]
+                                  for pos in self.suffix[first:last + 1]
+                                  if pos + length < size),
+                                 sorted=(length < NGRAM_LIMIT))
+
+################################################################################
+
+    def left_extensions(self, rindexrange, length):
+        """
+            Returns a list of `(symbol, frequency)` pairs, sorted by symbol,
+            for the words that precede the ngram of `length` words whose
+            reverse suffix array range is `rindexrange` (as returned by
+            `find_reverse_ngram_range`). Sentence ends are not listed.
+        """
+        first, last = rindexrange
+        corpus = self.corpus
+        return count_symbol_runs((corpus[pos - length]
+                                  for pos in self.rsuffix[first:last + 1]
+                                  if pos - length >= 0),
+                                 sorted=(length < NGRAM_LIMIT))
+
+################################################################################
+
+    def cursor(self, ngram=()):
+        """
+            Returns an `NgramCursor` on `ngram`, a list of symbol numbers.
+        """
+        return NgramCursor(self, ngram)
+
+################################################################################
+
+    def ngram_positions(self, indexrange):
+        """
+            Returns an array with the corpus positions of the suffixes in
+            `indexrange`, a `(first, last)` tuple as returned by
+            `find_ngram_range`.
+        """
+        first, last = indexrange
+        return self.suffix[first:last + 1]
+
+################################################################################
+
+    def binary_search_ngram(self, ngram, first, last, cmp, reverse=False):
         """
             Find the least suffix that satisfies `suffix <cmp> ngram`, or
             `None` if there is none.
+
+            @param reverse If True, search the reverse suffix array, reading
+            words from right to left. `ngram` must then be reversed as well.
         """
 
         # 'max' must be one more than 'last', for the case no suffix
@@ -368,13 +761,19 @@ class SuffixArray(object):
         mini = first
         ngram_array = make_array(ngram)
         length = len(ngram)
+        suffix = self.rsuffix if reverse else self.suffix
         mid = -1
         while mini < maxi:
             mid = (mini + maxi) // 2
-            midsuf = self.suffix[mid]
+            midsuf = suffix[mid]
             #if cmp(compare_ngrams(self.corpus, self.suffix[mid], ngram, 0, \
             #                      ngram2_exhausted=0), 0):
-            if cmp(self.corpus[midsuf: midsuf + length], ngram_array):
+            if reverse:
+                window = self.corpus[max(midsuf - length + 1, 0): midsuf + 1]
+                window.reverse()
+            else:
+                window = self.corpus[midsuf: midsuf + length]
+            if cmp(window, ngram_array):
                 # If 'mid' satisfies, then what we want *is* mid or *is before*
                 # mid            
                 maxi = mid
@@ -459,6 +858,259 @@ class CSuffixArray(SuffixArray):
         os.remove(self.wordlist_path)
 
 
+################################################################################
+################################################################################
+
+class NgramCursor(object):
+    """
+        Bidirectional cursor on the occurrences of an ngram in a `SuffixArray`.
+        It keeps the range of the ngram both in the suffix array and in the
+        reverse suffix array, so that extending the ngram by one word on
+        either side only searches inside the current range, and all right
+        (resp. left) extensions can be listed in a single scan of it.
+
+        Cursors are immutable: `extend_right` and `extend_left` return new
+        cursors. Ranges are computed on demand, so a cursor that is only ever
+        extended to the right does not need the reverse suffix array.
+    """
+
+################################################################################
+
+    def __init__(self, suffix_array, ngram=(), indexrange=False,
+                 rindexrange=False):
+        self.suffix_array = suffix_array
+        self.ngram = tuple(ngram)
+        # False means "not computed yet"; None means "no occurrence".
+        self._range = indexrange
+        self._rrange = rindexrange
+        if not self.ngram:
+            self._range = (0, len(suffix_array.suffix) - 1)
+            if suffix_array.rsuffix is not None:
+                self._rrange = (0, len(suffix_array.rsuffix) - 1)
+
+################################################################################
+
+    def forward_range(self):
+        """
+            Returns the range of the ngram in the suffix array, or None.
+        """
+        if self._range is False:
+            self._range = self.suffix_array.find_ngram_range(self.ngram)
+        return self._range
+
+################################################################################
+
+    def reverse_range(self):
+        """
+            Returns the range of the ngram in the reverse suffix array,
+            or None.
+        """
+        if self._rrange is False:
+            self._rrange = self.suffix_array.find_reverse_ngram_range(
+                    self.ngram)
+        return self._rrange
+
+################################################################################
+
+    def frequency(self):
+        """
+            Returns the number of occurrences of the ngram.
+        """
+        if self._range is False and self._rrange is not False:
+            indexrange = self._rrange
+        else:
+            indexrange = self.forward_range()
+        if indexrange is None:
+            return 0
+        return indexrange[1] - indexrange[0] + 1
+
+################################################################################
+
+    def extend_right(self, symbol):
+        """
+            Returns a cursor on the ngram followed by `symbol`.
+        """
+        indexrange = self.forward_range()
+        ngram = self.ngram + (symbol,)
+        if indexrange is None:
+            return NgramCursor(self.suffix_array, ngram, None, None)
+        first, last = indexrange
+        return NgramCursor(self.suffix_array, ngram,
+                self.suffix_array.find_ngram_range(ngram, first, last))
+
+################################################################################
+
+    def extend_left(self, symbol):
+        """
+            Returns a cursor on the ngram preceded by `symbol`.
+        """
+        rindexrange = self.reverse_range()
+        ngram = (symbol,) + self.ngram
+        if rindexrange is None:
+            return NgramCursor(self.suffix_array, ngram, None, None)
+        first, last = rindexrange
+        return NgramCursor(self.suffix_array, ngram, False,
+                self.suffix_array.find_reverse_ngram_range(ngram, first, last))
+
+################################################################################
+
+    def right_extensions(self):
+        """
+            Returns the list of `(symbol, frequency)` pairs of the words that
+            follow the ngram (see `SuffixArray.right_extensions`).
+        """
+        indexrange = self.forward_range()
+        if indexrange is None:
+            return []
+        return self.suffix_array.right_extensions(indexrange, len(self.ngram))
+
+################################################################################
+
+    def left_extensions(self):
+        """
+            Returns the list of `(symbol, frequency)` pairs of the words that
+            precede the ngram (see `SuffixArray.left_extensions`).
+        """
+        rindexrange = self.reverse_range()
+        if rindexrange is None:
+            return []
+        return self.suffix_array.left_extensions(rindexrange, len(self.ngram))
+
+
+################################################################################
+################################################################################
+
+class IndexContainer(object):
+    """
+        Read-only view of a single-file index. The file starts with a header
+        (`CONTAINER_HEADER`) holding the number of sections, the offset of the
+        table of contents and the content checksum of the index. Sections
+        (e.g. `info`, `lemma.corpus`, `lemma+pos.suffix`) follow, each one
+        starting at a multiple of `CONTAINER_ALIGNMENT` bytes, and the table of
+        contents (`CONTAINER_TOC_ENTRY` records) comes last. The whole file is
+        accessed through a single `mmap`.
+    """
+
+################################################################################
+
+    def __init__(self, path):
+        self.path = path
+        container_file = open(path, "rb")
+        try:
+            self.mmap = mmap.mmap(container_file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        finally:
+            container_file.close()
+
+        if len(self.mmap) < CONTAINER_HEADER.size:
+            error("Index container {path} is truncated", path=path)
+        magic, version, n_sections, toc_offset, self.checksum = \
+                CONTAINER_HEADER.unpack_from(self.mmap, 0)
+        if magic != CONTAINER_MAGIC:
+            error("{path} is not an index container", path=path)
+        if version != CONTAINER_VERSION:
+            error("Unsupported index container version {v} in {path}",
+                  v=version, path=path)
+
+        self.sections = {}  # name -> (offset, length, stamp)
+        for i in xrange(n_sections):
+            name, offset, length, stamp = CONTAINER_TOC_ENTRY.unpack_from(
+                    self.mmap, toc_offset + i * CONTAINER_TOC_ENTRY.size)
+            name = name.rstrip(b"\0").decode("utf-8")
+            if offset + length > len(self.mmap):
+                error("Section {name} of index container {path} is "
+                      "truncated", name=name, path=path)
+            self.sections[name] = (offset, length, stamp)
+
+################################################################################
+
+    def has_section(self, name):
+        return name in self.sections
+
+################################################################################
+
+    def section(self, name):
+        """
+            Returns the contents of section `name` as a byte string.
+        """
+        offset, length, stamp = self.sections[name]
+        return self.mmap[offset:offset + length]
+
+################################################################################
+
+    def section_chunks(self, name, chunk_size=1 << 20):
+        """
+            Returns an iterator over the contents of section `name` in blocks
+            of at most `chunk_size` bytes.
+        """
+        offset, length, stamp = self.sections[name]
+        for start in xrange(offset, offset + length, chunk_size):
+            yield self.mmap[start:min(start + chunk_size, offset + length)]
+
+################################################################################
+
+    def is_stale(self, name):
+        """
+            Returns True if section `name` was built from an index whose
+            content checksum differs from the checksum of this container.
+            This is the case of fused arrays that were carried over when
+            the non-fused attributes were re-indexed.
+        """
+        return self.sections[name][2] != self.checksum
+
+################################################################################
+
+    def close(self):
+        self.mmap.close()
+
+################################################################################
+
+    def write(path, sections, checksum):
+        """
+            Static method that writes a new container file at `path`.
+            The file is first written to a temporary path, then renamed,
+            so that readers never see a partially written container.
+
+            @param sections A list of `(name, chunks, stamp)` triples, where
+            `chunks` is an iterable of byte strings and `stamp` is the
+            checksum of the contents from which the section was built.
+
+            @param checksum The content checksum of the index.
+        """
+        dirname = os.path.dirname(os.path.abspath(path))
+        (fd, tmppath) = tempfile.mkstemp(dir=dirname, prefix=".mwi-")
+        output = os.fdopen(fd, "wb")
+        try:
+            toc = []
+            position = CONTAINER_HEADER.size
+            output.write(b"\0" * position)
+            for name, chunks, stamp in sections:
+                padding = -position % CONTAINER_ALIGNMENT
+                output.write(b"\0" * padding)
+                position += padding
+                offset = position
+                for chunk in chunks:
+                    output.write(chunk)
+                    position += len(chunk)
+                toc.append(CONTAINER_TOC_ENTRY.pack(name.encode("utf-8"),
+                        offset, position - offset, stamp))
+
+            for entry in toc:
+                output.write(entry)
+            output.seek(0)
+            output.write(CONTAINER_HEADER.pack(CONTAINER_MAGIC,
+                    CONTAINER_VERSION, len(toc), position, checksum))
+            output.close()
+            os.chmod(tmppath, 0o644)
+            os.rename(tmppath, path)
+        except:
+            output.close()
+            os.remove(tmppath)
+            raise
+
+    write = staticmethod(write)
+
+
 ################################################################################
 ################################################################################
 
@@ -514,6 +1166,7 @@ class Index(object):
         self.arrays = {}
         self.metadata = {"corpus_size": 0}
         self.sentence_factory = SentenceFactory()
+        self.container = None
 
         Index.use_c_indexer(use_c_indexer)
 
@@ -542,12 +1195,201 @@ class Index(object):
         """
         self.basepath = path
         self.metadata_path = path + ".info"
+        self.container_path = path + CONTAINER_EXT
+        if self.container is not None:
+            self.container.close()
+            self.container = None
 
 ################################################################################
 
-    def array_file_exists(self, attr):
+    def get_container(self):
+        """
+            Returns the `IndexContainer` of this index, or None if the index
+            is only stored as separate files.
+        """
+        if self.container is None and os.path.isfile(self.container_path):
+            verbose("Opening index container %s" % self.container_path)
+            self.container = IndexContainer(self.container_path)
+        return self.container
+
+################################################################################
+
+    def loose_array_exists(self, attr):
+        """
+            Returns True if `attr` is stored as separate index files.
+            Separate files take precedence over the container.
+        """
         return os.path.isfile(self.basepath + "." + attr + ".corpus")
 
+################################################################################
+
+    def array_file_exists(self, attr):
+        if self.loose_array_exists(attr):
+            return True
+        container = self.get_container()
+        return container is not None and container.has_section(attr + ".corpus")
+
+################################################################################
+
+    def loose_attributes(self):
+        """
+            Returns the sorted list of attributes (fused or not) that are
+            stored as separate files with this index's base path.
+        """
+        dirname = os.path.dirname(self.basepath) or "."
+        prefix = os.path.basename(self.basepath) + "."
+        attrs = []
+        for filename in os.listdir(dirname):
+            if filename.startswith(prefix) and filename.endswith(".corpus"):
+                attr = filename[len(prefix):-len(".corpus")]
+                if attr and "." not in attr:
+                    attrs.append(attr)
+        return sorted(attrs)
+
+################################################################################
+
+    def stored_attributes(self):
+        """
+            Returns the sorted list of attributes (fused or not) available in
+            this index, either as separate files or in the container.
+        """
+        attrs = set(self.loose_attributes())
+        container = self.get_container()
+        if container is not None:
+            for name in container.sections:
+                if name.endswith(".corpus"):
+                    attrs.add(name[:-len(".corpus")])
+        return sorted(attrs)
+
+################################################################################
+
+    def read_attribute(self, attr):
+        """
+            Returns an iterator over the value of `attr` for every word in
+            the corpus (see `read_attribute_from_index`).
+        """
+        if self.loose_array_exists(attr):
+            return read_attribute_from_index(attr, self.basepath)
+        array = SuffixArray()
+        array.load_from_container(self.get_container(), attr)
+        return (array.symbols.number_to_symbol[n] for n in array.corpus)
+
+################################################################################
+
+    def _base_corpus_chunks(self):
+        """
+            Returns `(attr, chunks)` pairs for the corpus arrays of all
+            non-fused attributes, as expected by `checksum_corpus_arrays`.
+            If any non-fused attribute is stored as separate files, only the
+            separate files are considered.
+        """
+        loose = [a for a in self.loose_attributes() if '+' not in a]
+        if loose:
+            return [(attr, read_file_chunks(self.basepath + "." + attr +
+                    ".corpus")) for attr in loose]
+        container = self.get_container()
+        return [(attr, container.section_chunks(attr + ".corpus"))
+                for attr in self.stored_attributes() if '+' not in attr]
+
+################################################################################
+
+    def content_checksum(self):
+        """
+            Returns the content checksum of this index (a 16-byte string).
+            For indices stored in a container, it is read from the header.
+            Otherwise, it is computed from the corpus arrays and kept in the
+            file `basepath + CHECKSUM_EXT`, together with the size and
+            modification time of each array: it is read from there as long
+            as the arrays are unchanged.
+        """
+        container = self.get_container()
+        loose = [a for a in self.loose_attributes() if '+' not in a]
+        if container is not None and not loose:
+            return container.checksum
+        if not loose:
+            return checksum_corpus_arrays(self._base_corpus_chunks())
+
+        stamps = []
+        for attr in loose:
+            stat = os.stat(self.basepath + "." + attr + ".corpus")
+            stamps.append("%s %d %r" % (attr, stat.st_size, stat.st_mtime))
+        path = self.basepath + CHECKSUM_EXT
+        if os.path.isfile(path):
+            with open(path) as checksum_file:
+                lines = checksum_file.read().splitlines()
+            if lines[1:] == stamps and len(lines[0]) == 32:
+                return binascii.unhexlify(lines[0])
+        verbose("Computing the content checksum of index %s" % self.basepath)
+        checksum = checksum_corpus_arrays(self._base_corpus_chunks())
+        try:
+            with open(path + ".tmp", "w") as checksum_file:
+                checksum_file.write("\n".join([binascii.hexlify(checksum)]
+                                               + stamps) + "\n")
+            os.rename(path + ".tmp", path)
+        except (IOError, OSError):
+            pass  # e.g. an index in a read-only directory
+        return checksum
+
+################################################################################
+
+    def pack(self, remove_files=False):
+        """
+            Writes the index to the single container file at
+            `self.container_path`. Non-fused attributes are taken from the
+            separate files if there are any, and from the current container
+            otherwise. Fused attributes that only exist in the current
+            container are carried over together with the checksum they were
+            built from, so that they are detected as stale (and rebuilt on
+            load) if the non-fused attributes have changed.
+
+            @param remove_files If True, removes the separate files once they
+            have been packed into the container.
+        """
+        container = self.get_container()
+        checksum = self.content_checksum()
+        loose = self.loose_attributes()
+        base_is_loose = [a for a in loose if '+' not in a] != []
+        packed_paths = []
+        sections = []
+
+        if os.path.isfile(self.metadata_path):
+            sections.append(("info", read_file_chunks(self.metadata_path),
+                             checksum))
+            packed_paths.append(self.metadata_path)
+        elif container is not None and container.has_section("info"):
+            sections.append(("info", container.section_chunks("info"),
+                             container.sections["info"][2]))
+        else:
+            error("Cannot pack index {path}: metadata not found",
+                  path=self.basepath)
+
+        for attr in self.stored_attributes():
+            from_container = attr not in loose
+            if from_container and '+' not in attr and base_is_loose:
+                continue  # Obsolete version of a re-indexed attribute
+            for suffix in ARRAY_FILE_SUFFIXES + OPTIONAL_ARRAY_FILE_SUFFIXES:
+                name = attr + suffix
+                path = self.basepath + "." + name
+                if not from_container:
+                    if os.path.isfile(path):
+                        sections.append((name, read_file_chunks(path),
+                                         checksum))
+                        packed_paths.append(path)
+                elif container.has_section(name):
+                    sections.append((name, container.section_chunks(name),
+                                     container.sections[name][2]))
+
+        verbose("Packing index into %s" % self.container_path)
+        IndexContainer.write(self.container_path, sections, checksum)
+        if container is not None:
+            container.close()
+            self.container = None
+        if remove_files:
+            for path in packed_paths:
+                os.remove(path)
+            if base_is_loose and os.path.isfile(self.basepath + CHECKSUM_EXT):
+                os.remove(self.basepath + CHECKSUM_EXT)
+
 ################################################################################
 
     def load(self, attribute):
@@ -564,20 +1406,237 @@ class Index(object):
         if not self.array_file_exists(attribute):
             if '+' in attribute:
                 self.make_fused_array(attribute.split('+'))
+                self.pack_fused_array()
             else:
                 warn("Cannot load attribute %s; index files not present."
                      % attribute)
                 return None
+        elif '+' in attribute and not self.loose_array_exists(attribute) \
+                and self.get_container().is_stale(attribute + ".corpus"):
+            warn("Fused array for %s is stale; rebuilding it." % attribute)
+            self.make_fused_array(attribute.split('+'))
+            self.pack_fused_array()
 
         verbose("Loading corpus files for attribute \"%s\"." % attribute)
         array = SuffixArray()
         path = self.basepath + "." + attribute
         array.set_basepath(path)
-        array.load()
+        if self.loose_array_exists(attribute):
+            array.load()
+        else:
+            array.load_from_container(self.get_container(), attribute)
 
         self.arrays[attribute] = array
         return array
 
+################################################################################
+
+    def frequency(self, attribute, ngram):
+        """
+            Returns the number of occurrences of `ngram`, a list of values
+            of `attribute` (e.g. for "lemma+pos", lemma and POS joined by
+            `ATTRIBUTE_SEPARATOR`). Values may contain `WILDCARD`s (see
+            `wildcard_frequency`).
+        """
+        if any(WILDCARD in symbol for symbol in ngram):
+            return self.wildcard_frequency(attribute, ngram)
+        array = self.load(attribute)
+        if array is None:
+            return 0
+        ngram_ids = []
+        for symbol in ngram:
+            wordid = array.symbols.symbol_to_number.get(symbol, None)
+            if not wordid:
+                return 0
+            ngram_ids.append(wordid)
+        return array.frequency(ngram_ids)
+
+################################################################################
+
+    def filter_positions(self, positions, filters):
+        """
+            Returns the list of corpus positions in `positions` at which the
+            words also match each of the `filters`. This allows counting
+            n-grams over combined attributes (e.g. lemma+pos) by looking up
+            the range of one attribute in its suffix array, then checking the
+            other attributes in their corpus arrays, without building (or
+            even having) the fused array.
+
+            @param positions An iterable of corpus positions, e.g. as returned
+            by `SuffixArray.ngram_positions`.
+
+            @param filters A list of `(attr, ngram)` pairs, where `ngram` is a
+            list of symbol numbers of `attr`. Positions holding `None` are not
+            constrained.
+        """
+        for attr, ngram in filters:
+            corpus = self.load(attr).corpus
+            length = len(ngram)
+            if None not in ngram:
+                # Array slices are compared at C speed, one per position
+                target = make_array(ngram)
+                positions = [p for p in positions
+                             if corpus[p:p + length] == target]
+            else:
+                constraints = [(i, sym) for (i, sym) in enumerate(ngram)
+                               if sym is not None]
+                positions = [p for p in positions
+                             if all(corpus[p + i] == sym
+                                    for (i, sym) in constraints)]
+        return positions
+
+################################################################################
+
+    def wildcard_frequency(self, attribute, ngram):
+        """
+            Returns the number of occurrences of `ngram`, as in `frequency`,
+            where (a part of) a value can be `WILDCARD`, e.g. "lemma" joined
+            to `WILDCARD` with `ATTRIBUTE_SEPARATOR` for a word whose POS is
+            not specified. Wildcards match any word, but not across sentences.
+
+            The longest run of specified values of a single attribute (e.g.
+            lemma) is looked up in its suffix array, and the occurrences are
+            then filtered against the corpus arrays of all the attributes, so
+            that no variant of the wildcards needs to be enumerated.
+        """
+        attrs = attribute.split("+")
+        length = len(ngram)
+        filters = []
+        for i, attr in enumerate(attrs):
+            array = self.load(attr)
+            if array is None:
+                return 0
+            ngram_ids = []
+            for symbol in ngram:
+                value = symbol.split(ATTRIBUTE_SEPARATOR)[i] \
+                        if len(attrs) > 1 else symbol
+                if value == WILDCARD:
+                    ngram_ids.append(None)
+                    continue
+                wordid = array.symbols.symbol_to_number.get(value, None)
+                if not wordid:
+                    return 0
+                ngram_ids.append(wordid)
+            filters.append((attr, ngram_ids))
+
+        # Longest run of specified values: (length, attr, start)
+        anchor = (0, None, 0)
+        for attr, ngram_ids in filters:
+            start = 0
+            for end in range(length + 1):
+                if end == length or ngram_ids[end] is None:
+                    anchor = max(anchor, (end - start, attr, start),
+                                 key=lambda a: a[0])
+                    start = end + 1
+        (anchor_length, anchor_attr, start) = anchor
+        corpus = self.load(attrs[0]).corpus
+        if anchor_length == 0:
+            positions = xrange(len(corpus) - length + 1)
+        else:
+            array = self.load(anchor_attr)
+            ngram_ids = dict(filters)[anchor_attr]
+            indexrange = array.find_ngram_range(
+                    ngram_ids[start:start + anchor_length])
+            if indexrange is None:
+                return 0
+            positions = [p - start for p in array.ngram_positions(indexrange)
+                         if p >= start and p - start + length <= len(corpus)]
+        positions = self.filter_positions(positions, filters)
+        # '' (symbol 0) means end-of-sentence
+        return sum(1 for p in positions if 0 not in corpus[p:p + length])
+
+################################################################################
+
+    def sequence_positions(self, constraints, length):
+        """
+            Returns the sorted list of the corpus positions at which a
+            sequence of `length` words of a sentence starts, whose words
+            satisfy the `constraints`.
+
+            As in `wildcard_frequency`, the occurrences of one constraint
+            are looked up in its suffix array: the least frequent of the
+            runs of single values of an attribute (e.g. the lemmas of two
+            consecutive words) and of the sets of values of a word (e.g. the
+            POS tags starting with "V", whose ranges are merged). They are
+            then filtered against the corpus arrays of the other
+            constraints, those with fewer values first, so that the positions
+            of a sequence are found without reading the whole corpus unless
+            it is unconstrained.
+
+            @param constraints A list of `(offset, attr, symbols)` triples:
+            the word `offset` of the sequence must have one of the symbol
+            numbers in the set `symbols` as value of `attr`. Symbol 0 (the
+            end of a sentence) must not be in `symbols`.
+        """
+        guide = self.arrays[self.used_word_attributes[0]].corpus
+        size = len(guide)
+        if any(not symbols for (offset, attr, symbols) in constraints):
+            return []
+
+        # Lookups: (frequency, ranges, first offset, constraints covered)
+        lookups = []
+        for attr in set(attr for (offset, attr, symbols) in constraints):
+            array = self.load(attr)
+            singles = dict((offset, next(iter(symbols)))
+                           for (offset, a, symbols) in constraints
+                           if a == attr and len(symbols) == 1)
+            for start in sorted(singles):
+                if start - 1 in singles:
+                    continue  # Not the start of a run
+                end = start
+                while end in singles:
+                    end += 1
+                indexrange = array.find_ngram_range(
+                        [singles[offset] for offset in xrange(start, end)])
+                if indexrange is None:
+                    return []
+                lookups.append((indexrange[1] - indexrange[0] + 1,
+                                [indexrange], start,
+                                [(offset, attr, set([singles[offset]]))
+                                 for offset in xrange(start, end)]))
+            for (offset, a, symbols) in constraints:
+                if a != attr or not 1 < len(symbols) <= MAX_LOOKUP_SYMBOLS:
+                    continue
+                ranges = [indexrange for indexrange
+                          in (array.find_ngram_range([symbol])
+                              for symbol in symbols)
+                          if indexrange is not None]
+                lookups.append((sum(last - first + 1
+                                    for (first, last) in ranges),
+                                ranges, offset, [(offset, a, symbols)]))
+
+        if lookups:
+            (frequency, ranges, start, covered) = min(lookups,
+                    key=lambda lookup: lookup[0])
+            array = self.load(covered[0][1])
+            positions = sorted(p - start for indexrange in ranges
+                               for p in array.ngram_positions(indexrange)
+                               if start <= p and p - start + length <= size)
+        else:
+            covered = []
+            positions = xrange(size - length + 1)
+
+        # Constraints with fewer values (usually rarer) first
+        filters = sorted((constraint for constraint in constraints
+                          if constraint not in covered),
+                         key=lambda constraint: len(constraint[2]))
+        for (offset, attr, symbols) in filters:
+            corpus = self.load(attr).corpus
+            if len(symbols) == 1:
+                symbol = next(iter(symbols))
+                positions = [p for p in positions
+                             if corpus[p + offset] == symbol]
+            else:
+                positions = [p for p in positions
+                             if corpus[p + offset] in symbols]
+
+        # Unconstrained words must not be sentence ends
+        constrained = set(offset for (offset, attr, symbols) in constraints)
+        for offset in xrange(length):
+            if offset not in constrained:
+                positions = [p for p in positions if guide[p + offset] != 0]
+        return list(positions)
+
 ################################################################################
 
     def make_fused_array(self, attrs):
@@ -587,8 +1646,7 @@ class Index(object):
         """
 
         verbose("Making fused array for " + '+'.join(attrs) + "...")
-        generators = [read_attribute_from_index(attr, self.basepath) \
-                      for attr in attrs]
+        generators = [self.read_attribute(attr) for attr in attrs]
 
         sufarray = Index.make_suffix_array()
         sufarray.set_basepath(self.basepath + "." + '+'.join(attrs))
@@ -611,6 +1669,61 @@ class Index(object):
         sufarray = None
         #print("objects collected by gc.collect()", file=sys.stderr)
 
+################################################################################
+
+    def load_built(self, attr):
+        """
+            Returns the suffix array of an attribute whose index files have
+            just been built, loading it if it is not in memory (e.g. because
+            it was built by the C indexer).
+        """
+        array = self.arrays.get(attr)
+        if array is None or len(array.corpus) == 0:
+            self.arrays.pop(attr, None)
+            array = self.load(attr)
+        return array
+
+################################################################################
+
+    def make_reverse_array(self, attr):
+        """
+            Builds and saves the reverse suffix array (`<attr>.rsuffix`) of
+            an attribute whose index files already exist.
+        """
+        array = self.load_built(attr)
+        verbose("Building reverse suffix array for %s..." % attr)
+        if Index.make_suffix_array is CSuffixArray:
+            array.build_reverse_suffix_array(Index.c_indexer_program)
+        else:
+            array.build_reverse_suffix_array()
+        save_array_to_file(array.rsuffix,
+                           self.basepath + "." + attr + ".rsuffix")
+
+################################################################################
+
+    def make_top_ngrams(self, attr, budget):
+        """
+            Builds and saves the table of the `budget` most frequent unigrams
+            and bigrams (`<attr>.topngrams`) of an attribute whose index files
+            already exist.
+        """
+        array = self.load_built(attr)
+        verbose("Building table of top %d ngrams for %s..." % (budget, attr))
+        array.build_top_ngrams(budget)
+        save_array_to_file(array.top_ngrams_array(),
+                           self.basepath + "." + attr + ".topngrams")
+
+################################################################################
+
+    def pack_fused_array(self):
+        """
+            If this index is stored in a container, moves the separate files
+            of a freshly made fused array into the container.
+        """
+        if self.get_container() is not None and \
+                not [a for a in self.loose_attributes() if '+' not in a]:
+            self.pack(remove_files=True)
+
 ################################################################################
 
     def save(self, attribute):
@@ -627,15 +1740,21 @@ class Index(object):
         """
             Loads the index metadata from the corresponding file.
         """
-        metafile = open(self.metadata_path)
-        for line in metafile:
+        if os.path.isfile(self.metadata_path):
+            metafile = open(self.metadata_path)
+            lines = metafile.readlines()
+            metafile.close()
+        elif self.get_container() is not None:
+            lines = self.container.section("info").splitlines()
+        else:
+            raise IOError("Index metadata not found: " + self.metadata_path)
+
+        for line in lines:
             key, type, value = line.rstrip('\n').split(" ", 2)
             if type == "int":
                 value = int(value)
             self.metadata[key] = value
 
-        metafile.close()
-
 ################################################################################
 
     def save_metadata(self):
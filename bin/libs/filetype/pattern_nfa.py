@@ -0,0 +1,644 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+
+################################################################################
+#
+# Copyright 2010-2014 Carlos Ramisch, Vitor De Araujo, Silvio Ricardo Cordeiro,
+# Sandra Castellanos
+#
+# pattern_nfa.py is part of mwetoolkit
+#
+# mwetoolkit is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# mwetoolkit is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with mwetoolkit.  If not, see <http://www.gnu.org/licenses/>.
+#
+################################################################################
+"""
+    pattern_nfa.py - Token-level matching of `ParsedPattern`s.
+
+    A pattern is compiled into a program for a Pike VM, whose instructions
+    test whole words (instead of the characters of the serialized sentence
+    matched by the regular expression of the pattern). All the matches that
+    start at a given word are found in a single left-to-right simulation,
+    and they are the same as with the regular expression, including the
+    words captured by each group.
+"""
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import absolute_import
+
+import bisect
+import re
+
+from xml.etree import ElementTree
+from ..base.word import WORD_ATTRIBUTES
+
+################################################################################
+
+# Instructions of a program, as tuples `(opcode, arguments...)`
+TOK = 0  # (TOK, predicate number): consume a word satisfying the predicate
+SPLIT = 1  # (SPLIT, pc1, pc2): continue at both, pc1 being preferred
+JMP = 2  # (JMP, pc)
+SAVE = 3  # (SAVE, slot): store the current word number in a capture slot
+MATCH = 4  # (MATCH,)
+FAIL = 5  # (FAIL,): a dead end
+
+REPEAT_REGEX = re.compile(r"\{([0-9]*)(,([0-9]*))?\}\Z")
+
+
+class UnsupportedPattern(Exception):
+    r"""Raised when compiling a pattern that uses a feature that the
+    token-level matcher does not support (e.g. back-references). Such a
+    pattern is matched with its regular expression instead."""
+
+
+################################################################################
+
+class Predicate(object):
+    r"""A test on the attributes of a word, made of `(attr, value)` pairs,
+    where `value` is either a string (the attribute must be equal to it) or
+    a compiled regular expression (which must match the whole attribute).
+    Predicates are interned: equal predicates get the same `number`, so that
+    each of them is only evaluated once per word, even if it appears in
+    several patterns.
+
+    Attribute values are compared through their symbols (see `symbol`), and
+    the result of a regular expression is remembered for each symbol, so
+    that it is only computed once per distinct value.
+    """
+    all = []  # Predicate for each number
+    by_key = {}  # key -> Predicate
+
+    def __init__(self, tests, number):
+        self.number = number
+        self.literals = [(attr, symbol(attr, value)) for (attr, value)
+                         in tests if not hasattr(value, "match")]
+        self.regexes = [(attr, value, {}) for (attr, value) in tests
+                        if hasattr(value, "match")]
+
+    def intern(tests):
+        """Static method that returns the `Predicate` of `tests`."""
+        key = tuple((attr, (value.pattern,) if hasattr(value, "match")
+                     else value) for (attr, value) in tests)
+        predicate = Predicate.by_key.get(key)
+        if predicate is None:
+            predicate = Predicate(tests, len(Predicate.all))
+            Predicate.all.append(predicate)
+            Predicate.by_key[key] = predicate
+        return predicate
+
+    intern = staticmethod(intern)
+
+    def evaluate(self, sentence):
+        """Returns the list of the results of the predicate for each word of
+        `sentence`, a `TokenSentence`."""
+        result = [True] * len(sentence.words)
+        for attr, value_symbol in self.literals:
+            result = [previous and value == value_symbol for (previous, value)
+                      in zip(result, sentence.column(attr))]
+        for attr, regex, known in self.regexes:
+            values = _VALUES[attr]
+            hits = []
+            for value in sentence.column(attr):
+                hit = known.get(value)
+                if hit is None:
+                    hit = known[value] = regex.match(values[value]) is not None
+                hits.append(hit)
+            result = [previous and hit for (previous, hit)
+                      in zip(result, hits)]
+        return result
+
+    def attributes(self):
+        """Returns the set of the attributes tested by the predicate."""
+        return set(attr for (attr, value_symbol) in self.literals) \
+                | set(attr for (attr, regex, known) in self.regexes)
+
+    def literal(self, attr):
+        """Returns the value that the attribute `attr` must be equal to, or
+        None if the predicate requires none (for "syn", it is compared to
+        the value surrounded by ";", see `accepts`)."""
+        for (literal_attr, value_symbol) in self.literals:
+            if literal_attr == attr:
+                return _VALUES[attr][value_symbol]
+        return None
+
+    def accepts(self, attr, value):
+        """Returns whether a word whose attribute `attr` is `value` passes
+        the tests of the predicate on `attr` (the value of "syn" being
+        given as in a `Word`, without the surrounding ";")."""
+        if attr == "syn":
+            value = ";" + value + ";"
+        for (literal_attr, value_symbol) in self.literals:
+            if literal_attr == attr and _VALUES[attr][value_symbol] != value:
+                return False
+        for (regex_attr, regex, known) in self.regexes:
+            if regex_attr == attr and regex.match(value) is None:
+                return False
+        return True
+
+
+# Symbol tables of attribute values: attr -> {value: symbol}, and
+# attr -> [value of each symbol]
+_SYMBOLS = dict((attr, {}) for attr in WORD_ATTRIBUTES)
+_VALUES = dict((attr, []) for attr in WORD_ATTRIBUTES)
+
+def symbol(attr, value):
+    """Returns the integer that stands for `value` in the attribute `attr`
+    (the value of "syn" being surrounded by ";", as in serialized words)."""
+    symbols = _SYMBOLS[attr]
+    value_symbol = symbols.get(value)
+    if value_symbol is None:
+        value_symbol = symbols[value] = len(symbols)
+        _VALUES[attr].append(value)
+    return value_symbol
+
+
+################################################################################
+
+class TokenSentence(object):
+    r"""A word list being matched, with the symbols of its attribute values
+    and the results of the predicates tested on its words so far (shared by
+    all the patterns)."""
+
+    def __init__(self, words):
+        self.words = list(words)
+        self.columns = {}  # attr -> [symbol for each word]
+        self.value_sets = {}  # attr -> set of the symbols in `columns[attr]`
+        self.results = {}  # predicate number -> [result for each word]
+        self.starts = {}  # predicate numbers -> [word numbers]
+
+    def column(self, attr):
+        """Returns the list of the symbols of `attr` for each word."""
+        column = self.columns.get(attr)
+        if column is None:
+            if attr == "syn":
+                column = [symbol(attr, ";" + word.syn + ";")
+                          for word in self.words]
+            else:
+                column = [symbol(attr, getattr(word, attr))
+                          for word in self.words]
+            self.columns[attr] = column
+        return column
+
+    def value_set(self, attr):
+        """Returns the set of the symbols of `attr` in the sentence."""
+        values = self.value_sets.get(attr)
+        if values is None:
+            values = self.value_sets[attr] = frozenset(self.column(attr))
+        return values
+
+    def results_of(self, predicate_number):
+        """Returns the list of the results of a predicate for each word."""
+        results = self.results.get(predicate_number)
+        if results is None:
+            results = self.results[predicate_number] = \
+                    Predicate.all[predicate_number].evaluate(self)
+        return results
+
+    def satisfying(self, predicate_numbers):
+        """Returns the sorted list of the numbers of the words that satisfy
+        any of the predicates in the tuple `predicate_numbers`."""
+        starts = self.starts.get(predicate_numbers)
+        if starts is None:
+            hits = [False] * len(self.words)
+            for predicate_number in predicate_numbers:
+                hits = [previous or hit for (previous, hit)
+                        in zip(hits, self.results_of(predicate_number))]
+            starts = self.starts[predicate_numbers] = \
+                    [i for (i, hit) in enumerate(hits) if hit]
+        return starts
+
+
+################################################################################
+
+class PatternNFA(object):
+    r"""The program of a `ParsedPattern` for the Pike VM, along with its
+    capture groups. Build with `compile_pattern`.
+
+    Group captures are stored in slots (two per group, for the numbers of
+    the first and after-last words). Only the groups that can contain a
+    whole word are captured: the regular expression's `id_*` and `ignore_*`
+    groups, and the `wid_*_wordnum` group of words with an id (which holds
+    the start of the serialized word).
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.prog = []
+        self.groups = []  # (group number in the regex, first slot), sorted
+        self.slot_of_group = {}  # group name -> first slot
+        self.anchored = False  # Matches only start at the first word
+        self.first_predicates = None  # See `next_start`
+        self.nullable = False
+        self.closures = None  # pc -> [(pc, slots saved)], see `closure`
+
+################################################################################
+
+    def slot(self, name):
+        """Returns the first capture slot of the group `name`."""
+        if name not in self.slot_of_group:
+            self.slot_of_group[name] = 2 * len(self.slot_of_group)
+        return self.slot_of_group[name]
+
+################################################################################
+
+    def finish(self):
+        """Computes what is needed for matching, once the program is
+        complete."""
+        groupindex = self.pattern.compiled_pattern.groupindex
+        self.groups = sorted((groupindex[name], slot)
+                             for (name, slot) in self.slot_of_group.items())
+        self.n_slots = 2 * len(self.slot_of_group)
+        self.closures = [self.compute_closure(pc)
+                         for pc in xrange(len(self.prog))]
+        # Predicates that the first word of a match must satisfy
+        first = [pc for (pc, saves) in self.closures[0]]
+        self.nullable = any(self.prog[pc][0] == MATCH for pc in first)
+        self.first_predicates = tuple(sorted(set(self.prog[pc][1]
+                                                 for pc in first
+                                                 if self.prog[pc][0] == TOK)))
+
+################################################################################
+
+    def next_start(self, sentence, i):
+        """Returns the number of the first word of `sentence` (a
+        `TokenSentence`), from the `i`th on, at which a match may start, or
+        the number of words if there is none."""
+        if self.nullable:
+            return i
+        starts = sentence.satisfying(self.first_predicates)
+        index = bisect.bisect_left(starts, i)
+        return starts[index] if index < len(starts) else len(sentence.words)
+
+################################################################################
+
+    def word_sequence(self):
+        """Returns the list of the `Predicate`s of the words of the pattern,
+        if it only matches a fixed sequence of words (each satisfying its
+        predicate) anywhere in a sentence, or None otherwise (the pattern
+        has alternatives, repetitions or an anchor). A sequence matches
+        once at most at each word, whatever the match distance."""
+        if self.anchored:
+            return None
+        predicates = []
+        for instruction in self.prog[:-1]:
+            if instruction[0] == TOK:
+                predicates.append(Predicate.all[instruction[1]])
+            elif instruction[0] != SAVE:
+                return None
+        return predicates if predicates else None
+
+################################################################################
+
+    def compute_closure(self, pc):
+        """Returns the list of the TOK and MATCH instructions reached from
+        `pc` without consuming a word, in order of priority, as
+        `(pc, slots)` pairs, where `slots` are the capture slots saved on
+        the way."""
+        prog = self.prog
+        reached = []
+        seen = set()
+        stack = [(pc, ())]
+        while stack:
+            (pc, slots) = stack.pop()
+            if pc in seen:
+                continue
+            seen.add(pc)
+            instruction = prog[pc]
+            opcode = instruction[0]
+            if opcode == JMP:
+                stack.append((instruction[1], slots))
+            elif opcode == SPLIT:
+                stack.append((instruction[2], slots))
+                stack.append((instruction[1], slots))
+            elif opcode == SAVE:
+                stack.append((pc + 1, slots + (instruction[1],)))
+            elif opcode != FAIL:
+                reached.append((pc, slots))
+        return reached
+
+    def closure(self, pc, caps, bits, i):
+        """Returns the list of `(pc, caps, bits)` threads reached from `pc`
+        without consuming a word, `i` being the number of the next word, in
+        order of priority. Only TOK and MATCH instructions are listed.
+        """
+        threads = []
+        for (pc, slots) in self.closures[pc]:
+            if slots:
+                new_caps = list(caps)
+                for slot in slots:
+                    new_caps[slot] = i
+                threads.append((pc, tuple(new_caps), bits))
+            else:
+                threads.append((pc, caps, bits))
+        return threads
+
+################################################################################
+
+    def run(self, sentence, start, wanted="All"):
+        """Runs the program on the words of `sentence` (a `TokenSentence`)
+        from word number `start`. Returns the list of matches, as
+        `(end, caps, bits)` tuples: `end` is the number of the word after the
+        match, `caps` holds the capture slots, and bit `j` of `bits` is set
+        if the match is preferred to the `j`th match of the list.
+
+        This is a Pike VM, whose list of threads is kept in order of
+        priority (that of the backtracking regular expression engine): a
+        thread is preferred to all the threads after it, and so are the
+        matches it leads to. When a thread matches, the threads before it
+        get a bit in `bits`, which all their descendants inherit.
+
+        If `wanted` is "Preferred", only the preferred match is returned:
+        the threads after a match are dropped, so that each new match is
+        preferred to the previous ones. If `wanted` is "Shortest", only the
+        preferred one among the shortest matches is returned.
+        """
+        prog = self.prog
+        closures = self.closures
+        results = sentence.results
+        n_words = len(sentence.words)
+        matches = []
+        threads = self.closure(0, (-1,) * self.n_slots, 0, start)
+        i = start
+        while threads:
+            next_threads = []
+            n_preferred = None  # Number of next threads preferred to a match
+            seen = set()
+            for (pc, caps, bits) in threads:
+                instruction = prog[pc]
+                if instruction[0] == MATCH:
+                    if wanted == "Shortest":
+                        return [(i, caps, bits)]
+                    if wanted == "Preferred":
+                        matches = [(i, caps, bits)]
+                        break
+                    matches.append((i, caps, bits))
+                    n_preferred = len(next_threads)
+                    continue
+                if i == n_words:
+                    continue
+                hits = results.get(instruction[1])
+                if hits is None:
+                    hits = sentence.results_of(instruction[1])
+                if not hits[i]:
+                    continue
+                for (next_pc, slots) in closures[pc + 1]:
+                    if next_pc in seen:
+                        continue
+                    seen.add(next_pc)
+                    if slots:
+                        next_caps = list(caps)
+                        for slot in slots:
+                            next_caps[slot] = i + 1
+                        next_threads.append((next_pc, tuple(next_caps), bits))
+                    else:
+                        next_threads.append((next_pc, caps, bits))
+            if n_preferred:
+                match_bit = 1 << (len(matches) - 1)
+                next_threads[:n_preferred] = [(pc, caps, bits | match_bit)
+                        for (pc, caps, bits) in next_threads[:n_preferred]]
+            threads = next_threads
+            i += 1
+        return matches
+
+################################################################################
+
+    def matches_at(self, sentence, start, match_distance="All",
+                   first_only=False):
+        """Returns the list of `(end, caps)` pairs of the matches that start
+        at word number `start`, in the order in which the regular expression
+        of the pattern would find them: its preferred match, then the
+        preferred match among the shorter ones, and so on. If
+        `first_only`, only the preferred match is returned. Otherwise, only
+        the match selected by `match_distance` is guaranteed to be in the
+        list (the first one for "Longest", the last one for "Shortest").
+        """
+        if first_only or match_distance == "Longest":
+            wanted = "Preferred"
+        else:
+            wanted = match_distance
+        matches = self.run(sentence, start, wanted)
+        if wanted != "All":
+            return [(end, caps) for (end, caps, bits) in matches]
+
+        def preferred(j, k):
+            # Whether match j is preferred to match k
+            if j > k:
+                return bool(matches[j][2] >> k & 1)
+            return not matches[k][2] >> j & 1
+
+        result = []
+        candidates = range(len(matches))
+        while candidates:
+            best = candidates[0]
+            for j in candidates[1:]:
+                if preferred(j, best):
+                    best = j
+            (end, caps, bits) = matches[best]
+            result.append((end, caps))
+            candidates = [j for j in candidates if matches[j][0] < end]
+        return result
+
+
+################################################################################
+
+def compile_pattern(pattern):
+    """Returns the `PatternNFA` of `pattern`, a `ParsedPattern` parsed from
+    XML. Raises `UnsupportedPattern` if the pattern cannot be matched at
+    the token level.
+    """
+    if getattr(pattern, "node", None) is None:
+        raise UnsupportedPattern("pattern not parsed from XML")
+    nfa = PatternNFA(pattern)
+    compiler = _Compiler(nfa)
+    compiler.compile_node(pattern.node)
+    nfa.prog.append((MATCH,))
+    nfa.finish()
+    return nfa
+
+
+class _Compiler(object):
+    r"""Emits the program of a `PatternNFA`, walking the XML pattern in the
+    same order as `ParsedPattern._do_parse`, so that groups get the same
+    names (and thus numbers) as in the regular expression."""
+
+    def __init__(self, nfa):
+        self.nfa = nfa
+        self.prog = nfa.prog
+        self.temp_id = 0  # As `ParsedPattern.temp_id`
+
+    def emit(self, *instruction):
+        self.prog.append(instruction)
+        return len(self.prog) - 1
+
+    def compile_node(self, node):
+        if node.tag == ElementTree.Comment:
+            pass
+        elif node.tag == "pat":
+            self.compile_pat(node)
+        elif node.tag == "either":
+            self.compile_either(node)
+        elif node.tag == "w":
+            self.compile_w(node)
+        elif node.tag == "backpat":
+            self.compile_backpat(node)
+        else:
+            raise UnsupportedPattern("element " + node.tag)
+
+    def compile_pat(self, node):
+        id = node.get("id", "")
+        ignore = node.get("ignore", "")
+        if node.get("anchor_start", ""):
+            if self.prog or self.nfa.anchored:
+                raise UnsupportedPattern("nested anchor_start")
+            self.nfa.anchored = True
+        if node.get("anchor_end", ""):
+            raise UnsupportedPattern("anchor_end")
+        if ignore:
+            slot = self.nfa.slot("ignore_%d" % self.temp_id)
+            self.temp_id += 1
+            self.emit(SAVE, slot)
+        if id:
+            id_slot = self.nfa.slot("id_" + id)
+            self.emit(SAVE, id_slot)
+        self.compile_repeat(node.get("repeat", ""), lambda: self.compile_children(node),
+                            all(nullable(child) for child in node))
+        if id:
+            self.emit(SAVE, id_slot + 1)
+        if ignore:
+            self.emit(SAVE, slot + 1)
+
+    def compile_children(self, node):
+        for child in node:
+            self.compile_node(child)
+
+    def compile_either(self, node):
+        id = node.get("id", "")
+        alternatives = [child for child in node]
+
+        def compile_body():
+            if id:
+                self.emit(SAVE, self.nfa.slot("id_" + id))
+            jumps = []
+            for child in alternatives[:-1]:
+                split = self.emit(SPLIT, len(self.prog) + 1, None)
+                self.compile_node(child)
+                jumps.append(self.emit(JMP, None))
+                self.prog[split] = (SPLIT, split + 1, len(self.prog))
+            if alternatives:
+                self.compile_node(alternatives[-1])
+            for jump in jumps:
+                self.prog[jump] = (JMP, len(self.prog))
+            if id:
+                self.emit(SAVE, self.nfa.slot("id_" + id) + 1)
+
+        self.compile_repeat(node.get("repeat", ""), compile_body,
+                            not alternatives or any(nullable(child)
+                                                    for child in alternatives))
+
+    def compile_backpat(self, node):
+        # The regex back-reference repeats the serialized words of the
+        # group, which include their position in the sentence: it can only
+        # match if the group is empty.
+        id = node.get("id", "")
+        groups = [group for group in self.nfa.pattern.node.iter()
+                  if group.tag in ("pat", "either", "w")
+                  and group.get("id", "") == id]
+        if len(groups) != 1 or nullable(groups[0]):
+            raise UnsupportedPattern("backpat of a group that may be empty")
+        self.emit(FAIL)
+
+    def compile_repeat(self, repeat, compile_body, body_nullable):
+        """Emits `compile_body()` repeated as `repeat` (as in a regex)."""
+        if not repeat:
+            compile_body()
+            return
+        if repeat in ("?", "*", "+"):
+            (min, max) = {"?": (0, 1), "*": (0, None), "+": (1, None)}[repeat]
+        else:
+            match = REPEAT_REGEX.match(repeat)
+            if not match or (match.group(2) and not match.group(1)
+                             and not match.group(3)):
+                raise UnsupportedPattern("repeat " + repeat)
+            min = int(match.group(1) or 0)
+            max = min if not match.group(2) else \
+                    (int(match.group(3)) if match.group(3) else None)
+            if max is not None and max < min:
+                raise UnsupportedPattern("repeat " + repeat)
+        if body_nullable and max != 1:
+            # The regex engine stops repeating an empty match, in ways
+            # that are not reproduced here
+            raise UnsupportedPattern("repeat of an empty match")
+        for _ in xrange(min):
+            compile_body()
+        if max is None:
+            loop = self.emit(SPLIT, None, None)
+            compile_body()
+            self.emit(JMP, loop)
+            self.prog[loop] = (SPLIT, loop + 1, len(self.prog))
+        else:
+            splits = []
+            for _ in xrange(max - min):
+                splits.append(self.emit(SPLIT, None, None))
+                compile_body()
+            for split in splits:
+                self.prog[split] = (SPLIT, split + 1, len(self.prog))
+
+    def compile_w(self, node):
+        if node.get("syndep", ""):
+            raise UnsupportedPattern("syndep")
+        pattern = self.nfa.pattern
+        negated = set(node.get("neg", "").split(":"))
+        tests = []
+        for attr in WORD_ATTRIBUTES:
+            val = node.get(attr, "")
+            if val.startswith("back:"):
+                raise UnsupportedPattern("back-reference")
+            neg_val = "".join(pattern._neg_children(node, attr))
+            if not val and not neg_val and attr not in negated:
+                continue  # Matches anything
+            if val and "*" not in val and "\\" not in val and not neg_val \
+                    and attr not in negated:
+                tests.append((attr, val))
+                continue
+            val = re.escape(val).replace("\\*", pattern.ATTRIBUTE_WILDCARD) \
+                    if val else pattern.ATTRIBUTE_WILDCARD
+            if attr in negated:
+                val = "(?!" + val + ")" + pattern.ATTRIBUTE_WILDCARD
+            tests.append((attr, re.compile("(?:" + neg_val + val + ")\\Z")))
+        predicate = Predicate.intern(tests)
+
+        id = node.get("id", "")
+        if id:
+            id_slot = self.nfa.slot("id_" + id)
+            wordnum_slot = self.nfa.slot("wid_%s_wordnum" % id)
+            self.emit(SAVE, id_slot)
+            self.emit(SAVE, wordnum_slot)
+        self.emit(TOK, predicate.number)
+        if id:
+            self.emit(SAVE, wordnum_slot + 1)
+            self.emit(SAVE, id_slot + 1)
+
+
+def nullable(node):
+    """Returns whether the pattern element `node` can match no word."""
+    if node.tag == ElementTree.Comment:
+        return True
+    if node.get("repeat", "") in ("?", "*") \
+            or node.get("repeat", "").startswith(("{0", "{,")):
+        return True
+    if node.tag == "pat":
+        return all(nullable(child) for child in node)
+    if node.tag == "either":
+        return any(nullable(child) for child in node) or len(node) == 0
+    return False
@@ -32,10 +32,13 @@ from __future__ import unicode_literals
 from __future__ import absolute_import
 
 from xml.etree import ElementTree
-from ..base.word import Word, WORD_ATTRIBUTES
+from ..base.word import Word, WordView, WORD_ATTRIBUTES
 from ..base.ngram import Ngram
 from ..base.__common import ATTRIBUTE_SEPARATOR, WORD_SEPARATOR
 from .. import util
+from .pattern_nfa import compile_pattern, symbol, TokenSentence, \
+        UnsupportedPattern
+import bisect
 import os
 import re
 import sys
@@ -107,6 +110,78 @@ class ParsedPattern(object):
         self.ignored_numids = set(numid for (strid, numid) in
                 self.compiled_pattern.groupindex.items() if
                 strid.startswith("ignore_"))
+        # Groups that may contain the start of a word, in increasing order
+        # (the other groups are inside an attribute)
+        self.word_numids = sorted(numid for (strid, numid) in
+                self.compiled_pattern.groupindex.items() if
+                strid.startswith(("id_", "ignore_")) or
+                (strid.startswith("wid_") and strid.endswith("_wordnum")))
+        # Token-level matcher, if the pattern only uses supported features
+        self.nfa = None
+        # Literal values that any match must contain (see `may_match`)
+        self.required = []
+        if getattr(self, "node", None) is not None:
+            self.required = self._required_literals(self.node)
+            try:
+                self.nfa = compile_pattern(self)
+            except UnsupportedPattern as reason:
+                util.verbose("Pattern in line {line} is matched as a regular "
+                        "expression ({reason})".format(line=self.source_line,
+                        reason=reason))
+
+    def _required_literals(self, node):
+        """Returns a list of clauses satisfied by any match of the pattern
+        element `node`: each clause is a frozenset of `(attr, symbol)`
+        pairs, and some word of the match has one of them as value (see
+        `pattern_nfa.symbol`). The attributes that only take literal values
+        are taken into account (a wildcard, a negation or a back-reference
+        requires nothing), and "syn" is ignored.
+        """
+        if node.tag == "w":
+            negated = set(node.get("neg", "").split(":"))
+            clauses = []
+            for attr in WORD_ATTRIBUTES:
+                val = node.get(attr, "")
+                if val and attr != "syn" and attr not in negated \
+                        and not val.startswith("back:") and "*" not in val:
+                    clauses.append(frozenset([(attr, symbol(attr, val))]))
+            return clauses
+        if node.tag not in ("pat", "either") \
+                or not re.match(r"(\+|\{0*[1-9][0-9]*(,[0-9]*)?\})?\Z",
+                                node.get("repeat", "")):
+            return []  # Comments, backpats and elements that may be skipped
+        children = [self._required_literals(child) for child in node]
+        if node.tag == "pat":
+            return [clause for clauses in children for clause in clauses]
+        if not children or not all(children):
+            return []
+        # Any alternative of the <either>: join their shortest clauses
+        return [frozenset().union(*(min(clauses, key=len)
+                                    for clauses in children))]
+
+
+    def may_match(self, sentence):
+        """Returns False if the pattern cannot match the `TokenSentence`
+        `sentence`, because it lacks the values in one of the clauses of
+        `self.required`."""
+        for clause in self.required:
+            for (attr, value) in clause:
+                if value in sentence.value_set(attr):
+                    break
+            else:
+                return False
+        return True
+
+
+    def word_sequence(self):
+        """Returns the list of the `Predicate`s of the words of the pattern
+        if it matches a fixed sequence of words, all of which are in its
+        matches (see `PatternNFA.word_sequence`), or None otherwise.
+        """
+        if self.nfa is None or self.ignored_numids:
+            return None
+        return self.nfa.word_sequence()
+
 
     def _do_parse(self, node, scope_repeat):
         if node.tag == ElementTree.Comment:
@@ -310,24 +385,84 @@ class ParsedPattern(object):
         """Returns an iterator over all matches of this pattern in the word list.
         Each iteration yields a pair `(ngram, match_indexes)`.
         """
+        if self.nfa is not None or self.required:
+            sentence = TokenSentence(words)
+            if not self.may_match(sentence):
+                return iter([])
+            if self.nfa is not None:
+                return self.matches_tokens(sentence, match_distance,
+                        overlapping, id_order, anchor_begin, anchor_end)
+        (wordstring, positions) = serialize_words(words)
+        return self.matches_serialized(words, wordstring, positions,
+                match_distance, overlapping, id_order, anchor_begin,
+                anchor_end)
+
+
+    def matches_serialized(self, words, wordstring, positions,
+            match_distance="All", overlapping=True, id_order=["*"],
+            anchor_begin=False, anchor_end=False):
+        """Same as `matches`, for a word list already serialized by
+        `serialize_words` (e.g. once for all the patterns of a `PatternSet`),
+        using the regular expression of the pattern.
+        """
         numid_order = [self.strid_to_numid(strid) for strid in id_order]
-        wordstring = self.WORD_SEPARATOR
-        positions = []
-        wordnum = 1
-        for word in words:
-            positions.append(len(wordstring))
-            attrs = { "wordnum": wordnum }
-            for attr in WORD_ATTRIBUTES:
-                attrs[attr] = getattr(word, attr)
-            attrs["syn"] = ";" + attrs["syn"] + ";"
-            wordstring += self.WORD_FORMAT % attrs + self.WORD_SEPARATOR
-            wordnum += 1
 
+        def next_start(i):
+            # Skip to the first word at which a match may start: no match
+            # starts before the leftmost one found by `search`.
+            found = self.compiled_pattern.search(wordstring, positions[i] - 1)
+            if found is None:
+                return len(positions)
+            return bisect.bisect_left(positions, found.start() + 1)
+
+        def matches_at(i):
+            return list(self._matches_at(words, wordstring, positions[i],
+                    len(wordstring), positions, numid_order, anchor_end))
+
+        return self._match_loop(len(positions), next_start, matches_at,
+                match_distance, overlapping, anchor_begin)
+
+
+    def matches_tokens(self, sentence, match_distance="All",
+            overlapping=True, id_order=["*"], anchor_begin=False,
+            anchor_end=False):
+        """Same as `matches`, for a `TokenSentence`, using the token-level
+        matcher `self.nfa`, which must be available.
+        """
+        numid_order = [self.strid_to_numid(strid) for strid in id_order]
+        interesting_numids = set(numid_order) | self.ignored_numids
+        n_words = len(sentence.words)
+
+        def next_start(i):
+            if self.nfa.anchored:
+                return i if i == 0 else n_words
+            return self.nfa.next_start(sentence, i)
+
+        def matches_at(i):
+            return [self._token_match(sentence.words, i, end, caps,
+                                      numid_order, interesting_numids)
+                    for (end, caps) in self.nfa.matches_at(sentence, i,
+                            match_distance, anchor_end)]
+
+        return self._match_loop(n_words, next_start, matches_at,
+                match_distance, overlapping, anchor_begin)
+
+
+    def _match_loop(self, n_words, next_start, matches_at, match_distance,
+            overlapping, anchor_begin):
+        """Generates the matches of `matches_at(i)` for each word number
+        `i`, according to `match_distance`, `overlapping` and
+        `anchor_begin` (see `matches`). The words before `next_start(i)`
+        are skipped (no match starts there).
+        """
         i = 0
-        while i < len(positions):
-            matches_here = list(self._matches_at(words, wordstring,
-                    positions[i], len(wordstring), positions, numid_order,
-                    anchor_end))
+        while i < n_words:
+            if not anchor_begin:
+                i = next_start(i)
+                if i == n_words:
+                    return
+
+            matches_here = matches_at(i)
 
             increment = 1
             if match_distance == "All":
@@ -352,50 +487,79 @@ class ParsedPattern(object):
             if anchor_begin: return
 
 
+    def _token_match(self, words, start, end, caps, numid_order,
+            interesting_numids):
+        """Returns the `(ngram, match_indexes)` pair of a match of `self.nfa`
+        from word `start` to `end` (excluded), according to the capture
+        slots `caps` (see `_build_match`).
+        """
+        spans = [(numid, caps[slot], caps[slot + 1])
+                 for (numid, slot) in self.nfa.groups
+                 if caps[slot] >= 0 and caps[slot + 1] >= 0]
+        return self._build_match(words, start, end, spans, numid_order,
+                                 interesting_numids)
+
+
     def _matches_at(self, words, wordstring, current_start,
             limit, positions, numid_order, anchor_end):
         current_end = limit
-        matches_here = []
+        interesting_numids = set(numid_order) | self.ignored_numids
         while True:
             result = self.compiled_pattern.match(wordstring, current_start - 1, current_end)
             if not result: return
-
-            start = result.start()
-            end = result.end()
-            current_end = end - 1
-            ngram = []
-            wordnums = []
-
-            n_groups = self.compiled_pattern.groups
-            spans = [(numid, result.span(numid)) for numid in xrange(n_groups+1)]
-            interesting_numids = set(numid_order) | self.ignored_numids
-            words_by_numid = [[] for _ in xrange(n_groups+1)]
-            nums_by_numid = [[] for _ in xrange(n_groups+1)]
-
-            def get_numid(pos):
-                for numid, (beg, end) in reversed(spans):
-                    if beg <= pos < end:
-                        if numid in interesting_numids:
-                            return numid
-                        return 0
-                assert False, "Not even in ID==0?!?!"
-
-            for num, (pos, word) in enumerate(zip(positions, words)):
-                if start <= pos < end:
-                    numid = get_numid(pos)
-                    if numid not in self.ignored_numids:
-                        words_by_numid[numid].append(word)
-                        nums_by_numid[numid].append(num)
-
-            self.debug_id_order(words_by_numid)
-            for numid in numid_order:
-                ngram.extend(words_by_numid[numid])
-                wordnums.extend(nums_by_numid[numid])
-
-            yield (Ngram(copy_word_list(ngram)), wordnums)
+            current_end = result.end() - 1
+
+            # The words of a group are those that start in its span
+            spans = []
+            for numid in self.word_numids:
+                (begin, end) = result.span(numid)
+                if begin != -1:
+                    spans.append((numid, bisect.bisect_left(positions, begin),
+                                  bisect.bisect_left(positions, end)))
+            yield self._build_match(words,
+                    bisect.bisect_left(positions, result.start()),
+                    bisect.bisect_left(positions, result.end()),
+                    spans, numid_order, interesting_numids)
             if anchor_end: return
 
 
+    def _build_match(self, words, start, end, spans, numid_order,
+            interesting_numids):
+        """Returns the `(ngram, match_indexes)` pair of a match from word
+        `start` to `end` (excluded). `spans` holds a `(numid, first, last)`
+        triple for each group that matched words `first` to `last`
+        (excluded), by increasing `numid`: each word belongs to the last
+        group that contains it, or to group 0 if this group is not in
+        `interesting_numids` (the groups of `numid_order` and the ignored
+        ones). The ngram is made of views of the words (see `WordView`),
+        in the order of `numid_order`.
+        """
+        owners = [0] * (end - start)
+        for (numid, first, last) in spans:
+            if numid not in interesting_numids:
+                numid = 0
+            (first, last) = (max(first, start), min(last, end))
+            if first < last:
+                owners[first - start:last - start] = [numid] * (last - first)
+
+        n_groups = self.compiled_pattern.groups
+        words_by_numid = [[] for _ in xrange(n_groups+1)]
+        nums_by_numid = [[] for _ in xrange(n_groups+1)]
+        ignored_numids = self.ignored_numids
+        for (num, numid) in enumerate(owners, start):
+            if numid not in ignored_numids:
+                words_by_numid[numid].append(words[num])
+                nums_by_numid[numid].append(num)
+
+        self.debug_id_order(words_by_numid)
+        ngram = []
+        wordnums = []
+        for numid in numid_order:
+            ngram.extend(WordView(word) for word in words_by_numid[numid])
+            wordnums.extend(nums_by_numid[numid])
+        return (Ngram(ngram), wordnums)
+
+
     def strid_to_numid(self, str_id):
         try:
             return self._strid_to_numid["id_" + str_id]
@@ -431,8 +595,85 @@ class ParsedPattern(object):
 
 
 
-# XXX Do we actually need to copy it?
-# In this case isn't it better to use `copy.deepcopy()`?
+########################################
+
+def serialize_words(words):
+    """Returns a pair `(wordstring, positions)`, where `wordstring` is the
+    string matched by the regular expressions of `ParsedPattern`s (each
+    word in `ParsedPattern.WORD_FORMAT`, followed by `WORD_SEPARATOR`), and
+    `positions` holds the position in `wordstring` of each word.
+    """
+    wordstring = WORD_SEPARATOR
+    positions = []
+    wordnum = 1
+    for word in words:
+        positions.append(len(wordstring))
+        attrs = { "wordnum": wordnum }
+        for attr in WORD_ATTRIBUTES:
+            attrs[attr] = getattr(word, attr)
+        attrs["syn"] = ";" + attrs["syn"] + ";"
+        wordstring += ParsedPattern.WORD_FORMAT % attrs + WORD_SEPARATOR
+        wordnum += 1
+    return (wordstring, positions)
+
+
+########################################
+
+class PatternSet(object):
+    r"""A list of patterns matched together against each word list, which
+    is only serialized once for all of them (if some of them are matched as
+    regular expressions). The predicates tested on the words by the
+    token-level matchers are also evaluated once for all the patterns.
+
+    The patterns that lack some required value in the word list are
+    skipped (see `ParsedPattern.may_match`); `n_checks` and `n_skipped`
+    count how many times a pattern was checked against a word list, and
+    skipped.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.n_checks = 0
+        self.n_skipped = 0
+
+
+    def matches(self, words, match_distance="All", overlapping=True,
+                id_order=["*"], anchor_begin=False, anchor_end=False):
+        """Returns an iterator over the matches of all the patterns in the
+        word list, in the order of the patterns (as if `ParsedPattern.matches`
+        was called on each of them). Each iteration yields a triple
+        `(pattern, ngram, match_indexes)`.
+        """
+        sentence = TokenSentence(words)
+        serialized = None
+        for pattern in self.patterns:
+            self.n_checks += 1
+            if not pattern.may_match(sentence):
+                self.n_skipped += 1
+                continue
+            if pattern.nfa is not None:
+                pattern_matches = pattern.matches_tokens(sentence,
+                        match_distance, overlapping, id_order, anchor_begin,
+                        anchor_end)
+            else:
+                if serialized is None:
+                    serialized = serialize_words(words)
+                (wordstring, positions) = serialized
+                pattern_matches = pattern.matches_serialized(words,
+                        wordstring, positions, match_distance, overlapping,
+                        id_order, anchor_begin, anchor_end)
+            for (ngram, match_indexes) in pattern_matches:
+                yield (pattern, ngram, match_indexes)
+
+
+    def describe(self):
+        """Returns a one-line description of the work saved by the
+        prefilter of required values."""
+        return "Skipped %d of %d pattern-sentence checks (%.1f%%): " \
+                "required values missing from the sentence" % (
+                self.n_skipped, self.n_checks,
+                100 * self.n_skipped / max(self.n_checks, 1))
+
+
 def copy_word_list(ws):
     return [w.copy() for w in ws]
 
@@ -499,6 +740,30 @@ def patternlib_test():
     patternlib_do_test(p, ws, "Longest")
 
 
+def patternlib_benchmark(n_ids=20, n_words=200, repeat=20):
+    r"""Times the matching of a pattern of `n_ids` words with an id each,
+    reordered by `id_order`, on a sentence of `n_words` words, with each
+    engine. Run with `python -m libs.filetype.patternlib --benchmark`."""
+    import timeit
+    node = ElementTree.fromstring("<pat>" + "".join(
+            '<pat id="i{0}"><w pos="N"/></pat>'.format(i)
+            for i in xrange(n_ids)) + "</pat>")
+    for element in node.iter():
+        element.source_line = element.source_col = 0
+    pattern = parse_pattern(node)
+    words = [Word("w%d" % i, "w%d" % i, "N", "") for i in xrange(n_words)]
+    id_order = ["i%d" % i for i in reversed(xrange(n_ids))] + ["*"]
+    n_matches = len(list(pattern.matches(words, id_order=id_order)))
+    nfa = pattern.nfa
+    for (engine, pattern.nfa) in [("token-level", nfa), ("regex", None)]:
+        seconds = min(timeit.repeat(lambda: list(pattern.matches(words,
+                id_order=id_order)), number=1, repeat=repeat))
+        print("{0} ids, {1} words, {2} engine: {3:.2f}ms ({4:.1f}us per "
+              "match)".format(n_ids, n_words, engine, seconds * 1000,
+              seconds * 1e6 / n_matches))
+    pattern.nfa = nfa
+
+
 def pretty_ngram(ngram):
     return " ".join(w.surface for w in ngram)
 
@@ -520,4 +785,7 @@ def patternlib_make(str_pattern):
 
 
 if __name__ == "__main__":
-    patternlib_test()
+    if sys.argv[1:] == ["--benchmark"]:
+        patternlib_benchmark()
+    else:
+        patternlib_test()
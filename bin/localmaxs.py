@@ -54,6 +54,8 @@ from libs.base.corpus_size import CorpusSize
 from libs.base.frequency import Frequency
 from libs.base.candidate import CandidateFactory
 from libs.base.word import Word
+from libs.base.ngram_sketch import NgramSketch
+from libs.base.ngram_automaton import NgramAutomaton
 from libs.util import read_options, treat_options_simplest, verbose, warn, \
     error, interpret_ngram
 from libs import filetype
@@ -102,6 +104,25 @@ OPTIONS may be:
     Use a shelve (disk storage) rather than an in-memory data structure for
     storing candidate counts. Uses less memory, but is slower. Default false.
 
+--sketch <megabytes>
+    Count ngrams approximately, in a count-min sketch that takes at most
+    <megabytes> of memory, whatever the size of the corpus. Only the most
+    frequent ngrams (those whose estimated frequency is at least the value
+    of --freq) are kept, and their estimated frequencies are never below
+    the exact ones. LocalMaxs then only compares the ngrams kept, so rare
+    ngrams no longer hide a frequent one. The error bound is printed in
+    verbose mode.
+
+--sketch-error <epsilon>
+    With --sketch, size the sketch so that estimated frequencies exceed
+    the exact ones by at most <epsilon> times the number of counted ngrams
+    (with probability 0.99). By default, the bound follows from the memory
+    given to --sketch.
+
+--exact
+    With --sketch, read the corpus a second time to count exactly the
+    ngrams kept by the sketch, instead of using estimated frequencies.
+
 {common_options}
 """
 
@@ -111,11 +132,15 @@ selected_candidates = {}
 corpus_size = 0
 input_filetype_ext = None
 base_attr = 'lemma'
-glue = scp_glue
+glue = None  # scp_glue by default, defined below
 min_ngram = 2
 max_ngram = 8
 min_frequency = 2
 use_shelve = False
+sketch = None  # NgramSketch()
+sketch_size = None
+sketch_error = None
+exact_recount = False
 
 
 ################################################################################
@@ -123,9 +148,10 @@ use_shelve = False
 def key(ngram):
     """
         Returns a string key for the given list of words (strings).
-        (Shelves can only be indexed by strings and integers.)
+        (Shelves can only be indexed by strings and integers, and 'shelve'
+        does not speak Unicode, so keys are UTF-8 bytestrings.)
     """
-    return WORD_SEPARATOR.join(ngram)
+    return WORD_SEPARATOR.join(ngram).encode('utf-8')
 
 ################################################################################
 
@@ -133,29 +159,31 @@ def unkey(str):
     """
         Returns a list of words for the given key.
     """
-    return str.split(WORD_SEPARATOR)
+    return str.decode('utf-8').split(WORD_SEPARATOR)
 
 ################################################################################
 
 
 class NGramCounterHandler(filetype.InputHandler):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, corpus_paths, *args, **kwargs):
         super(NGramCounterHandler, self).__init__(*args, **kwargs)
         self.candidate_factory = CandidateFactory()
         self.chain = None
+        self.corpus_paths = corpus_paths
 
     def handle_sentence(self, sentence, info={}):
         """Count all ngrams being considered in the sentence."""
         global corpus_size
 
-        # 'shelve' does not speak Unicode; we must convert Unicode strings back to
-        # plain bytestrings to use them as keys.
-        words = [getattr(w, base_attr).encode('utf-8') for w in sentence]
+        words = [getattr(w, base_attr) for w in sentence]
 
         for ngram_size in range(1, max_ngram + 2):
             for i in range(len(words) - ngram_size + 1):
                 ngram = words[i : i+ngram_size]
                 ngram_key = key(ngram)
+                if sketch is not None:
+                    sketch.add(ngram_key)
+                    continue
                 count = ngram_counts.get(ngram_key, 0)
                 ngram_counts[ngram_key] = count + 1
                 selected_candidates[ngram_key] = True
@@ -175,6 +203,8 @@ class NGramCounterHandler(filetype.InputHandler):
     def after_file(self, fileobj, info={}):
         global corpus_size_f
         corpus_size_f = float(corpus_size)
+        if sketch is not None:
+            count_heavy_hitters(self.corpus_paths)
         verbose("Selecting ngrams through LocalMaxs...")
         self.localmaxs()
         verbose("Outputting candidates file...")
@@ -213,7 +243,7 @@ class NGramCounterHandler(filetype.InputHandler):
         cand = self.candidate_factory.make(id_number=cand_id)
         for value in ngram:
             word = Word(WILDCARD, WILDCARD, WILDCARD, WILDCARD)
-            setattr(word, base_attr, value.decode('utf-8'))
+            setattr(word, base_attr, value)
             cand.append(word)
         freq = Frequency('corpus', ngram_counts[ngram_key])
         cand.add_frequency(freq)
@@ -223,6 +253,53 @@ class NGramCounterHandler(filetype.InputHandler):
 
 ################################################################################
 
+class NGramRecountHandler(filetype.InputHandler):
+    r"""Counts the sentences of the corpus in an `NgramAutomaton` (--exact)."""
+    def __init__(self, automaton):
+        self.automaton = automaton
+
+    def handle_sentence(self, sentence, info={}):
+        self.automaton.scan([getattr(w, base_attr) for w in sentence])
+
+    def _fallback(self, obj, info):
+        pass
+
+
+################################################################################
+
+def count_heavy_hitters(corpus_paths):
+    """
+        Fills `ngram_counts` and `selected_candidates` (option --sketch) with
+        the ngrams whose estimated frequency is at least `min_frequency`,
+        and all of their sub-ngrams, whose glue is needed by LocalMaxs. With
+        --exact, their frequencies are counted again in the corpus.
+    """
+    verbose(sketch.describe())
+    ngram_keys = set()
+    for (ngram_key, estimate) in sketch.heavy_hitters(min_frequency):
+        ngram = unkey(ngram_key)
+        for i in range(len(ngram)):
+            for j in range(i + 1, len(ngram) + 1):
+                ngram_keys.add(key(ngram[i:j]))
+    verbose("Sketch kept %d ngrams" % len(ngram_keys))
+
+    if exact_recount:
+        verbose("Counting these ngrams exactly...")
+        automaton = NgramAutomaton()
+        for ngram_key in ngram_keys:
+            automaton.add(unkey(ngram_key))
+        filetype.parse(corpus_paths, NGramRecountHandler(automaton),
+                       input_filetype_ext)
+        get_count = lambda ngram_key: automaton.frequency(unkey(ngram_key))
+    else:
+        get_count = sketch.estimate
+
+    for ngram_key in ngram_keys:
+        ngram_counts[ngram_key] = get_count(ngram_key)
+        selected_candidates[ngram_key] = True
+
+################################################################################
+
 def main(corpus_paths):
     """
         Main function.
@@ -236,7 +313,11 @@ def main(corpus_paths):
         (selected_candidates, selected_candidates_tmpfile) = make_shelve()
 
     verbose("Counting ngrams...")
-    filetype.parse(corpus_paths, NGramCounterHandler(), input_filetype_ext)
+    if sketch_size is not None:
+        global sketch
+        sketch = NgramSketch(sketch_size, sketch_error)
+    filetype.parse(corpus_paths, NGramCounterHandler(corpus_paths),
+                   input_filetype_ext)
 
     if use_shelve:
         verbose("Removing temporary files...")
@@ -293,9 +374,11 @@ def treat_options( opts, arg, n_arg, usage_string ) :
     global selected_candidates
     global use_shelve
     global input_filetype_ext
+    global sketch_size, sketch_error, exact_recount
 
     treat_options_simplest( opts, arg, n_arg, usage_string )
 
+    glue = scp_glue
     mode = []
     for ( o, a ) in opts:
         if o in ("-s", "--surface") : 
@@ -314,9 +397,32 @@ def treat_options( opts, arg, n_arg, usage_string ) :
             use_shelve = True
         elif o == "--from":
             input_filetype_ext = a
+        elif o == "--sketch":
+            try:
+                sketch_size = int(float(a) * 1024 * 1024)
+                if sketch_size <= 0:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --sketch must be a positive number")
+        elif o == "--sketch-error":
+            try:
+                sketch_error = float(a)
+                if not 0 < sketch_error < 1:
+                    raise ValueError
+            except ValueError:
+                error("Argument of --sketch-error must be between 0 and 1")
+        elif o == "--exact":
+            exact_recount = True
         else:
             raise Exception("Bad arg: " + o)
 
+    if sketch_size is None and (sketch_error is not None or exact_recount):
+        error("Options --sketch-error and --exact only work with --sketch")
+    if sketch_size is not None and use_shelve:
+        error("Options --sketch and --shelve cannot be used together")
+    if exact_recount and "-" in arg:
+        error("Option --exact cannot read the corpus from standard input")
+
 
 ################################################################################
 
@@ -345,6 +451,7 @@ def destroy_shelve(shlv, path):
 
 ################################################################################
 
-longopts = ["from=", "surface", "glue=", "ngram=", "freq=", "shelve"]
+longopts = ["from=", "surface", "glue=", "ngram=", "freq=", "shelve",
+            "sketch=", "sketch-error=", "exact"]
 args = read_options("sG:n:f:iS", longopts, treat_options, 1, usage_string)
 main(args)
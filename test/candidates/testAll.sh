@@ -30,10 +30,17 @@ find_candidates() {
 
 
 cd "$HERE"
-ln -sf "$t_INPUT/ted500.xml" "$t_LOCAL_INPUT/VerbParticle/corpus.xml"
+for datadir in VerbParticle Features Prefilter IdOrder; do
+    ln -sf "$t_INPUT/ted500.xml" "$t_LOCAL_INPUT/$datadir/corpus.xml"
+done
 
 
-for datadir in NounCompound VerbParticle; do
+# Features: patterns with each element of the pattern language (repeat,
+# either, ignore, neg, backpat and, matched as a regular expression,
+# syndep); the reference matches were found with the regex engine alone.
+# Prefilter: patterns with optional, alternative and negated literals,
+# which must not make the sentences without them be skipped.
+for datadir in NounCompound VerbParticle Features Prefilter; do
     mkdir -p "$t_OUTDIR/$datadir"
 
     t_testname "Find all matches"
@@ -51,3 +58,13 @@ for datadir in NounCompound VerbParticle; do
     t_testname "Find shortest matches (non-overlapping)"
     find_candidates '-N -d Shortest' "shortest-nonoverlap-candidates"
 done
+
+
+datadir=IdOrder
+mkdir -p "$t_OUTDIR/$datadir"
+
+t_testname "Find matches in the order of the pattern IDs"
+find_candidates '--id-order noun:*' "id-order-candidates"
+
+t_testname "Find shortest matches in the order of the pattern IDs"
+find_candidates '-d Shortest --id-order noun:adj' "shortest-id-order-candidates"
@@ -36,7 +36,7 @@ main() {
     t_compare_with_ref "candidates-from-index.xml"
 
     t_testname "Individual word frequency counting"
-    t_run "$t_BIN/counter.py -v -i $t_OUTDIR/corpus.info $t_OUTDIR/candidates-from-index.xml >$t_OUTDIR/candidates-counted.xml"
+    t_run "$t_BIN/counter.py -v --filter-limit 0 -i $t_OUTDIR/corpus.info $t_OUTDIR/candidates-from-index.xml >$t_OUTDIR/candidates-counted.xml"
     t_compare_with_ref "candidates-counted.xml"
     for filepath in "$t_REFDIR/corpus.lemma+pos".*; do
         t_compare_with_ref "$(basename "$filepath")"
@@ -0,0 +1,105 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+"""
+    Lists the words that precede and follow some ngrams of an index, used by
+    testAll.sh to check the reverse suffix arrays built by `index.py -r`.
+
+    Usage: ngram-extensions.py <cursor|forward> <index> <attr> <n-words>
+
+    The ngrams are the first <n-words> words of the symbol table of <attr>,
+    each one extended with its most frequent left and right neighbours.
+    For each ngram, a line "<ngram> <freq> right: <word>:<freq>...
+    left: <word>:<freq>..." is output. In mode "cursor", the ngrams are
+    extended and their neighbours are listed with `NgramCursor`, which uses
+    the reverse suffix array. In mode "forward", they are found by
+    searching each extended ngram in the (forward) suffix array only. Both
+    modes must give the same output.
+"""
+
+from __future__ import print_function
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "..",
+                                "..", "bin"))
+from libs.filetype import indexlib
+
+
+def forward_frequency(array, ngram):
+    indexrange = array.find_ngram_range(ngram)
+    if indexrange is None:
+        return 0
+    return indexrange[1] - indexrange[0] + 1
+
+
+def forward_extensions(array, ngram):
+    """Returns `(freq, right, left)` for `ngram`, using `array.suffix`."""
+    indexrange = array.find_ngram_range(ngram)
+    if indexrange is None:
+        return (0, [], [])
+    positions = array.ngram_positions(indexrange)
+    following = set(array.corpus[pos + len(ngram)] for pos in positions
+                    if pos + len(ngram) < len(array.corpus))
+    preceding = set(array.corpus[pos - 1] for pos in positions if pos > 0)
+    right = [(sym, forward_frequency(array, ngram + (sym,)))
+             for sym in sorted(following) if sym != 0]
+    left = [(sym, forward_frequency(array, (sym,) + ngram))
+            for sym in sorted(preceding) if sym != 0]
+    return (len(positions), right, left)
+
+
+def cursor_extensions(cursor):
+    """Returns `(freq, right, left)` for the ngram of `cursor`."""
+    return (cursor.frequency(), cursor.right_extensions(),
+            cursor.left_extensions())
+
+
+def most_frequent(extensions):
+    return max(extensions, key=lambda (sym, freq): (freq, -sym))[0]
+
+
+def main(mode, basepath, attr, n_words):
+    index = indexlib.Index(basepath, [attr])
+    array = index.load(attr)
+    words = array.symbols.number_to_symbol
+
+    def show(ngram, (freq, right, left)):
+        print(" ".join(words[sym] for sym in ngram).encode("utf-8"), freq,
+              "right:", " ".join("%s:%d" % (words[sym].encode("utf-8"), f)
+                                 for (sym, f) in right),
+              "left:", " ".join("%s:%d" % (words[sym].encode("utf-8"), f)
+                                for (sym, f) in left))
+        return (right, left)
+
+    for sym in xrange(1, min(n_words + 1, len(words))):
+        if mode == "cursor":
+            cursor = array.cursor().extend_right(sym)
+            right, left = show((sym,), cursor_extensions(cursor))
+            if right:
+                show(cursor.ngram + (most_frequent(right),),
+                     cursor_extensions(cursor.extend_right(
+                         most_frequent(right))))
+            if left:
+                extended = cursor.extend_left(most_frequent(left))
+                show(extended.ngram, cursor_extensions(extended))
+                if right:
+                    extended = extended.extend_right(most_frequent(right))
+                    show(extended.ngram, cursor_extensions(extended))
+        else:
+            right, left = show((sym,), forward_extensions(array, (sym,)))
+            if right:
+                ngram = (sym, most_frequent(right))
+                show(ngram, forward_extensions(array, ngram))
+            if left:
+                ngram = (most_frequent(left), sym)
+                show(ngram, forward_extensions(array, ngram))
+                if right:
+                    ngram = ngram + (most_frequent(right),)
+                    show(ngram, forward_extensions(array, ngram))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 5 or sys.argv[1] not in ("cursor", "forward"):
+        sys.exit(__doc__)
+    main(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]))
@@ -0,0 +1,54 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+"""
+    Writes and lists web caches, used by testAll.sh to check the caches
+    merged by `join_web_cache.py`.
+
+    Usage: web-cache.py <load|pickle|dump> <cache> [<entries.txt>]
+
+    In mode "load", the entries of <entries.txt>, one "<term> <freq>
+    <yyyy-mm-dd>" per line, are added to the cache. In mode "pickle", a
+    cache of the old (pickled) format is written with them instead. In mode
+    "dump", the entries of the cache are output in the same format, sorted
+    by term.
+"""
+
+from __future__ import print_function
+
+import cPickle
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "..",
+                                "..", "bin"))
+from libs.base.web_cache import WebCache
+
+
+def read_entries(path):
+    with open(path) as entries_file:
+        for line in entries_file:
+            (term, freq, day) = line.split()
+            yield (term.decode("utf-8"), (int(freq), datetime.datetime
+                    .strptime(day, "%Y-%m-%d").date()))
+
+
+def main(mode, cache_path, entries_path=None):
+    if mode == "pickle":
+        with open(cache_path, "wb") as cache_file:
+            cPickle.dump(dict(read_entries(entries_path)), cache_file)
+        return
+    cache = WebCache(cache_path)
+    if mode == "load":
+        cache.update(read_entries(entries_path))
+    else:
+        for (term, (freq, day)) in cache.iteritems():
+            print(term.encode("utf-8"), freq, day.isoformat())
+    cache.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != (3 if sys.argv[1:2] == ["dump"] else 4) \
+            or sys.argv[1] not in ("load", "pickle", "dump"):
+        sys.exit(__doc__)
+    main(*sys.argv[1:])
@@ -0,0 +1,78 @@
+#!/usr/bin/python
+# -*- coding:UTF-8 -*-
+"""
+    Stand-in for the search service of counter.py -u, used by testAll.sh.
+
+    Usage: web-server.py <port-file> <log-file> [<term-to-fail>...]
+
+    Listens on a free local port, which is written to <port-file> once the
+    server is ready. Each query is answered with a frequency computed from
+    its term, in the XML format of the Google University Research Program,
+    and logged to <log-file> as a line "<term> <status> <seconds>", where
+    <seconds> is the time elapsed since the previous query of the same term
+    (rounded down), or "-" for its first query. The terms given as
+    arguments are answered with "503 Service Unavailable" twice before
+    being answered normally. The server stops by itself after
+    LIFETIME seconds, in case the test fails before stopping it.
+"""
+
+from __future__ import print_function
+
+import BaseHTTPServer
+import os
+import SocketServer
+import sys
+import threading
+import time
+import urlparse
+
+FAILURES_PER_TERM = 2
+LIFETIME = 300
+
+port_path = sys.argv[1]
+log_path = sys.argv[2]
+failing_terms = set(arg.decode("utf-8") for arg in sys.argv[3:])
+
+lock = threading.Lock()
+last_query_times = {}  # term -> time of its previous query
+n_failures = {}  # term -> number of failures sent
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        query = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        term = query["q"][0].decode("utf-8").strip('"')
+        with lock:
+            now = time.time()
+            previous = last_query_times.get(term)
+            last_query_times[term] = now
+            elapsed = "-" if previous is None else str(int(now - previous))
+            status = 200
+            if term in failing_terms \
+                    and n_failures.get(term, 0) < FAILURES_PER_TERM:
+                n_failures[term] = n_failures.get(term, 0) + 1
+                status = 503
+            with open(log_path, "a") as log:
+                log.write(("%s %d %s\n" % (term, status, elapsed))
+                          .encode("utf-8"))
+        self.send_response(status)
+        self.end_headers()
+        if status == 200:
+            freq = sum(ord(char) for char in term)
+            self.wfile.write(b"<GSP><RES><M>%d</M></RES></GSP>" % freq)
+
+    def log_message(self, format, *args):
+        pass  # Requests are logged to the log file only
+
+
+class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+threading.Timer(LIFETIME, os._exit, (0,)).start()
+server = Server(("127.0.0.1", 0), Handler)
+with open(port_path + ".tmp", "w") as port_file:
+    port_file.write("%d\n" % server.server_address[1])
+os.rename(port_path + ".tmp", port_path)
+server.serve_forever()